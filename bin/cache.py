@@ -0,0 +1,591 @@
+#!/usr/bin/env python3
+# Persistent caches in the tmpdir, stored as sqlite databases,
+# compressed storage of cached files, and the garbage collection of the tmpdir.
+import errno
+import gzip
+import hashlib
+import json
+import os
+import secrets
+import shutil
+import sqlite3
+import threading
+import time
+
+from contextlib import closing, contextmanager
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+try:
+    import zstandard
+
+    has_zstandard = True
+except ImportError:
+    has_zstandard = False
+
+
+# A persistent map from string keys to json-serializable dicts.
+# All entries are read at once when the manifest is opened. Changes are only kept in memory
+# and written back in a single transaction by flush(), so that a run touching thousands of
+# entries only does a constant number of database operations.
+# Entries are returned as copies; use set/update to modify them.
+# Each row records when it was last used, so that the garbage collection can drop unused rows.
+class Manifest:
+    def __init__(self, path: Path, table='entries'):
+        self.path = path
+        self.table = table
+        self._lock = threading.Lock()
+        self._entries = dict()
+        self._dirty = set()
+        # Keys that were read or written, whose time of use is updated by flush().
+        self._used = set()
+        self._load()
+
+    def _connect(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        connection = sqlite3.connect(self.path, timeout=60)
+        connection.execute(
+            f'CREATE TABLE IF NOT EXISTS {self.table}'
+            ' (key TEXT PRIMARY KEY, value TEXT NOT NULL, used REAL NOT NULL DEFAULT 0)'
+        )
+        columns = [row[1] for row in connection.execute(f'PRAGMA table_info({self.table})')]
+        if 'used' not in columns:
+            # Written by an older version. Its rows count as unused.
+            connection.execute(f'ALTER TABLE {self.table} ADD COLUMN used REAL NOT NULL DEFAULT 0')
+        return connection
+
+    def _load(self):
+        if not self.path.is_file():
+            return
+        try:
+            with closing(self._connect()) as connection:
+                rows = connection.execute(f'SELECT key, value FROM {self.table}').fetchall()
+        except sqlite3.DatabaseError:
+            # A corrupt manifest only means that everything is out of date.
+            self.path.unlink()
+            return
+        for key, value in rows:
+            try:
+                self._entries[key] = json.loads(value)
+            except json.JSONDecodeError:
+                pass
+
+    def __contains__(self, key):
+        with self._lock:
+            self._used.add(key)
+            return key in self._entries
+
+    def get(self, key, default=None):
+        with self._lock:
+            self._used.add(key)
+            if key not in self._entries:
+                return default
+            return json.loads(json.dumps(self._entries[key]))
+
+    # Replace the entry for key. Only entries that changed are written by flush().
+    def set(self, key, value: dict):
+        value = json.loads(json.dumps(value))
+        with self._lock:
+            self._used.add(key)
+            if self._entries.get(key) == value:
+                return
+            self._entries[key] = value
+            self._dirty.add(key)
+
+    # Update some fields of the entry for key, creating it when needed.
+    def update(self, key, **fields):
+        fields = json.loads(json.dumps(fields))
+        with self._lock:
+            self._used.add(key)
+            entry = self._entries.get(key)
+            if entry is not None and all(
+                name in entry and entry[name] == value for name, value in fields.items()
+            ):
+                return
+            self._entries.setdefault(key, dict()).update(fields)
+            self._dirty.add(key)
+
+    def remove(self, key):
+        with self._lock:
+            if key in self._entries:
+                del self._entries[key]
+                self._dirty.add(key)
+
+    def keys(self):
+        with self._lock:
+            return list(self._entries.keys())
+
+    # Write all changed entries, and the time of use of all used entries, in a single transaction.
+    def flush(self):
+        now = time.time()
+        with self._lock:
+            if not self._dirty and not self._used:
+                return
+            changed = [
+                (key, json.dumps(self._entries[key]), now)
+                for key in self._dirty
+                if key in self._entries
+            ]
+            removed = [(key,) for key in self._dirty if key not in self._entries]
+            used = [
+                (now, key) for key in self._used if key in self._entries and key not in self._dirty
+            ]
+            self._dirty = set()
+            self._used = set()
+        with closing(self._connect()) as connection:
+            with connection:
+                connection.executemany(
+                    f'INSERT OR REPLACE INTO {self.table} (key, value, used) VALUES (?, ?, ?)',
+                    changed,
+                )
+                connection.executemany(f'DELETE FROM {self.table} WHERE key = ?', removed)
+                connection.executemany(f'UPDATE {self.table} SET used = ? WHERE key = ?', used)
+
+
+# A persistent map from file paths to the hash of their content.
+# A file is only hashed again when its size, modification time, or inode changed.
+class FileHashes(Manifest):
+    def __init__(self, path: Path):
+        super().__init__(path, table='file_hashes')
+
+    def hash(self, path: Path):
+        key = str(path.absolute())
+        stat = path.stat()
+        signature = [stat.st_mtime_ns, stat.st_size, stat.st_ino]
+        entry = self.get(key)
+        if entry is not None and entry.get('stat') == signature:
+            return entry['hash']
+        # util imports config, which imports util again, so cache can not import util at the
+        # top level: that breaks whenever cache is imported before config.
+        from util import hash_file_content
+
+        file_hash = hash_file_content(path)
+        self.set(key, {'stat': signature, 'hash': file_hash})
+        return file_hash
+
+
+# Cached files can be stored compressed, as <name>.zst when the zstandard library is available
+# and as <name>.gz otherwise, see `generate --compress-cache`. Both are read, so that a cache
+# stays usable when zstandard is installed or removed.
+COMPRESSED_SUFFIXES = ['.zst', '.gz']
+
+
+# The compressed version of path, or None if it does not exist.
+def compressed_path(path: Path):
+    for suffix in COMPRESSED_SUFFIXES:
+        compressed = path.with_name(path.name + suffix)
+        if compressed.is_file():
+            return compressed
+    return None
+
+
+# Whether path exists, either as is or compressed.
+def is_stored(path: Path):
+    return path.is_file() or compressed_path(path) is not None
+
+
+# Write the content of the file source compressed to target, which is replaced atomically.
+def compress_to(source: Path, target: Path):
+    tmp = target.with_name(f'{target.name}.{secrets.token_hex(4)}')
+    with source.open('rb') as src:
+        if has_zstandard:
+            with tmp.open('wb') as dst:
+                zstandard.ZstdCompressor().copy_stream(src, dst)
+        else:
+            with gzip.open(tmp, 'wb', compresslevel=6) as dst:
+                shutil.copyfileobj(src, dst, 1 << 20)
+    tmp.replace(target)
+
+
+# Replace path by a compressed version.
+def compress_file(path: Path):
+    compress_to(path, path.with_name(path.name + ('.zst' if has_zstandard else '.gz')))
+    path.unlink()
+
+
+# Open the compressed file for reading, decompressing it as a stream.
+def open_decompressed(compressed: Path):
+    if compressed.suffix == '.gz':
+        return gzip.open(compressed, 'rb')
+    assert compressed.suffix == '.zst'
+    if not has_zstandard:
+        raise RuntimeError(f'{compressed} can only be read with the zstandard python library.')
+    return zstandard.ZstdDecompressor().stream_reader(compressed.open('rb'), closefd=True)
+
+
+# Open path for reading, or its compressed version, decompressing it as a stream.
+def open_stored(path: Path):
+    if path.is_file():
+        return path.open('rb')
+    compressed = compressed_path(path)
+    if compressed is None:
+        raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), str(path))
+    return open_decompressed(compressed)
+
+
+# Write the decompressed content of path to target, which defaults to path itself.
+# The compressed file is removed when it is decompressed in place.
+def decompress_file(path: Path, target: Path = None):
+    compressed = compressed_path(path)
+    assert compressed is not None
+    target = target or path
+    tmp = target.with_name(f'{target.name}.{secrets.token_hex(4)}')
+    with open_decompressed(compressed) as src, tmp.open('wb') as dst:
+        shutil.copyfileobj(src, dst, 1 << 20)
+    tmp.replace(target)
+    if target == path:
+        compressed.unlink()
+
+
+# Decompress all compressed files in a directory in place.
+def decompress_dir(directory: Path):
+    for suffix in COMPRESSED_SUFFIXES:
+        for compressed in directory.glob('*' + suffix):
+            path = compressed.with_suffix('')
+            if not path.is_file():
+                decompress_file(path)
+            else:
+                compressed.unlink()
+
+
+# The hash of the content of path, also when it is stored compressed. Equal to hash_file_content.
+def hash_stored(path: Path, buffer_size=1 << 20):
+    sha = hashlib.sha512(usedforsecurity=False)
+    with open_stored(path) as f:
+        while data := f.read(buffer_size):
+            sha.update(data)
+    return sha.hexdigest()
+
+
+# The content of path, or of its compressed version, to pass as stdin to a process, e.g. in
+# Submission.run and InputValidator.run. Plain files are passed as is. Compressed files are
+# decompressed by a thread writing into a pipe, so that they never exist uncompressed on disk.
+@contextmanager
+def open_stdin(path: Path):
+    if path.is_file() or compressed_path(path) is None:
+        with path.open('rb') as f:
+            yield f
+        return
+
+    src = open_decompressed(compressed_path(path))
+    read_fd, write_fd = os.pipe()
+
+    def write():
+        try:
+            with src, open(write_fd, 'wb') as dst:
+                shutil.copyfileobj(src, dst, 1 << 16)
+        except OSError:
+            # The process exited or was killed before it read all of its input.
+            pass
+
+    writer = threading.Thread(target=write, daemon=True)
+    writer.start()
+    stdin = open(read_fd, 'rb')
+    try:
+        yield stdin
+    finally:
+        # Closing the read end makes the writer fail with a broken pipe if it is still writing.
+        stdin.close()
+        writer.join()
+
+
+# Mark a directory in the tmpdir as used, so that the garbage collection evicts it last.
+def touch(path: Path):
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+
+# The depth below ~tmp/<problem>/<kind>/ of the directories that are evicted as a whole.
+# E.g. ~tmp/<problem>/runs/<verdict>/<submission>/ and ~tmp/<problem>/data/<hash>/.
+# Files directly inside these directories, like manifest.sqlite, are never evicted. Instead, the
+# rows of these databases are dropped, see _prune_database.
+GC_ENTRY_DEPTH = {'runs': 2, 'submissions': 2, 'tool_runs': 2}
+
+# Automatic garbage collection at the end of a command runs at most once per interval.
+GC_INTERVAL = 10 * 60
+
+
+def _gc_entries(tmpdir: Path):
+    def entries(path, depth):
+        for child in path.iterdir():
+            if child.is_symlink() or not child.is_dir():
+                continue
+            if depth == 1:
+                yield child
+            else:
+                yield from entries(child, depth - 1)
+
+    for level_dir in tmpdir.iterdir():
+        if level_dir.is_symlink() or not level_dir.is_dir():
+            continue
+        for kind in level_dir.iterdir():
+            if kind.is_symlink() or not kind.is_dir():
+                continue
+            yield from entries(kind, GC_ENTRY_DEPTH.get(kind.name, 1))
+
+
+# Tables with a row for each directory next to the database, like the manifest of generated
+# testcases, data/manifest.sqlite, with a row for each data/<hash>/. Rows of evicted directories are
+# dropped.
+GC_DIRECTORY_TABLES = ['entries']
+# Tables that are never pruned: `deployed` tracks the files in data/ until they are removed.
+GC_KEEP_TABLES = ['deployed']
+
+
+# The sqlite databases of the tmpdir, e.g. ~tmp/<problem>/cache.sqlite and
+# ~tmp/<problem>/data/manifest.sqlite.
+def _gc_databases(tmpdir: Path):
+    def databases(path, depth):
+        for child in path.iterdir():
+            if child.is_symlink():
+                continue
+            if child.suffix == '.sqlite' and child.is_file():
+                yield child
+            elif depth > 0 and child.is_dir():
+                yield from databases(child, depth - 1)
+
+    yield from databases(tmpdir, 2)
+
+
+# Drop the rows of a table that are no longer needed, and return their number.
+def _prune_table(connection, directory: Path, table, cutoff):
+    if table in GC_KEEP_TABLES:
+        return 0
+    if table in GC_DIRECTORY_TABLES:
+        evicted = [
+            (key,)
+            for (key,) in connection.execute(f'SELECT key FROM {table}')
+            if not (directory / key).is_dir()
+        ]
+        return connection.executemany(f'DELETE FROM {table} WHERE key = ?', evicted).rowcount
+    if cutoff is None:
+        return 0
+    columns = [row[1] for row in connection.execute(f'PRAGMA table_info({table})')]
+    if 'used' not in columns:
+        # Written by an older version, so not used since.
+        return connection.execute(f'DELETE FROM {table}').rowcount
+    return connection.execute(f'DELETE FROM {table} WHERE used < ?', (cutoff,)).rowcount
+
+
+# Drop the rows of a database (see Manifest) that are no longer needed: the rows of directory
+# tables whose directory was evicted, and, when `cutoff` is set, the rows of other tables that were
+# last used before it. Returns the number of bytes freed.
+def _prune_database(path: Path, cutoff):
+    size = path.stat().st_size
+    try:
+        with closing(sqlite3.connect(path, timeout=60)) as connection:
+            with connection:
+                tables = connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+                removed = sum(
+                    _prune_table(connection, path.parent, table, cutoff)
+                    for (table,) in tables.fetchall()
+                )
+            if removed:
+                connection.execute('VACUUM')
+    except sqlite3.DatabaseError:
+        return 0
+    return max(size - path.stat().st_size, 0)
+
+
+# The disk usage of a directory, without following symlinks, as a pair of the number of bytes
+# that removing it frees, and a dict from the inodes of its files to their size.
+# Files that are hardlinked from outside the directory (e.g. into data/) are not freed.
+def _disk_usage(path: Path):
+    inodes = dict()
+    # The number of links to each inode found in the directory, and its total number of links.
+    links = dict()
+    for root, dirs, files in os.walk(path):
+        for f in files:
+            try:
+                stat = os.lstat(os.path.join(root, f))
+            except OSError:
+                continue
+            inode = (stat.st_dev, stat.st_ino)
+            inodes[inode] = stat.st_size
+            found, _ = links.get(inode, (0, 0))
+            links[inode] = (found + 1, stat.st_nlink)
+    freeable = sum(size for inode, size in inodes.items() if links[inode][0] >= links[inode][1])
+    return freeable, inodes
+
+
+# Every command holds a shared lock on the tmpdir while it runs. The garbage collection only
+# evicts while holding it exclusively, so that it never removes directories that a concurrent
+# command may be using, even when that command touched them before this one started.
+_tmpdir_lock = None
+
+
+def lock_tmpdir(tmpdir: Path):
+    global _tmpdir_lock
+    if fcntl is None or _tmpdir_lock is not None:
+        return
+    tmpdir.mkdir(parents=True, exist_ok=True)
+    _tmpdir_lock = (tmpdir / 'gc.lock').open('a')
+    fcntl.flock(_tmpdir_lock.fileno(), fcntl.LOCK_SH)
+
+
+@contextmanager
+def _exclusive_tmpdir_lock(tmpdir: Path):
+    if fcntl is None:
+        yield True
+        return
+    f = _tmpdir_lock if _tmpdir_lock is not None else (tmpdir / 'gc.lock').open('a')
+    try:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        # Converting a lock is not atomic: the shared lock may be lost when this fails.
+        if f is _tmpdir_lock:
+            fcntl.flock(f.fileno(), fcntl.LOCK_SH)
+        else:
+            f.close()
+        yield False
+        return
+    try:
+        yield True
+    finally:
+        if f is _tmpdir_lock:
+            fcntl.flock(f.fileno(), fcntl.LOCK_SH)
+        else:
+            f.close()
+
+
+# The builds in the shared build directory (see program.Program.shared_tmpdir) are used by all
+# contests, so the tmpdir lock does not protect them. Instead, every command holds a shared lock on
+# <build>.lock for each build that it uses, until it exits. A build is only compiled again (e.g.
+# with --force-build) or evicted while its lock can be taken exclusively.
+# The flock is shared by all threads of this command, so `mutex` serializes using it.
+class BuildLock:
+    _locks = dict()
+    _locks_lock = threading.Lock()
+
+    # The lock of the build with the given lock file, shared by all programs of this command.
+    @staticmethod
+    def get(path: Path):
+        with BuildLock._locks_lock:
+            if path not in BuildLock._locks:
+                BuildLock._locks[path] = BuildLock(path)
+            return BuildLock._locks[path]
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.mutex = threading.Lock()
+        # Whether this command built it successfully.
+        self.built = False
+        self._file = None
+
+    def _flock(self, operation):
+        if self._file is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._file = self.path.open('a')
+        try:
+            fcntl.flock(self._file.fileno(), operation)
+        except BlockingIOError:
+            return False
+        return True
+
+    # Returns False when another command is using the build.
+    def try_exclusive(self):
+        return fcntl is None or self._flock(fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+    def exclusive(self):
+        if fcntl is not None:
+            self._flock(fcntl.LOCK_EX)
+
+    def shared(self):
+        if fcntl is not None:
+            self._flock(fcntl.LOCK_SH)
+
+    def release(self):
+        self.built = False
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+# The builds in the shared build directory, which are evicted as a whole.
+def _shared_gc_entries(shared_dir: Path):
+    for kind in shared_dir.iterdir():
+        if kind.is_symlink() or not kind.is_dir():
+            continue
+        for child in kind.iterdir():
+            if not child.is_symlink() and child.is_dir():
+                yield child
+
+
+# Remove a build from the shared build directory, unless a command is using it.
+def _evict_shared(entry: Path):
+    if fcntl is None:
+        shutil.rmtree(entry, ignore_errors=True)
+        return True
+    # A new file description, so that this conflicts with the locks of this command as well.
+    with entry.with_suffix('.lock').open('a') as f:
+        try:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+        shutil.rmtree(entry, ignore_errors=True)
+        return True
+
+
+# Evict the least recently used directories of the tmpdir and the shared build directory, until
+# they are at most `budget` bytes together, including the sqlite databases in the tmpdir.
+# Directories used since `keep_since` are never evicted. The rows of the databases that belong
+# to evicted directories, or that were not used since the evicted directories, are dropped.
+# When `auto` is set, this does nothing if the last garbage collection was recent.
+# Returns the number of bytes freed, or None when another command is using the tmpdir.
+def collect_garbage(tmpdir: Path, budget: int, keep_since: float, auto=False, shared_dir=None):
+    stamp = tmpdir / 'gc_stamp'
+    if auto and stamp.is_file() and stamp.stat().st_mtime > time.time() - GC_INTERVAL:
+        return 0
+
+    with _exclusive_tmpdir_lock(tmpdir) as locked:
+        if not locked:
+            return None
+        stamp.touch()
+
+        entries = []
+        # Hardlinked files are counted once in the total.
+        inodes = dict()
+        candidates = [(entry, False) for entry in _gc_entries(tmpdir)]
+        if shared_dir is not None and shared_dir.is_dir():
+            candidates += [(entry, True) for entry in _shared_gc_entries(shared_dir)]
+        for entry, shared in candidates:
+            try:
+                last_used = entry.stat().st_mtime
+            except OSError:
+                continue
+            freeable, entry_inodes = _disk_usage(entry)
+            entries.append((last_used, freeable, entry, shared))
+            inodes.update(entry_inodes)
+        databases = list(_gc_databases(tmpdir))
+        for path in databases:
+            stat = path.stat()
+            inodes[(stat.st_dev, stat.st_ino)] = stat.st_size
+        total = sum(inodes.values())
+
+        freed = 0
+        # Rows of the databases that were last used before the evicted directories are dropped.
+        cutoff = None
+        for last_used, size, entry, shared in sorted(entries, key=lambda e: e[0]):
+            if total - freed <= budget:
+                break
+            if last_used >= keep_since or size == 0:
+                continue
+            if shared:
+                if not _evict_shared(entry):
+                    continue
+            else:
+                shutil.rmtree(entry, ignore_errors=True)
+            freed += size
+            cutoff = last_used
+        if total - freed > budget:
+            # Still over budget, so only rows used since `keep_since` are kept.
+            cutoff = keep_since
+        for path in databases:
+            freed += _prune_database(path, cutoff)
+        return freed
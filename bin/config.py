@@ -48,18 +48,26 @@ KNOWN_TESTCASE_EXTENSIONS = [
     '.out',
 ]
 
-KNOWN_DATA_EXTENSIONS = KNOWN_TESTCASE_EXTENSIONS + [
-    '.interaction',
-    '.hint',
-    '.desc',
+# The files written by visualizers.
+KNOWN_VISUALIZER_EXTENSIONS = [
     '.png',
     '.jpg',
     '.svg',
     '.pdf',
-    #'.args',
-    #'.files', # this is actually a folder
 ]
 
+KNOWN_DATA_EXTENSIONS = (
+    KNOWN_TESTCASE_EXTENSIONS
+    + [
+        '.interaction',
+        '.hint',
+        '.desc',
+        #'.args',
+        #'.files', # this is actually a folder
+    ]
+    + KNOWN_VISUALIZER_EXTENSIONS
+)
+
 KNOWN_TEXT_DATA_EXTENSIONS = KNOWN_TESTCASE_EXTENSIONS + [
     '.interaction',
     '.hint',
@@ -105,7 +113,7 @@ grep '^  [^ ]' | sed 's/^  //' | cut -d ' ' -f 1 | sed -E 's/,//;s/^-?-?//;s/-/_
 grep -Ev '^(h|jobs|time|verbose)$' | sed "s/^/'/;s/$/',/" | tr '\n' ' ' | sed 's/^/args_list = [/;s/, $/]\n/'
 """
 # fmt: off
-args_list = ['1', 'add', 'all', 'answer', 'api', 'author', 'check_deterministic', 'clean', 'colors', 'contest', 'contest_id', 'contestname', 'cp', 'default_solution', 'depth', 'directory', 'error', 'force', 'force_build', 'input', 'interaction', 'interactive', 'invalid', 'kattis', 'language', 'memory', 'move_to', 'no_bar', 'no_generate', 'no_solution', 'no_solutions', 'no_testcase_sanity_checks', 'no_timelimit', 'no_validators', 'no_visualizer', 'open', 'order', 'order_from_ccs', 'overview', 'password', 'post_freeze', 'problem', 'problemname', 'remove', 'samples', 'sanitizer', 'skel', 'skip', 'submissions', 'table', 'testcases', 'timelimit', 'timeout', 'token', 'tree', 'username', 'validation', 'watch', 'web']
+args_list = ['1', 'add', 'all', 'answer', 'api', 'author', 'batch_validation', 'check_deterministic', 'clean', 'colors', 'compress_cache', 'contest', 'contest_id', 'contestname', 'cp', 'default_solution', 'depth', 'directory', 'error', 'export_cache', 'force', 'force_build', 'gc', 'import_cache', 'input', 'interaction', 'interactive', 'invalid', 'kattis', 'language', 'memory', 'move_to', 'no_bar', 'no_generate', 'no_solution', 'no_solutions', 'no_testcase_sanity_checks', 'no_timelimit', 'no_validators', 'no_visualizer', 'open', 'order', 'order_from_ccs', 'overview', 'password', 'post_freeze', 'problem', 'problemname', 'profile', 'remove', 'revalidate', 'samples', 'sanitizer', 'shard', 'skel', 'skip', 'solution_jobs', 'submissions', 'table', 'testcases', 'timelimit', 'timeout', 'tmp_budget', 'token', 'tree', 'username', 'validation', 'watch', 'web']
 # fmt: on
 
 
@@ -140,6 +148,17 @@ def get_timeout():
     return args.timeout or DEFAULT_TIMEOUT
 
 
+# The default size budget of the tmpdir in MiB for `bt tmp --gc`.
+DEFAULT_TMP_BUDGET = 4096
+
+# Cached testcase files of at least this many bytes are compressed by `bt generate --compress-cache`.
+COMPRESS_CACHE_THRESHOLD = 1024 * 1024
+
+
+def get_tmp_budget():
+    return (args.tmp_budget or DEFAULT_TMP_BUDGET) * 1024 * 1024
+
+
 # Randomly generated uuid4 for BAPCtools
 BAPC_UUID = '8ee7605a-d1ce-47b3-be37-15de5acd757e'
 BAPC_UUID_PREFIX = 8
@@ -5,7 +5,10 @@ import os
 import yaml
 import os.path
 import re
+import shutil
+import struct
 import zipfile
+import cache
 import config
 import util
 import base64
@@ -57,6 +60,159 @@ def remove_language_suffix(fname, statement_language):
     return out
 
 
+# Writes a zip file, copying the compressed data of unchanged entries from the previous version
+# of the zip instead of compressing them again.
+# For each entry the content hash of its source, and the CRC and size of the written entry are
+# recorded in a manifest. An entry is reused when the content hash of the source is unchanged and
+# the old zip still contains an entry with the recorded CRC and size.
+# Content hashes are only recomputed for files whose stat changed.
+#
+# Copying an entry depends on internals of zipfile that are not part of its public API: the
+# attributes of ZipFile listed in ZIPFILE_INTERNALS, ZipInfo.FileHeader, and sizeFileHeader.
+# When these are missing or copying fails, the entry is compressed again instead. Before copying,
+# the local header of the old entry is checked against its entry in the central directory, so
+# that only the copied entries are read, without decompressing them.
+class IncrementalZip:
+    ZIPFILE_INTERNALS = ['fp', 'filelist', 'NameToInfo', 'start_dir', '_didModify']
+
+    def __init__(self, output: Path, file_hashes: cache.FileHashes, manifest: cache.Manifest):
+        self.output = output
+        self.file_hashes = file_hashes
+        self.manifest = manifest
+        self.tmp_output = output.with_name(output.name + '.tmp')
+        self.old_zip = None
+        self.old_file = None
+        if output.is_file():
+            try:
+                self.old_zip = zipfile.ZipFile(output)
+                self.old_file = output.open('rb')
+            except zipfile.BadZipFile:
+                self.old_zip = None
+        self.zf = zipfile.ZipFile(
+            self.tmp_output, mode="w", compression=zipfile.ZIP_DEFLATED, allowZip64=False
+        )
+        self.can_copy = (
+            hasattr(zipfile, 'sizeFileHeader')
+            and hasattr(zipfile.ZipInfo, 'FileHeader')
+            and all(hasattr(self.zf, name) for name in IncrementalZip.ZIPFILE_INTERNALS)
+        )
+        self.reused = 0
+        self.compressed = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.zf.close()
+        if self.old_zip is not None:
+            self.old_zip.close()
+            self.old_file.close()
+        if exc_type is None:
+            self.tmp_output.replace(self.output)
+            self.manifest.flush()
+            self.file_hashes.flush()
+        else:
+            self.tmp_output.unlink(missing_ok=True)
+
+    def write(self, source: Path, target):
+        target = str(target)
+        # Nested zips are already compressed.
+        compress_type = zipfile.ZIP_STORED if source.suffix == '.zip' else zipfile.ZIP_DEFLATED
+        key = f'{self.output.absolute()}:{target}'
+        file_hash = self.file_hashes.hash(source)
+
+        entry = self.manifest.get(key)
+        if (
+            self.can_copy
+            and entry is not None
+            and entry['hash'] == file_hash
+            and self.old_zip is not None
+        ):
+            try:
+                old = self.old_zip.getinfo(target)
+            except KeyError:
+                old = None
+            if (
+                old is not None
+                and old.CRC == entry['crc']
+                and old.file_size == entry['size']
+                and old.compress_type == compress_type
+            ):
+                if self._copy_entry(old):
+                    self.reused += 1
+                    return
+
+        self.zf.write(source, target, compress_type=compress_type)
+        zinfo = self.zf.getinfo(target)
+        self.manifest.set(key, {'hash': file_hash, 'crc': zinfo.CRC, 'size': zinfo.file_size})
+        self.compressed += 1
+
+    # Copy the compressed data of an entry of the old zip, without decompressing it.
+    # Returns False when this fails, after removing the partially written entry.
+    def _copy_entry(self, old: zipfile.ZipInfo):
+        start = self.zf.fp.tell()
+        try:
+            zinfo = self._copy_entry_data(old)
+        except (AttributeError, TypeError, struct.error, zipfile.BadZipFile) as e:
+            util.log(f'Could not copy {old.filename} from {self.output}: {e}')
+            self.zf.fp.seek(start)
+            self.zf.fp.truncate()
+            # A broken entry only affects itself, but missing internals affect all entries.
+            if not isinstance(e, zipfile.BadZipFile):
+                self.can_copy = False
+            return False
+
+        # Register the entry like ZipFile.write does, so that it ends up in the central directory.
+        self.zf.filelist.append(zinfo)
+        self.zf.NameToInfo[zinfo.filename] = zinfo
+        self.zf.start_dir = self.zf.fp.tell()
+        self.zf._didModify = True
+        return True
+
+    def _copy_entry_data(self, old: zipfile.ZipInfo):
+        zinfo = zipfile.ZipInfo(old.filename, old.date_time)
+        zinfo.compress_type = old.compress_type
+        zinfo.external_attr = old.external_attr
+        zinfo.CRC = old.CRC
+        zinfo.compress_size = old.compress_size
+        zinfo.file_size = old.file_size
+
+        # Check the local file header of the old entry against the central directory, and skip it.
+        self.old_file.seek(old.header_offset)
+        header = self.old_file.read(zipfile.sizeFileHeader)
+        if len(header) != zipfile.sizeFileHeader or header[0:4] != b'PK\x03\x04':
+            raise zipfile.BadZipFile(f'Bad local header of {old.filename} in {self.output}')
+        flags, compress_type = struct.unpack('<HH', header[6:10])
+        crc, compress_size, file_size, name_length, extra_length = struct.unpack(
+            '<LLLHH', header[14:30]
+        )
+        name = self.old_file.read(name_length).decode(
+            'utf-8' if flags & 0x800 else 'cp437', errors='replace'
+        )
+        # With a data descriptor (flag 0x08), the CRC and sizes follow the data instead.
+        if (
+            name != old.orig_filename
+            or compress_type != old.compress_type
+            or (
+                not flags & 0x08
+                and (crc, compress_size, file_size) != (old.CRC, old.compress_size, old.file_size)
+            )
+        ):
+            raise zipfile.BadZipFile(f'Mismatching local header of {old.filename} in {self.output}')
+        self.old_file.seek(extra_length, os.SEEK_CUR)
+
+        zinfo.header_offset = self.zf.fp.tell()
+        self.zf.fp.write(zinfo.FileHeader(False))
+        remaining = old.compress_size
+        while remaining > 0:
+            data = self.old_file.read(min(remaining, 1 << 20))
+            if not data:
+                raise zipfile.BadZipFile(f'Truncated entry {old.filename} in {self.output}')
+            self.zf.fp.write(data)
+            remaining -= len(data)
+        return zinfo
+
+
 def build_samples_zip(problems, output, statement_language):
     zf = zipfile.ZipFile(output, mode="w", compression=zipfile.ZIP_DEFLATED, allowZip64=False)
 
@@ -213,19 +369,18 @@ def build_problem_zip(problem, output):
     revert_problem_yaml_name = fix_problem_yaml_name(problem)
 
     try:
-        zf = zipfile.ZipFile(output, mode="w", compression=zipfile.ZIP_DEFLATED, allowZip64=False)
-
-        for fname in sorted(copyfiles):
-            source = fname
-            target = fname
-            if isinstance(fname, tuple):
-                source = fname[0]
-                target = fname[1]
-            zf.write(source, target, compress_type=zipfile.ZIP_DEFLATED)
+        manifest = cache.Manifest(problem.tmpdir / 'cache.sqlite', table='zip_entries')
+        with IncrementalZip(output, problem.file_hashes(), manifest) as zf:
+            for fname in sorted(copyfiles):
+                source = fname
+                target = fname
+                if isinstance(fname, tuple):
+                    source = fname[0]
+                    target = fname[1]
+                zf.write(source, target)
 
         # Done.
-        zf.close()
-        print("done", file=sys.stderr)
+        print(f"done (reused {zf.reused}, compressed {zf.compressed} files)", file=sys.stderr)
         print(file=sys.stderr)
 
     finally:
@@ -238,36 +393,34 @@ def build_problem_zip(problem, output):
 # contest*.{lang}.pdf
 # solutions*.{lang}.pdf
 # Output is <outfile>
-def build_contest_zip(problems, zipfiles, outfile, statement_language):
+def build_contest_zip(problems, zipfiles, outfile, statement_language, tmpdir):
     print("writing ZIP file %s" % outfile, file=sys.stderr)
 
     update_problems_yaml(problems)
 
-    zf = zipfile.ZipFile(outfile, mode="w", compression=zipfile.ZIP_DEFLATED, allowZip64=False)
-
-    for fname in zipfiles:
-        zf.write(fname, fname.name, compress_type=zipfile.ZIP_DEFLATED)
-
-    # For general zip export, also create pdfs and a samples zip.
-    if not config.args.kattis:
-        sampleout = Path('samples.zip')
-        build_samples_zip(problems, sampleout, statement_language)
-
-        for fname in (
-            [
-                'problems.yaml',
-                'contest.yaml',
-                sampleout,
-            ]
-            + list(Path('.').glob(f'contest*.{statement_language}.pdf'))
-            + list(Path('.').glob(f'solutions*.{statement_language}.pdf'))
-        ):
-            if Path(fname).is_file():
-                zf.write(
-                    fname,
-                    remove_language_suffix(fname, statement_language),
-                    compress_type=zipfile.ZIP_DEFLATED,
-                )
+    cache_path = tmpdir / 'cache.sqlite'
+    file_hashes = cache.FileHashes(cache_path)
+    manifest = cache.Manifest(cache_path, table='zip_entries')
+    with IncrementalZip(Path(outfile), file_hashes, manifest) as zf:
+        for fname in zipfiles:
+            zf.write(fname, fname.name)
+
+        # For general zip export, also create pdfs and a samples zip.
+        if not config.args.kattis:
+            sampleout = Path('samples.zip')
+            build_samples_zip(problems, sampleout, statement_language)
+
+            for fname in (
+                [
+                    'problems.yaml',
+                    'contest.yaml',
+                    sampleout,
+                ]
+                + list(Path('.').glob(f'contest*.{statement_language}.pdf'))
+                + list(Path('.').glob(f'solutions*.{statement_language}.pdf'))
+            ):
+                if Path(fname).is_file():
+                    zf.write(Path(fname), remove_language_suffix(fname, statement_language))
 
     # For Kattis export, delete the original zipfiles.
     if config.args.kattis:
@@ -277,8 +430,6 @@ def build_contest_zip(problems, zipfiles, outfile, statement_language):
     print("done", file=sys.stderr)
     print(file=sys.stderr)
 
-    zf.close()
-
 
 def update_contest_id(cid):
     if has_ryaml:
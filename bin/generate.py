@@ -1,21 +1,31 @@
 import hashlib
 import random
 import io
+import json
+import os
+import pickle
+import sys
 import re
 import shutil
 import yaml as yamllib
 import collections
+import contextlib
 import shutil
 import secrets
+import tarfile
+import threading
+import time
 
 from pathlib import Path, PurePosixPath, PurePath
 
+import cache
 import config
 import inspect
 import parallel
 import program
 import run
 import validate
+import watch
 from testcase import Testcase
 from verdicts import Verdict
 
@@ -40,6 +50,17 @@ def assert_type(name, obj, types, path=None):
     )
 
 
+# Messages printed while parsing generators.yaml are recorded, so that they can be shown again
+# when the parsed generators.yaml is loaded from the cache. See GeneratorConfig.
+_parse_messages = None
+
+
+def parse_message(*args, **kwargs):
+    if _parse_messages is not None:
+        _parse_messages.append((args, kwargs))
+    message(*args, **kwargs)
+
+
 def is_testcase(yaml):
     return (
         yaml == None
@@ -76,6 +97,10 @@ def resolve_path(path, *, allow_absolute, allow_relative):
     return Path('generators') / path
 
 
+# Map from (problem path, program path) to the shared (program path, absolute program path).
+_program_paths = dict()
+
+
 # An Invocation is a program with command line arguments to execute.
 # The following classes inherit from Invocation:
 # - GeneratorInvocation
@@ -103,7 +128,7 @@ class Invocation:
         )
 
         # NOTE: This is also used by `fuzz`.
-        self.uses_seed = self.SEED_REGEX.search(self.command_string)
+        self.uses_seed = self.SEED_REGEX.search(self.command_string) is not None
 
         # Make sure that {seed} occurs at most once.
         seed_cnt = 0
@@ -114,11 +139,30 @@ class Invocation:
 
         # Automatically set self.program when that program has been built.
         self.program = None
+        self._add_program_callback()
+
+    def _add_program_callback(self):
+        # Share the path objects between invocations of the same program.
+        key = (self.problem.path, self.program_path)
+        if key not in _program_paths:
+            _program_paths[key] = (self.program_path, self.problem.path / self.program_path)
+        self.program_path, path = _program_paths[key]
 
         def callback(program):
             self.program = program
 
-        program.Program.add_callback(problem, problem.path / self.program_path, callback)
+        program.Program.add_callback(self.problem, path, callback)
+
+    # Invocations are pickled as part of the cached generators.yaml, see GeneratorConfig.
+    # The program is only set after building, and the callback has to be registered again.
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['program'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._add_program_callback()
 
     # Return the form of the command used for caching.
     # This is independent of {name} and the actual run_command.
@@ -188,9 +232,12 @@ class VisualizerInvocation(Invocation):
 
     # Run the visualizer, taking {name} as a command line argument.
     # Stdin and stdout are not used.
-    def run(self, bar, cwd, name):
-        result = self.program.run(cwd, args=self._sub_args())
+    # Visualizers run in the background (see GeneratorConfig.visualize), so the result is only
+    # reported later by report().
+    def run(self, cwd):
+        return self.program.run(cwd, args=self._sub_args())
 
+    def report(self, bar, cwd, result):
         if result.status == ExecStatus.TIMEOUT:
             bar.debug(f'{Style.RESET_ALL}-> {shorten_path(self.problem, cwd)}')
             bar.error(f'Visualizer TIMEOUT after {result.duration}s')
@@ -200,19 +247,71 @@ class VisualizerInvocation(Invocation):
 
         if result.status and config.args.error and result.err:
             bar.log('stderr', result.err)
-        return result
 
 
 class SolutionInvocation(Invocation):
     def __init__(self, problem, string):
         super().__init__(problem, string, allow_absolute=True, allow_relative=False)
 
+    # The outputs of the solution are stored by the content of the input, so that rules that
+    # generate identical inputs only run the solution once:
+    #   tmpdir/answers/<hash of input, solution, arguments, and extra>/testcase.<ext>
+    # The input is hashed directly, since the file_hashes() cache would keep a row for every
+    # temporary path.
+    def _answer_dir(self, in_path, extra=None):
+        key = {
+            'solution': self.program.hash,
+            'args': ' '.join(self.args),
+            'in': hash_file_content(in_path),
+            'extra': extra,
+        }
+        return self.problem.tmpdir / 'answers' / combine_hashes_dict(key)
+
+    # Copy the stored outputs with the given extensions to cwd. Returns False when they are not
+    # all stored.
+    def _restore_answer(self, answer_dir, cwd, extensions):
+        sources = [answer_dir / ('testcase' + ext) for ext in extensions]
+        if not all(cache.is_stored(source) for source in sources):
+            return False
+        cache.touch(answer_dir)
+        for source in sources:
+            if source.is_file():
+                shutil.copyfile(source, cwd / source.name)
+            else:
+                cache.decompress_file(source, cwd / source.name)
+        return True
+
+    # Files are copied rather than linked, so that modifying a file in data/ in place can not
+    # change the stored output. Since they never share storage with data/, large outputs are
+    # stored compressed with `generate --compress-cache`.
+    def _store_answer(self, answer_dir, cwd, extensions):
+        answer_dir.mkdir(parents=True, exist_ok=True)
+        for ext in extensions:
+            source = cwd / ('testcase' + ext)
+            target = answer_dir / source.name
+            if (
+                config.args.compress_cache
+                and source.stat().st_size >= config.COMPRESS_CACHE_THRESHOLD
+            ):
+                cache.compress_to(
+                    source,
+                    target.with_name(target.name + ('.zst' if cache.has_zstandard else '.gz')),
+                )
+                continue
+            tmp = target.with_name(f'{target.name}.{secrets.token_hex(4)}')
+            shutil.copyfile(source, tmp)
+            tmp.replace(target)
+
     # Run the submission, reading testcase.in from stdin and piping stdout to testcase.ans.
     # If the .ans already exists, nothing is done
     def run(self, bar, cwd):
         in_path = cwd / 'testcase.in'
         ans_path = cwd / 'testcase.ans'
 
+        answer_dir = self._answer_dir(in_path)
+        if self._restore_answer(answer_dir, cwd, ['.ans']):
+            return ExecResult(None, ExecStatus.ACCEPTED, 0, False, None, None)
+
         # No {name}/{seed} substitution is done since all IO should be via stdin/stdout.
         result = self.program.run(in_path, ans_path, args=self.args, cwd=cwd, default_timeout=True)
 
@@ -225,6 +324,8 @@ class SolutionInvocation(Invocation):
 
         if result.status and config.args.error and result.err:
             bar.log('stderr', result.err)
+        if result.status:
+            self._store_answer(answer_dir, cwd, ['.ans'])
         return result
 
     def run_interaction(self, bar, cwd, t):
@@ -234,6 +335,20 @@ class SolutionInvocation(Invocation):
             return True
 
         testcase = Testcase(self.problem, in_path, short_path=(t.path.parent / (t.name + '.in')))
+
+        # The interaction also depends on the output validator and its flags.
+        output_validators = self.problem.validators(validate.OutputValidator)
+        extra = {
+            'output_validators': [str(v.hash) for v in output_validators],
+            'output_validator_flags': [
+                testcase.testdata_yaml_validator_flags(v, bar) for v in output_validators
+            ],
+            'validator_flags': self.problem.settings.validator_flags,
+        }
+        answer_dir = self._answer_dir(in_path, json.dumps(extra, sort_keys=True))
+        if self._restore_answer(answer_dir, cwd, ['.interaction']):
+            return True
+
         r = run.Run(self.problem, self.program, testcase)
 
         # No {name}/{seed} substitution is done since all IO should be via stdin/stdout.
@@ -242,6 +357,7 @@ class SolutionInvocation(Invocation):
             bar.error(ret.verdict)
             return False
 
+        self._store_answer(answer_dir, cwd, ['.interaction'])
         return True
 
 
@@ -314,6 +430,8 @@ KNOWN_TESTCASE_KEYS = [
     'visualizer',
     'random_salt',
     'retries',
+    'max_parallel',
+    'memory',
     'count',
 ] + [e[1:] for e in config.KNOWN_TEXT_DATA_EXTENSIONS]
 RESERVED_TESTCASE_KEYS = ['data', 'testdata.yaml', 'include']
@@ -326,9 +444,11 @@ KNOWN_DIRECTORY_KEYS = [
     'visualizer',
     'random_salt',
     'retries',
+    'max_parallel',
+    'memory',
 ]
 RESERVED_DIRECTORY_KEYS = ['command']
-KNOWN_ROOT_KEYS = ['generators', 'parallel']
+KNOWN_ROOT_KEYS = ['generators', 'batch_generators', 'parallel']
 DEPRECATED_ROOT_KEYS = ['gitignore_generated']
 
 
@@ -336,6 +456,9 @@ DEPRECATED_ROOT_KEYS = ['gitignore_generated']
 # - config.solution
 # - config.visualizer
 # - config.random_salt
+# - config.retries
+# - config.max_parallel
+# - config.memory
 class Config:
     # Used at each directory or testcase level.
 
@@ -357,6 +480,24 @@ class Config:
             return ''
         return x
 
+    # The limit is shared by all testcases below the directory that declares it, so it is
+    # stored together with the path of that directory.
+    def parse_max_parallel(p, x, path):
+        assert_type('Max_parallel', x, [type(None), int], path)
+        if x is None:
+            return None
+        if x < 1:
+            raise ParseException('max_parallel must be at least 1.', path)
+        return (str(path), x)
+
+    def parse_memory(p, x, path):
+        assert_type('Memory', x, [type(None), int], path)
+        if x is None:
+            return None
+        if x < 1:
+            raise ParseException('memory must be at least 1 MiB.', path)
+        return x
+
     INHERITABLE_KEYS = [
         # True: use an AC submission by default when the solution: key is not present.
         ('solution', True, parse_solution),
@@ -366,6 +507,12 @@ class Config:
         # The number of retries to run a generator when it fails, each time incrementing the {seed}
         # by 1.
         ('retries', 1, lambda p, x, path: int(x)),
+        # The maximum number of generators of the testcases in this directory that may run at the
+        # same time.
+        ('max_parallel', None, parse_max_parallel),
+        # The memory in MiB used by one run of the generator. Generators are only started when
+        # the total declared memory of the running generators fits in the physical memory.
+        ('memory', None, parse_memory),
     ]
 
     def __init__(self, problem, path, yaml=None, parent_config=None):
@@ -383,6 +530,10 @@ class Config:
 
 
 class Rule:
+    # Slots keep rules small, since `count:` can expand a generators.yaml into very many testcases.
+    # Subclasses without __slots__ (i.e. Directory) still get a __dict__.
+    __slots__ = ('parent', 'config', 'key', 'name', 'path')
+
     # key: the dictionary key in the yaml file, i.e. `testcase`
     # name: the numbered testcase name, i.e. `01-testcase`
     def __init__(self, problem, key, name, yaml, parent):
@@ -404,7 +555,30 @@ class Rule:
 
 
 class TestcaseRule(Rule):
-    def __init__(self, problem, generator_config, key, name: str, yaml, parent, count_index):
+    __slots__ = (
+        'parse_error',
+        'sample',
+        'generator',
+        'copy',
+        'hardcoded',
+        'hash',
+        'cache_data',
+        'rule',
+        'in_is_generated',
+        'count_index',
+        'intended_copy',
+        'copy_of',
+        'root',
+        'seed',
+        'generate_success',
+    )
+
+    # previous: the testcase for the previous count_index of the same `count:` rule, if any.
+    # Its generator is reused when it is identical. The config is parsed for each testcase, since
+    # it depends on the path of the testcase.
+    def __init__(
+        self, problem, generator_config, key, name: str, yaml, parent, count_index, previous=None
+    ):
         assert is_testcase(yaml)
 
         # if not None rule will be skipped during generation
@@ -441,7 +615,7 @@ class TestcaseRule(Rule):
         self.copy_of = None
 
         if name.endswith('.in'):
-            message(
+            parse_message(
                 "Testcase names should not end with '.in'",
                 'generators.yaml',
                 parent.path / name,
@@ -454,7 +628,7 @@ class TestcaseRule(Rule):
         # root in /data
         self.root = self.path.parts[0]
         if self.root == 'bad':
-            message(
+            parse_message(
                 'bad is deprecated. Use {invalid_inputs,invalid_answers} instead.',
                 self.path,
                 color_type=MessageType.WARN,
@@ -481,7 +655,7 @@ class TestcaseRule(Rule):
                 if isinstance(yaml, str):
                     yaml = {'generate': yaml}
                     if yaml['generate'].endswith('.in'):
-                        message(
+                        parse_message(
                             f"Use the new `copy: path/to/case` key instead of {yaml['generate']}.",
                             'generators.yaml',
                             self.path,
@@ -514,12 +688,19 @@ class TestcaseRule(Rule):
                                 '{count}', f'{self.count_index+1}'
                             )
                         else:
-                            message(
+                            parse_message(
                                 'Found {count} in generator command but no count in yaml. Ignored.',
                                 self.path,
                                 color_type=MessageType.WARN,
                             )
-                    self.generator = GeneratorInvocation(problem, command_string)
+                    if (
+                        previous is not None
+                        and previous.generator is not None
+                        and previous.generator.command_string == command_string
+                    ):
+                        self.generator = previous.generator
+                    else:
+                        self.generator = GeneratorInvocation(problem, command_string)
 
                     # TODO: Should the seed depend on white space? For now it does, but
                     # leading and trailing whitespace is stripped.
@@ -539,7 +720,7 @@ class TestcaseRule(Rule):
                 if 'copy' in yaml:
                     assert_type('`copy`', yaml['copy'], str)
                     if Path(yaml['copy']).suffix in config.KNOWN_TEXT_DATA_EXTENSIONS:
-                        message(
+                        parse_message(
                             f"`copy: {yaml['copy']}` should not include the extension.",
                             'generators.yaml',
                             self.path,
@@ -549,6 +730,8 @@ class TestcaseRule(Rule):
                         yaml['copy'], allow_absolute=False, allow_relative=True
                     )
                     self.copy = problem.path / self.copy.parent / (self.copy.name + '.in')
+                    for ext in config.KNOWN_TESTCASE_EXTENSIONS:
+                        generator_config.add_parse_dependency(self.copy.with_suffix(ext))
                     if self.copy.is_file():
                         self.in_is_generated = False
                     self.rule['copy'] = str(self.copy)
@@ -578,7 +761,7 @@ class TestcaseRule(Rule):
                     raise ParseException(f'Testcase must not contain reserved key {key}.')
                 if key not in KNOWN_TESTCASE_KEYS:
                     if config.args.action == 'generate':
-                        message(
+                        parse_message(
                             f'Unknown testcase level key: {key}',
                             'generators.yaml',
                             self.path,
@@ -638,7 +821,52 @@ class TestcaseRule(Rule):
                 # both source and target do not exist
                 pass
 
+    # Fill cache_data with the hashes and commands of everything the generated files depend on.
+    def update_cache_data(t):
+        if t.copy:
+            t.cache_data['source_hash'] = t.hash
+        for ext, string in t.hardcoded.items():
+            t.cache_data['hardcoded_' + ext[1:]] = hash_string(string)
+        if t.generator:
+            t.cache_data['generator_hash'] = t.generator.hash(seed=t.seed)
+            t.cache_data['generator'] = t.generator.cache_command(seed=t.seed)
+        if t.config.solution:
+            t.cache_data['solution_hash'] = t.config.solution.hash()
+            t.cache_data['solution'] = t.config.solution.cache_command()
+
+    # The visualizer invocation of the testcase. Visualizations are not part of cache_data, since
+    # they are made in the background after the testcase is generated, see GeneratorConfig.visualize.
+    def visualizer_data(t):
+        return {
+            'visualizer_hash': t.config.visualizer.hash(),
+            'visualizer': t.config.visualizer.cache_command(),
+        }
+
+    # Whether the files in the cache directory of this testcase exist and were generated with
+    # the current cache_data, as stored in the manifest entry meta_yaml.
+    def generated_files_up_to_date(t, problem, meta_yaml):
+        cwd = problem.tmpdir / 'data' / t.hash
+        infile = cwd / 'testcase.in'
+        ansfile = cwd / 'testcase.ans'
+        if not cache.is_stored(infile):
+            return False
+        if not cache.is_stored(ansfile):
+            return False
+        if (
+            (problem.interactive or problem.multipass)
+            and t.sample
+            and not cache.is_stored(ansfile.with_suffix('.interaction'))
+        ):
+            return False
+        return meta_yaml.get('cache_data') == t.cache_data
+
     def generate(t, problem, generator_config, parent_bar):
+        for _ in t.generate_stages(problem, generator_config, parent_bar):
+            pass
+
+    # Generate the testcase. This yields the stage (see GENERATE_STAGES) before each expensive
+    # step, so that GeneratorConfig can run the steps of different testcases in a pipeline.
+    def generate_stages(t, problem, generator_config, parent_bar):
         bar = parent_bar.start(str(t.path))
 
         t.generate_success = False
@@ -671,32 +899,54 @@ class TestcaseRule(Rule):
         # E.g. bapctmp/problem/data/<hash>.in
         cwd = problem.tmpdir / 'data' / t.hash
         cwd.mkdir(parents=True, exist_ok=True)
+        cache.touch(cwd)
         infile = cwd / 'testcase.in'
         ansfile = cwd / 'testcase.ans'
-        meta_path = cwd / 'meta_.yaml'
+        manifest = generator_config.manifest
 
-        # Returns False when some files were skipped.
-        def copy_generated():
-            all_done = True
+        # The content hashes of the generated files in the cache, keyed by extension.
+        def cached_file_hashes():
+            return {
+                ext: cache.hash_stored(infile.with_suffix(ext))
+                for ext in config.KNOWN_DATA_EXTENSIONS
+                if cache.is_stored(infile.with_suffix(ext))
+            }
 
-            for ext in config.KNOWN_DATA_EXTENSIONS:
+        # Copy the generated files with the given extensions to data/. Files are compared by their
+        # content hash, where the hash of the files in data/ is only recomputed when their stat
+        # changed since they were written.
+        def copy_generated(file_hashes, extensions=config.KNOWN_DATA_EXTENSIONS, bar=bar):
+            for ext in extensions:
                 source = infile.with_suffix(ext)
                 target = target_infile.with_suffix(ext)
 
-                if source.is_file():
+                if ext in file_hashes:
                     generator_config.known_files.add(target)
                     if target.is_file():
-                        if source.read_bytes() == target.read_bytes() and not target.is_symlink():
+                        if not target.is_symlink() and (
+                            generator_config.deployed_hash(target) == file_hashes[ext]
+                        ):
                             # identical -> skip
                             pass
+                        elif source.is_file() and target.samefile(source):
+                            # A hardlink to the cache was modified in place, so the cache is
+                            # modified as well. This is normally handled by
+                            # regenerate_modified_in_place, but duplicated rules share the cache of
+                            # the original rule.
+                            generator_config.remove(target)
+                            source.unlink()
+                            manifest.update(t.hash, cache_data=None)
+                            bar.warn(
+                                f'{target.name} was modified in place. Run generate again to restore it.'
+                            )
                         else:
                             # different -> overwrite
                             generator_config.remove(target)
-                            shutil.copy(source, target, follow_symlinks=True)
+                            generator_config.deploy(source, target, file_hashes[ext])
                             bar.log(f'CHANGED: {target.name}')
                     else:
                         # new file -> copy it
-                        shutil.copy(source, target, follow_symlinks=True)
+                        generator_config.deploy(source, target, file_hashes[ext])
                         bar.log(f'NEW: {target.name}')
                 elif target.is_file():
                     # Target exists but source wasn't generated -> remove it
@@ -705,7 +955,6 @@ class TestcaseRule(Rule):
                 else:
                     # both source and target do not exist
                     pass
-            return all_done
 
         if t.copy_of is not None:
             if t.intended_copy:
@@ -713,65 +962,58 @@ class TestcaseRule(Rule):
                 t.copy_of.link(problem, generator_config, bar, target_infile)
             else:
                 # This is a duplicated rule, we copy to show this
-                copy_generated()
+                file_hashes = (manifest.get(t.hash) or {}).get('files')
+                copy_generated(file_hashes or cached_file_hashes())
             t.generate_success = True
             bar.done(message='SKIPPED: up to date')
             return
 
         def init_meta():
-            meta_yaml = read_yaml(meta_path) if meta_path.is_file() else None
-            if meta_yaml is None:
+            meta_yaml = manifest.get(t.hash)
+            if not isinstance(meta_yaml, dict):
                 meta_yaml = {'validator_hashes': dict()}
-            meta_yaml['rule'] = t.rule
+            meta_yaml.setdefault('validator_hashes', dict())
+            # Only mark the entry as changed when needed, to keep no-op runs cheap.
+            if meta_yaml.get('rule') != t.rule:
+                meta_yaml['rule'] = t.rule
+                manifest.set(t.hash, meta_yaml)
             return meta_yaml
 
         meta_yaml = init_meta()
-        write_yaml(meta_yaml, meta_path.open('w'), allow_yamllib=True)
+
+        # Files in data/ can be hardlinks to the cache (see clone_file), so modifying them in
+        # place modifies the cache as well. In that case the testcase is generated again, after
+        # which copy_generated replaces the modified file and reports it as CHANGED.
+        def regenerate_modified_in_place():
+            for ext, file_hash in meta_yaml.get('files', dict()).items():
+                source = infile.with_suffix(ext)
+                target = target_infile.with_suffix(ext)
+                if (
+                    target.is_file()
+                    and not target.is_symlink()
+                    and source.is_file()
+                    and target.samefile(source)
+                    and generator_config.deployed_hash(target) != file_hash
+                ):
+                    bar.debug(f'{target.name} was modified in place. Generating it again.')
+                    meta_yaml.pop('cache_data', None)
+                    return
+
+        regenerate_modified_in_place()
 
         # Check whether the generated data and validation are up to date.
         # Returns (generator/input up to date, validation up to date)
         def up_to_date():
             # The testcase is up to date if:
             # - both target infile ans ansfile exist
-            # - meta_ contains exactly the right content (commands and hashes)
+            # - the manifest contains exactly the right content (commands and hashes)
             # - each validator with correct flags has been run already.
-            if t.copy:
-                t.cache_data['source_hash'] = t.hash
-            for ext, string in t.hardcoded.items():
-                t.cache_data['hardcoded_' + ext[1:]] = hash_string(string)
-            if t.generator:
-                t.cache_data['generator_hash'] = t.generator.hash(seed=t.seed)
-                t.cache_data['generator'] = t.generator.cache_command(seed=t.seed)
-            if t.config.solution:
-                t.cache_data['solution_hash'] = t.config.solution.hash()
-                t.cache_data['solution'] = t.config.solution.cache_command()
-            if t.config.visualizer:
-                t.cache_data['visualizer_hash'] = t.config.visualizer.hash()
-                t.cache_data['visualizer'] = t.config.visualizer.cache_command()
-
-            if not infile.is_file():
-                return (False, False)
-            if not ansfile.is_file():
-                return (False, False)
-            if (
-                (problem.interactive or problem.multipass)
-                and t.sample
-                and not ansfile.with_suffix('.interaction').is_file()
-            ):
-                return (False, False)
-
-            if not meta_path.is_file():
-                return (False, False)
-
-            meta_yaml = read_yaml(meta_path)
-            # In case meta_yaml is malformed, things are not up to date.
-            if not isinstance(meta_yaml, dict):
-                return (False, False)
-            if meta_yaml.get('cache_data') != t.cache_data:
+            t.update_cache_data()
+            if not t.generated_files_up_to_date(problem, meta_yaml):
                 return (False, False)
 
             # Check whether all input validators have been run.
-            testcase = Testcase(problem, infile, short_path=t.path / t.name)
+            testcase = Testcase(problem, infile, short_path=t.path.parent / (t.name + '.in'))
             for h in testcase.validator_hashes(validate.InputValidator, bar):
                 if h not in meta_yaml.get('validator_hashes', []):
                     return (True, False)
@@ -783,61 +1025,19 @@ class TestcaseRule(Rule):
         # which is also set to True when running `bt all`.
         # This doesn't do anything for non-generated cases.
         # It also checks that the input changes when the seed changes.
+        # The checks run after all testcases are generated, see GeneratorConfig.check_deterministic.
         def check_deterministic(force=False):
             if not force and not config.args.check_deterministic:
-                return False
-
+                return
             if t.generator is None:
-                return True
-
-            # Check that the generator is deterministic.
-            # TODO: Can we find a way to easily compare cpython vs pypy? These
-            # use different but fixed implementations to hash tuples of ints.
-            tmp = cwd / 'tmp'
-            tmp.mkdir(parents=True, exist_ok=True)
-            tmp_infile = tmp / 'testcase.in'
-            result = t.generator.run(bar, tmp, tmp_infile.stem, t.seed, t.config.retries)
-            if not result.status:
                 return
+            generator_config.determinism_checks.append(t)
 
-            # This is checked when running the generator.
-            assert infile.is_file()
-
-            # Now check that the source and target are equal.
-            if infile.read_bytes() == tmp_infile.read_bytes():
-                if config.args.check_deterministic:
-                    bar.part_done(True, 'Generator is deterministic.')
-            else:
-                bar.part_done(
-                    False, f'Generator `{t.generator.command_string}` is not deterministic.'
-                )
-
-            # If {seed} is used, check that the generator depends on it.
-            if t.generator.uses_seed:
-                depends_on_seed = False
-                for run in range(config.SEED_DEPENDENCY_RETRIES):
-                    new_seed = (t.seed + 1 + run) % (2**31)
-                    result = t.generator.run(bar, tmp, tmp_infile.stem, new_seed, t.config.retries)
-                    if not result.status:
-                        return
-
-                    # Now check that the source and target are different.
-                    if infile.read_bytes() != tmp_infile.read_bytes():
-                        depends_on_seed = True
-                        break
-
-                if depends_on_seed:
-                    if config.args.check_deterministic:
-                        bar.debug('Generator depends on seed.')
-                else:
-                    bar.log(
-                        f'Generator `{t.generator.command_string}` likely does not depend on seed:',
-                        f'All values in [{t.seed}, {new_seed}] give the same result.',
-                    )
-
+        # The files in data/ were just written by copy_generated or checked by their stat, so their
+        # content hashes are known without reading them again.
         def add_testdata_to_cache():
             # Used to identify generated testcases
-            generator_config.hashed_in.add(hash_file_content(infile))
+            generator_config.hashed_in.add(generator_config.deployed_hash(target_infile))
 
             # Store the generated testdata for deduplication test cases.
             hashes = {}
@@ -850,8 +1050,10 @@ class TestcaseRule(Rule):
                 extensions.remove('.out')
 
             for ext in extensions:
-                if target_infile.with_suffix(ext).is_file():
-                    hashes[ext] = hash_file(target_infile.with_suffix(ext))
+                target = target_infile.with_suffix(ext)
+                if target.is_file():
+                    # Like hash_file, this depends on both the name and the content.
+                    hashes[ext] = hash_string(target.name + generator_config.deployed_hash(target))
 
             # build ordered list of hashes we want to consider
             test_hash = [hashes[ext] for ext in extensions if ext in hashes]
@@ -870,21 +1072,110 @@ class TestcaseRule(Rule):
                     f'Testcase {t.path} is equal to {generator_config.generated_testdata[test_hash].path}.'
                 )
 
+        # Add the time spent in processes to the profile of the given stage, see `generate --profile`.
+        # The profile of a stage is replaced by the first run of that stage in this call.
+        profiled_stages = set()
+
+        @contextlib.contextmanager
+        def profile(stage):
+            with ExecProfile() as p:
+                yield
+            profiles = meta_yaml.setdefault('profile', dict())
+            if stage not in profiled_stages:
+                profiled_stages.add(stage)
+                profiles[stage] = [0, 0]
+            totals = profiles[stage]
+            totals[0] += p.wall_time
+            totals[1] = add_cpu_time(totals[1], p.cpu_time)
+
+        # Whether the visualizer needs to run. This happens in a background queue once the other
+        # files are deployed, so that slow visualizers do not delay generating other testcases.
+        # Note that the .in/.ans are generated even when the visualizer fails.
+        def needs_visualization():
+            if 'visualizer' in meta_yaml and not t.config.visualizer:
+                # The visualizer was removed, so remove its outputs as well.
+                for ext in config.KNOWN_VISUALIZER_EXTENSIONS:
+                    infile.with_suffix(ext).unlink(missing_ok=True)
+                    meta_yaml.get('files', dict()).pop(ext, None)
+                    meta_yaml.get('sizes', dict()).pop(ext, None)
+                del meta_yaml['visualizer']
+                manifest.set(t.hash, meta_yaml)
+            if config.args.no_visualizer or not t.config.visualizer:
+                return False
+            # Only `generate` waits for the visualizers, so that e.g. the implicit generate of
+            # `bt zip` is not held up by them. Outdated visualizations are kept until then.
+            if config.args.action != 'generate':
+                return False
+            return meta_yaml.get('visualizer') != t.visualizer_data()
+
+        # Deploy the outputs of the visualizer, once it finished in the background.
+        # The manifest entry was changed since meta_yaml was read (e.g. by the deterministic and
+        # include checks), so only the fields of the visualizer are updated.
+        def deploy_visualization(bar, result, profile):
+            entry = manifest.get(t.hash) or dict()
+            totals = entry.get('profile', dict())
+            totals['visualizer'] = [profile.wall_time, profile.cpu_time]
+            t.config.visualizer.report(bar, cwd, result)
+            if not result.status:
+                manifest.update(t.hash, profile=totals)
+                return
+            file_hashes = {
+                ext: hash_file_content(infile.with_suffix(ext))
+                for ext in config.KNOWN_VISUALIZER_EXTENSIONS
+                if infile.with_suffix(ext).is_file()
+            }
+            files = entry.get('files', dict())
+            sizes = entry.get('sizes', dict())
+            for ext in config.KNOWN_VISUALIZER_EXTENSIONS:
+                files.pop(ext, None)
+                sizes.pop(ext, None)
+                if ext in file_hashes:
+                    files[ext] = file_hashes[ext]
+                    sizes[ext] = infile.with_suffix(ext).stat().st_size
+            manifest.update(
+                t.hash,
+                visualizer=t.visualizer_data(),
+                files=files,
+                sizes=sizes,
+                profile=totals,
+            )
+            copy_generated(file_hashes, config.KNOWN_VISUALIZER_EXTENSIONS, bar)
+
+        # The visualizer outputs are left alone until the pending visualization is deployed.
+        def deployed_extensions(visualize):
+            if not visualize:
+                return config.KNOWN_DATA_EXTENSIONS
+            return [
+                ext
+                for ext in config.KNOWN_DATA_EXTENSIONS
+                if ext not in config.KNOWN_VISUALIZER_EXTENSIONS
+            ]
+
         generator_up_to_date, validator_up_to_date = up_to_date()
         if not validator_up_to_date:
             if not generator_up_to_date:
                 # clear all generated files
                 shutil.rmtree(cwd)
                 cwd.mkdir(parents=True, exist_ok=True)
-                meta_yaml = init_meta()
-                write_yaml(meta_yaml, meta_path.open('w'), allow_yamllib=True)
+                meta_yaml = {'validator_hashes': dict(), 'rule': t.rule}
+                manifest.set(t.hash, meta_yaml)
 
                 # Step 1: run `generate:` if present.
                 if t.generator:
-                    result = t.generator.run(bar, cwd, infile.stem, t.seed, t.config.retries)
-                    if result.err is not None:
+                    stage = generator_config.generator_stage(t)
+                    if stage != 'generator':
+                        yield stage
+                    with profile('generator'):
+                        if generator_config.take_batch_output(t, cwd):
+                            result = None
+                        else:
+                            with generator_config.generator_slot(t):
+                                result = t.generator.run(
+                                    bar, cwd, infile.stem, t.seed, t.config.retries
+                                )
+                    if result is not None and result.err is not None:
                         bar.debug('generator:', result.err)
-                    if not result.status:
+                    if result is not None and not result.status:
                         return
 
                 # Step 2: Copy `copy:` files for all known extensions.
@@ -914,15 +1205,21 @@ class TestcaseRule(Rule):
                     bar.error(f'No .in file was generated!')
                     return
 
-            assert infile.is_file(), f'Expected .in file not found in cache: {infile}'
-            testcase = Testcase(problem, infile, short_path=t.path / t.name)
+            assert cache.is_stored(infile), f'Expected .in file not found in cache: {infile}'
+            testcase = Testcase(problem, infile, short_path=t.path.parent / (t.name + '.in'))
 
             # Validate the in.
             no_validators = config.args.no_validators
 
-            if not testcase.validate_format(
-                validate.Mode.INPUT, bar=bar, constraints=None, warn_instead_of_error=no_validators
-            ):
+            yield 'input_validation'
+            with profile('input_validation'):
+                input_valid = testcase.validate_format(
+                    validate.Mode.INPUT,
+                    bar=bar,
+                    constraints=None,
+                    warn_instead_of_error=no_validators,
+                )
+            if not input_valid:
                 if not no_validators:
                     if t.generator:
                         bar.warn(
@@ -956,14 +1253,20 @@ class TestcaseRule(Rule):
                             and (testcase.root == 'sample' or config.args.interaction)
                             and '.interaction' not in t.hardcoded
                         ):
-                            if not t.config.solution.run_interaction(bar, cwd, t):
+                            yield 'solution'
+                            with profile('solution'):
+                                success = t.config.solution.run_interaction(bar, cwd, t)
+                            if not success:
                                 return
                     else:
                         # Generate a .ans if not already generated by earlier steps.
                         if not testcase.ans_path.is_file():
                             # Run the solution if available.
                             if t.config.solution:
-                                if not t.config.solution.run(bar, cwd).status:
+                                yield 'solution'
+                                with profile('solution'):
+                                    success = t.config.solution.run(bar, cwd).status
+                                if not success:
                                     return
                             else:
                                 # Otherwise, it's a hard error.
@@ -973,23 +1276,28 @@ class TestcaseRule(Rule):
 
                         # Validate the ans file.
                         assert ansfile.is_file(), f'Failed to generate ans file: {ansfile}'
-                        if not testcase.validate_format(
-                            validate.Mode.ANSWER, bar=bar, warn_instead_of_error=no_validators
-                        ):
+                        yield 'answer_validation'
+                        with profile('answer_validation'):
+                            answer_valid = testcase.validate_format(
+                                validate.Mode.ANSWER, bar=bar, warn_instead_of_error=no_validators
+                            )
+                        if not answer_valid:
                             if not no_validators:
                                 bar.debug(
                                     'Use generate --no-validators to ignore validation results.'
                                 )
                                 return
 
-                # Generate visualization
-                if not config.args.no_visualizer and t.config.visualizer:
-                    # Note that the .in/.ans are generated even when the visualizer fails.
-                    t.config.visualizer.run(bar, cwd, infile.stem)
-
                 check_deterministic(True)
 
             meta_yaml['cache_data'] = t.cache_data
+            if not generator_up_to_date or 'files' not in meta_yaml:
+                meta_yaml['files'] = cached_file_hashes()
+                meta_yaml['sizes'] = {
+                    ext: infile.with_suffix(ext).stat().st_size
+                    for ext in meta_yaml['files']
+                    if infile.with_suffix(ext).is_file()
+                }
             if generator_up_to_date:
                 hashes = testcase.validator_hashes(validate.InputValidator, bar)
                 for h in hashes:
@@ -1000,22 +1308,42 @@ class TestcaseRule(Rule):
                 )
 
             # Update metadata
-            if copy_generated():
-                write_yaml(meta_yaml, meta_path.open('w'), allow_yamllib=True)
+            visualize = needs_visualization()
+            copy_generated(meta_yaml['files'], deployed_extensions(visualize))
+            manifest.set(t.hash, meta_yaml)
             message = ''
         else:
             if config.args.action != 'generate':
                 bar.logged = True  # Disable redundant 'up to date' message in run mode.
             check_deterministic(False)
             message = 'SKIPPED: up to date'
-            copy_generated()
+            if 'files' not in meta_yaml:
+                meta_yaml['files'] = cached_file_hashes()
+                manifest.set(t.hash, meta_yaml)
+            visualize = needs_visualization()
+            copy_generated(meta_yaml['files'], deployed_extensions(visualize))
 
         # Note that we set this to true even if not all files were overwritten -- a different log/warning message will be displayed for that.
         t.generate_success = True
         add_testdata_to_cache()
+
+        # Visualizers read the cached files by their path.
+        def run_visualizer():
+            cache.decompress_dir(cwd)
+            return t.config.visualizer.run(cwd)
+
+        if visualize:
+            generator_config.visualize(t, run_visualizer, deploy_visualization)
         bar.done(message=message)
 
 
+# The stages of generating a testcase, in order. Each stage has its own queue, so that e.g. a slow
+# solution does not keep other testcases from being validated.
+GENERATE_STAGES = ['generator', 'input_validation', 'solution', 'answer_validation']
+# The stages recorded by `generate --profile`. Visualizers run in the background afterwards.
+PROFILE_STAGES = GENERATE_STAGES + ['visualizer']
+
+
 # Helper that has the required keys needed from a parent directory.
 class RootDirectory:
     path = Path('')
@@ -1042,7 +1370,7 @@ class Directory(Rule):
                         f'Directory must not contain reserved key {key}.', self.path
                     )
                 if key in DEPRECATED_ROOT_KEYS:
-                    message(
+                    parse_message(
                         f'Dreprecated root level key: {key}, ignored',
                         'generators.yaml',
                         self.path,
@@ -1050,7 +1378,7 @@ class Directory(Rule):
                     )
                 elif key not in KNOWN_DIRECTORY_KEYS + KNOWN_ROOT_KEYS:
                     if config.args.action == 'generate':
-                        message(
+                        parse_message(
                             f'Unknown root level key: {key}',
                             'generators.yaml',
                             self.path,
@@ -1064,7 +1392,7 @@ class Directory(Rule):
                     )
                 if key not in KNOWN_DIRECTORY_KEYS:
                     if config.args.action == 'generate':
-                        message(
+                        parse_message(
                             f'Unknown directory level key: {key}',
                             'generators.yaml',
                             self.path,
@@ -1164,45 +1492,51 @@ class Directory(Rule):
                     generator_config.remove(testdata_yaml_path)
                     testdata_yaml_path.write_text(yaml_text)
                     bar.log(f'CHANGED: testdata.yaml')
+                    problem.reset_testdata_yamls()
             else:
                 # new file -> create it
                 testdata_yaml_path.write_text(yaml_text)
                 bar.log(f'NEW: testdata.yaml')
+                problem.reset_testdata_yamls()
         elif d.testdata_yaml == '' and testdata_yaml_path.is_file():
             # empty -> remove it
             generator_config.remove(testdata_yaml_path)
             bar.log(f'REMOVED: testdata.yaml')
+            problem.reset_testdata_yamls()
         bar.done()
 
-    def generate_includes(d, problem, generator_config, bar):
-        for key in d.includes:
-            t = d.includes[key]
-            target = t.path
-            new_case = d.path / target.name
-            bar.start(str(new_case))
-            infile = problem.path / 'data' / target.parent / (target.name + '.in')
-            new_infile = problem.path / 'data' / d.path / (target.name + '.in')
-
-            if not t.generate_success:
-                bar.error(f'Included case {target} has errors.')
-                bar.done()
-                continue
+    # Link the included testcase `key` into this directory, after validating its input with the
+    # flags of this directory. Includes are independent tasks, see GeneratorConfig._run.
+    def generate_include(d, key, problem, generator_config, parent_bar):
+        t = d.includes[key]
+        target = t.path
+        new_case = d.path / target.name
+        bar = parent_bar.start(str(new_case))
+        infile = problem.path / 'data' / target.parent / (target.name + '.in')
+        new_infile = problem.path / 'data' / d.path / (target.name + '.in')
+
+        if not t.generate_success:
+            bar.error(f'Included case {target} has errors.')
+            bar.done()
+            return
 
-            if not infile.is_file():
-                bar.warn(f'{target}.in does not exist.')
-                bar.done()
-                continue
+        if not infile.is_file():
+            bar.warn(f'{target}.in does not exist.')
+            bar.done()
+            return
 
-            # Check if the testcase was already validated.
-            # TODO: Dedup some of this with TestcaseRule.generate?
-            cwd = problem.tmpdir / 'data' / t.hash
-            meta_path = cwd / 'meta_.yaml'
+        # Check if the testcase was already validated with the flags of this directory, possibly
+        # for another directory including the same testcase. Validating the same testcase for
+        # multiple directories at once is serialized, so that it is validated only once for each
+        # set of flags.
+        # TODO: Dedup some of this with TestcaseRule.generate?
+        testcase = Testcase(problem, infile, short_path=new_case)
+        hashes = testcase.validator_hashes(validate.InputValidator, bar)
+        with generator_config.include_lock(t.hash):
+            meta_yaml = generator_config.manifest.get(t.hash)
             assert (
-                meta_path.is_file()
-            ), f"Metadata file not found for included case {d.path / key}\nwith hash {t.hash}\nfile {meta_path}"
-            meta_yaml = read_yaml(meta_path)
-            testcase = Testcase(problem, infile, short_path=t.path / t.name)
-            hashes = testcase.validator_hashes(validate.InputValidator, bar)
+                meta_yaml is not None
+            ), f"Metadata not found for included case {d.path / key}\nwith hash {t.hash}"
 
             # All hashes validated before?
             def up_to_date():
@@ -1213,7 +1547,6 @@ class Directory(Rule):
 
             if not up_to_date():
                 # Validate the testcase input.
-                testcase = Testcase(problem, infile, short_path=new_case)
                 if not testcase.validate_format(
                     validate.Mode.INPUT,
                     bar=bar,
@@ -1223,22 +1556,27 @@ class Directory(Rule):
                     if not config.args.no_validators:
                         bar.debug('Use generate --no-validators to ignore validation results.')
                         bar.done()
-                        continue
+                        return
                 # Add hashes to the cache.
                 for h in hashes:
-                    if 'validator_hashes' not in meta_yaml:
-                        meta_yaml['validator_hashes'] = dict()
-                    meta_yaml['validator_hashes'][h] = hashes[h]
+                    meta_yaml.setdefault('validator_hashes', dict())[h] = hashes[h]
 
                 # Update metadata
-                yamllib.dump(
-                    meta_yaml,
-                    meta_path.open('w'),
-                )
+                generator_config.manifest.set(t.hash, meta_yaml)
+
+        # TODO: Validate the testcase output as well?
+        t.link(problem, generator_config, bar, new_infile)
+        bar.done()
 
-            # TODO: Validate the testcase output as well?
-            t.link(problem, generator_config, bar, new_infile)
-            bar.done()
+
+# The physical memory in MiB, used as the total of the `memory:` declarations of the generators that
+# run at the same time.
+def physical_memory():
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') // 2**20
+    except (AttributeError, ValueError, OSError):
+        # Not available on e.g. Windows, so only run one memory-heavy generator at a time.
+        return 0
 
 
 # Returns the numbered name
@@ -1252,6 +1590,40 @@ def numbered_testcase_name(basename, i, n):
         return number_prefix
 
 
+# A pending run of the visualizer of a testcase, see GeneratorConfig.visualize.
+# The visualizer runs in a background thread, while its outputs are deployed from the main thread
+# once all testcases are generated.
+class Visualization:
+    def __init__(self, t, run, deploy):
+        self.t = t
+        self.run = run
+        self.deploy = deploy
+        self.result = None
+        self.profile = None
+        self.finished = threading.Event()
+
+    def __call__(self):
+        try:
+            with ExecProfile() as self.profile:
+                self.result = self.run()
+        finally:
+            self.finished.set()
+
+
+# The hash of all code in bin/. The pickled parse tree contains objects of other modules as well
+# (e.g. program.py), so any change to the code invalidates the cached generators.yaml.
+_bin_code_hash = None
+
+
+def _code_hash():
+    global _bin_code_hash
+    if _bin_code_hash is None:
+        _bin_code_hash = combine_hashes(
+            [f'{f.name} {hash_file_content(f)}' for f in Path(__file__).parent.glob('*.py')]
+        )
+    return _bin_code_hash
+
+
 class GeneratorConfig:
     def parse_generators(generators_yaml):
         assert_type('Generators', generators_yaml, dict)
@@ -1276,9 +1648,28 @@ class GeneratorConfig:
             generators[path] = [Path('generators') / d for d in deps]
         return generators
 
+    # The generators that support the batch protocol, see run_batches.
+    def parse_batch_generators(batch_generators_yaml):
+        assert_type('Batch generators', batch_generators_yaml, list)
+        batch_generators = set()
+        for gen in batch_generators_yaml:
+            assert_type('Batch generator', gen, str)
+            batch_generators.add(resolve_path(gen, allow_absolute=False, allow_relative=True))
+        return batch_generators
+
+    # `parallel: false` generates the testcases one at a time, and a number limits the number of
+    # parallel jobs. By default, --jobs is used.
+    def parse_parallel(parallel_yaml):
+        assert_type('Parallel', parallel_yaml, [bool, int])
+        if parallel_yaml is not True and parallel_yaml < 0:
+            raise ParseException('parallel must be a boolean or a non-negative integer.')
+        return parallel_yaml
+
     # Only used at the root directory level.
     ROOT_KEYS = [
         ('generators', {}, parse_generators),
+        ('batch_generators', set(), parse_batch_generators),
+        ('parallel', True, parse_parallel),
     ]
 
     # Parse generators.yaml.
@@ -1308,20 +1699,145 @@ class GeneratorConfig:
         self.hashed_in = set()
         # Files that should be processed
         self.restriction = restriction
+        # Cached metadata of generated testcases keyed by rule hash, opened by run().
+        self.manifest = None
+        # Content hashes and stats of the files written to data/, opened by run().
+        self.deployed = None
+        # Map from rule hash to the directory containing the output of a batch generator run,
+        # and the (wall, cpu) time of the batch attributed to the testcase.
+        self.batch_outputs = dict()
+        # Generated testcases whose generator should be checked for determinism after generating.
+        self.determinism_checks = []
+        # The generator commands that are known to depend on {seed}, opened by run().
+        self.seed_dependency = None
+        # Files (other than generators.yaml) that the parsed rules depend on, with their stat.
+        self.parse_dependencies = dict()
+        # The generators, solutions, and visualizers built by build(), keyed by their path.
+        self.programs = dict()
 
         if yaml_path.is_file():
-            yaml = read_yaml(yaml_path, plain=True)
+            yaml_text = yaml_path.read_text()
             self.has_yaml = True
         else:
-            yaml = None
+            yaml_text = None
             self.has_yaml = False
 
+        # Parsing a large generators.yaml is slow, so the parsed tree is cached in the tmpdir.
+        parse_key = self._parse_key(yaml_text)
+        if self._load_parse_cache(parse_key):
+            return
+
+        global _parse_messages
+        _parse_messages = []
         try:
+            yaml = parse_yaml(yaml_text, path=yaml_path, plain=True) if self.has_yaml else None
             self.parse_yaml(yaml)
         except ParseException as e:
             # Handle fatal parse errors
             message(e.message, 'generators.yaml', e.path, color_type=MessageType.ERROR)
             exit()
+        finally:
+            messages = _parse_messages
+            _parse_messages = None
+
+        self._write_parse_cache(parse_key, messages)
+
+    # The fields of GeneratorConfig that are computed by parse_yaml.
+    PARSE_CACHE_FIELDS = [
+        'n_parse_error',
+        'known_cases',
+        'known_directories',
+        'known_keys',
+        'rules_cache',
+        'parse_dependencies',
+        'root_dir',
+    ] + [key for key, default, func in ROOT_KEYS]
+
+    # The parsed tree depends on the generators.yaml and the code parsing it, and on some
+    # command line arguments. Programs are not built yet while parsing, so their hashes
+    # are only added later.
+    def _parse_key(self, yaml_text):
+        key = [
+            sys.version,
+            _code_hash(),
+            str(self.problem.path.absolute()),
+            str(yaml_text),
+            str(config.args.action == 'generate'),
+        ]
+        if self.restriction:
+            key.append(str(Path.cwd()))
+            key += [str(p) for p in self.restriction]
+        return hash_string('\0'.join(key))
+
+    def _parse_cache_path(self):
+        return self.problem.tmpdir / 'generators_yaml.pickle'
+
+    @staticmethod
+    def _stat_signature(path):
+        try:
+            stat = path.stat()
+            return (stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            return None
+
+    def add_parse_dependency(self, path):
+        self.parse_dependencies[path] = GeneratorConfig._stat_signature(path)
+
+    def _load_parse_cache(self, parse_key):
+        cache_path = self._parse_cache_path()
+        if not cache_path.is_file():
+            return False
+
+        problem = self.problem
+
+        class Unpickler(pickle.Unpickler):
+            def persistent_load(self, pid):
+                assert pid == 'problem'
+                return problem
+
+        try:
+            with cache_path.open('rb') as f:
+                unpickler = Unpickler(f)
+                if unpickler.load() != parse_key:
+                    return False
+                dependencies = unpickler.load()
+                for path, stat in dependencies.items():
+                    if GeneratorConfig._stat_signature(path) != stat:
+                        return False
+                messages, fields = unpickler.load()
+        except Exception:
+            # A broken cache is simply rebuilt.
+            return False
+
+        for key, value in fields.items():
+            setattr(self, key, value)
+        self.known_keys = collections.defaultdict(lambda: [False, []], self.known_keys)
+        for args, kwargs in messages:
+            message(*args, **kwargs)
+        return True
+
+    def _write_parse_cache(self, parse_key, messages):
+        problem = self.problem
+
+        class Pickler(pickle.Pickler):
+            def persistent_id(self, obj):
+                return 'problem' if obj is problem else None
+
+        fields = {key: getattr(self, key) for key in GeneratorConfig.PARSE_CACHE_FIELDS}
+        fields['known_keys'] = dict(fields['known_keys'])
+
+        cache_path = self._parse_cache_path()
+        tmp_path = cache_path.with_suffix(f'.{secrets.token_hex(4)}')
+        try:
+            with tmp_path.open('wb') as f:
+                pickler = Pickler(f, pickle.HIGHEST_PROTOCOL)
+                pickler.dump(parse_key)
+                pickler.dump(self.parse_dependencies)
+                pickler.dump((messages, fields))
+            tmp_path.replace(cache_path)
+        except Exception:
+            tmp_path.unlink(missing_ok=True)
+            cache_path.unlink(missing_ok=True)
 
     # testcase_short_path: secret/1.in
     def process_testcase(self, relative_testcase_path):
@@ -1359,7 +1875,7 @@ class GeneratorConfig:
             key = self.known_keys[obj.key]
             key[1].append(obj)
             if key[0] and len(key[1]) == 2:
-                message(
+                parse_message(
                     f'Included key {name} exists more than once as {key[1][0].path} and {key[1][1].path}.',
                     'generators.yaml',
                     obj.path,
@@ -1379,7 +1895,7 @@ class GeneratorConfig:
             count = yaml['count']
             if count < 1:
                 if warn_for is not None:
-                    message(
+                    parse_message(
                         f'Found count: {count}, increased to 1.',
                         'generators.yaml',
                         warn_for,
@@ -1388,7 +1904,7 @@ class GeneratorConfig:
                 return 1
             if count > 100:
                 if warn_for is not None:
-                    message(
+                    parse_message(
                         f'Found count: {count}, limited to 100.',
                         'generators.yaml',
                         warn_for,
@@ -1436,6 +1952,7 @@ class GeneratorConfig:
                 count = parse_count(yaml, parent.path / name)
 
                 ts = []
+                previous = None
                 for count_index in range(count):
                     if count_index > 0:
                         name = name_gen()
@@ -1446,9 +1963,12 @@ class GeneratorConfig:
                     if not self.process_testcase(parent.path / name):
                         continue
 
-                    t = TestcaseRule(self.problem, self, key, name, yaml, parent, count_index)
+                    t = TestcaseRule(
+                        self.problem, self, key, name, yaml, parent, count_index, previous
+                    )
+                    previous = t
                     if t.path in self.known_cases:
-                        message(
+                        parse_message(
                             f'was already parsed. Skipping.',
                             'generators.yaml',
                             t.path,
@@ -1548,14 +2068,14 @@ class GeneratorConfig:
                 if p in self.known_cases:
                     if target != self.known_cases[p].path:
                         if self.known_cases[p].path == p:
-                            message(
+                            parse_message(
                                 f'conflict with included case {target}.',
                                 'generators.yaml',
                                 p,
                                 color_type=MessageType.ERROR,
                             )
                         else:
-                            message(
+                            parse_message(
                                 f'included with multiple targets {target} and {self.known_cases[p].path}.',
                                 'generators.yaml',
                                 p,
@@ -1571,7 +2091,7 @@ class GeneratorConfig:
                 for include in yaml['include']:
                     assert_type('include', include, str, d.path)
                     if '/' in include:
-                        message(
+                        parse_message(
                             f'Include {include} should be a testcase/testgroup key, not a path.',
                             'generators.yaml',
                             d.path,
@@ -1582,7 +2102,7 @@ class GeneratorConfig:
                     if include in self.known_keys:
                         key = self.known_keys[include]
                         if len(key[1]) != 1:
-                            message(
+                            parse_message(
                                 f'Included key {include} exists more than once.',
                                 'generators.yaml',
                                 d.path,
@@ -1601,7 +2121,7 @@ class GeneratorConfig:
                             )
                             pass
                     else:
-                        message(
+                        parse_message(
                             f'Unknown include key {include} does not refer to a previous testcase.',
                             'generators.yaml',
                             d.path,
@@ -1641,97 +2161,688 @@ class GeneratorConfig:
 
         self.root_dir.walk(collect_programs, dir_f=None)
 
-        def build_programs(program_type, program_paths):
-            programs = []
-            for program_path in program_paths:
-                path = self.problem.path / program_path
-                deps = None
-                if program_type is program.Generator and program_path in self.generators:
-                    deps = [Path(self.problem.path) / d for d in self.generators[program_path]]
-                    programs.append(program_type(self.problem, path, deps=deps))
+        # TODO: Consider building all types of programs in parallel as well.
+        self._build_programs(program.Generator, generators_used)
+        self._build_programs(run.Submission, solutions_used)
+        self._build_programs(program.Visualizer, visualizers_used)
+        self._build_validators()
+
+        def cleanup_build_failures(t):
+            if t.config.solution and t.config.solution.program is None:
+                t.config.solution = None
+            if not build_visualizers or (
+                t.config.visualizer and t.config.visualizer.program is None
+            ):
+                t.config.visualizer = None
+
+        self.root_dir.walk(cleanup_build_failures, dir_f=None)
+
+    # Build the programs of the given type, and return whether all of them built successfully.
+    # The invocations using them get their program through the callbacks, see Invocation.
+    def _build_programs(self, program_type, program_paths):
+        programs = []
+        for program_path in program_paths:
+            path = self.problem.path / program_path
+            deps = None
+            if program_type is program.Generator and program_path in self.generators:
+                deps = [Path(self.problem.path) / d for d in self.generators[program_path]]
+                programs.append(program_type(self.problem, path, deps=deps))
+            else:
+                if program_type is run.Submission:
+                    programs.append(
+                        program_type(self.problem, path, skip_double_build_warning=True)
+                    )
                 else:
-                    if program_type is run.Submission:
-                        programs.append(
-                            program_type(self.problem, path, skip_double_build_warning=True)
-                        )
-                    else:
-                        programs.append(program_type(self.problem, path))
+                    programs.append(program_type(self.problem, path))
 
-            bar = ProgressBar('Build ' + program_type.subdir, items=programs)
+        bar = ProgressBar('Build ' + program_type.subdir, items=programs)
+        ok = True
 
-            def build_program(p):
-                localbar = bar.start(p)
-                p.build(localbar)
-                localbar.done()
+        def build_program(p):
+            nonlocal ok
+            localbar = bar.start(p)
+            ok &= p.build(localbar)
+            localbar.done()
 
-            parallel.run_tasks(build_program, programs)
+        parallel.run_tasks(build_program, programs)
 
-            bar.finalize(print_done=False)
+        bar.finalize(print_done=False)
 
-        # TODO: Consider building all types of programs in parallel as well.
-        build_programs(program.Generator, generators_used)
-        build_programs(run.Submission, solutions_used)
-        build_programs(program.Visualizer, visualizers_used)
+        for p in programs:
+            self.programs[p.path] = p
+        return ok
 
+    def _build_validators(self):
         self.problem.validators(validate.InputValidator)
         if not self.problem.interactive and not self.problem.multipass:
             self.problem.validators(validate.AnswerValidator)
         self.problem.validators(validate.OutputValidator)
 
-        def cleanup_build_failures(t):
-            if t.config.solution and t.config.solution.program is None:
-                t.config.solution = None
-            if not build_visualizers or (
-                t.config.visualizer and t.config.visualizer.program is None
-            ):
-                t.config.visualizer = None
+    # Rebuild the programs and validators whose sources are among the changed paths, for
+    # `generate --watch`. Returns False when the config has to be parsed again instead, i.e. when
+    # a changed path is not a source of any of them, or a changed program failed to build before.
+    # Returns None when a rebuild fails.
+    def rebuild(self, changed):
+        problem_path = self.problem.path
+        validator_dirs = [
+            problem_path / d
+            for cls in [validate.InputValidator, validate.AnswerValidator, validate.OutputValidator]
+            for d in cls.source_dirs
+        ]
+
+        changed_programs = dict()
+        validators_changed = False
+        for path in changed:
+            owners = [
+                p
+                for p in self.programs.values()
+                if path in p.source_files or is_relative_to(p.path, path)
+            ]
+            if owners:
+                for p in owners:
+                    if not p.ok:
+                        return False
+                    changed_programs[p.path] = p
+            elif any(is_relative_to(d, path) for d in validator_dirs):
+                validators_changed = True
+            else:
+                return False
 
-        self.root_dir.walk(cleanup_build_failures, dir_f=None)
+        self.problem.reset_programs(changed_programs.keys(), validators=validators_changed)
+        ok = True
+        for program_type in [program.Generator, run.Submission, program.Visualizer]:
+            paths = [
+                p.path.relative_to(problem_path)
+                for p in changed_programs.values()
+                if type(p) is program_type
+            ]
+            if paths:
+                ok &= self._build_programs(program_type, paths)
+        if validators_changed:
+            self._build_validators()
+        return ok or None
 
     def run(self):
+        # Reset the state of a previous run, for `generate --watch`.
+        self.known_files = set()
+        self.generated_testdata = dict()
+        self.hashed_in = set()
+        self.trashdir = None
+        self.batch_outputs = dict()
+        self.determinism_checks = []
+        # The number of parallel jobs, limited by `parallel:` in generators.yaml.
+        self.jobs = config.args.jobs
+        if self.parallel is not True:
+            self.jobs = min(self.jobs, int(self.parallel))
+        self.parallel_limits = dict()
+        self.memory_budget = parallel.Budget(physical_memory())
+        self.pipeline = None
+        self.include_locks = dict()
+        self.visualizer_queue = parallel.new_queue(lambda v: v(), num_threads=self.jobs)
+        self.visualizations = []
+
         self.update_gitignore_file()
         self.problem.reset_testcase_hashes()
 
         item_names = []
-        self.root_dir.walk(lambda x: item_names.append(x.path))
+        if config.args.shard:
+            # Copies and includes are only handled when generating all shards.
+            self.root_dir.walk(
+                lambda t: t.copy_of is None and self.in_shard(t) and item_names.append(t.path),
+                lambda d: item_names.append(d.path),
+            )
+        else:
+            self.root_dir.walk(lambda x: item_names.append(x.path))
+
+            def count_dir(d):
+                for name in d.includes:
+                    item_names.append(d.path / name)
+
+            self.root_dir.walk(None, count_dir)
+
+        # All cache metadata is read once here and written back once all testcases are done.
+        manifest_path = self.problem.tmpdir / 'data' / 'manifest.sqlite'
+        self.manifest = cache.Manifest(manifest_path)
+        self.deployed = cache.Manifest(manifest_path, table='deployed')
+        self.seed_dependency = cache.Manifest(manifest_path, table='seed_dependency')
+        try:
+            for path in config.args.import_cache or []:
+                self.import_cache(path)
+            self.run_batches()
+            bar = ProgressBar('Generate', items=item_names)
+            self._run(bar)
+            bar.finalize()
+            self.check_deterministic()
+            self.finish_visualizations()
+            if config.args.compress_cache:
+                self.compress_cache()
+            if config.args.profile:
+                self.print_profile()
+            if config.args.export_cache:
+                self.export_cache(config.args.export_cache)
+        finally:
+            # Visualizations that did not finish, e.g. because generating was interrupted, are
+            # cancelled. They are rerun next time.
+            self.visualizer_queue.abort()
+            self.visualizer_queue.done()
+            self.manifest.flush()
+            self.deployed.flush()
+            self.seed_dependency.flush()
+            self.problem.flush_caches()
+
+    # Generators listed in `batch_generators:` are run once for all their testcases that are
+    # not up to date, instead of once per testcase.
+    # The generator is called with `--batch` and reads one job per line from stdin:
+    #   <directory>\0<argument>\0<argument>...
+    # where the fields are separated by NUL bytes, and the arguments are the generator arguments
+    # of the testcase, with {name} and {seed} already substituted (see doc/generators.md).
+    # Testcases with a NUL byte in their arguments are not batched. For each job, the generator
+    # writes testcase.in (and optionally other files) to the given directory, relative to its
+    # working directory.
+    # The outputs are picked up by TestcaseRule.generate via take_batch_output. When a batch
+    # fails, its testcases fall back to running the generator once per testcase.
+    def run_batches(self):
+        if not self.batch_generators:
+            return
+
+        jobs = collections.defaultdict(list)
+
+        def add_job(t):
+            if (
+                t.generator is None
+                or t.generator.program is None
+                or t.generator.program_path not in self.batch_generators
+                or t.copy_of is not None
+                or t.parse_error is not None
+                or t.hash is None
+                or not self.in_shard(t)
+                # NUL separates the fields of a job.
+                or any('\0' in arg for arg in t.generator._sub_args(seed=t.seed))
+            ):
+                return
+            t.update_cache_data()
+            meta_yaml = self.manifest.get(t.hash) or dict()
+            if not t.generated_files_up_to_date(self.problem, meta_yaml):
+                jobs[t.generator.program].append(t)
+
+        self.root_dir.walk(add_job, dir_f=None)
+        if not jobs:
+            return
+
+        bar = ProgressBar('Batch generate', items=[program.name for program in jobs])
+
+        def run_batch(item):
+            program, rules = item
+            localbar = bar.start(program.name)
+            batchdir = (
+                self.problem.tmpdir / 'batch' / program.tmpdir.relative_to(self.problem.tmpdir)
+            )
+            if batchdir.is_dir():
+                shutil.rmtree(batchdir)
+            batchdir.mkdir(parents=True)
+
+            # One job per line, with its fields separated by NUL bytes, so that the arguments are
+            # passed exactly as they would be on the command line.
+            lines = []
+            for t in rules:
+                (batchdir / t.hash).mkdir()
+                lines.append('\0'.join([t.hash] + t.generator._sub_args(seed=t.seed)) + '\n')
+            jobs_path = batchdir / 'jobs'
+            jobs_path.write_text(''.join(lines))
+
+            memory = max(t.config.memory or 0 for t in rules)
+            with ExecProfile() as batch_profile, self.memory_budget.reserve(memory):
+                result = program.run_batch(batchdir, jobs_path, config.get_timeout() * len(rules))
+            if not result.status:
+                localbar.done(False, f'Batch of {len(rules)} testcases failed', result.err)
+                return
+            if config.args.error and result.err:
+                localbar.log('stderr', result.err)
+
+            # The time of the batch is split evenly over its testcases.
+            cpu_time = batch_profile.cpu_time
+            share = (
+                batch_profile.wall_time / len(rules),
+                None if cpu_time is None else cpu_time / len(rules),
+            )
+            for t in rules:
+                if (batchdir / t.hash / 'testcase.in').is_file():
+                    self.batch_outputs[t.hash] = (batchdir / t.hash, share)
+            localbar.done(message=f'{len(rules)} testcases')
+
+        parallel.run_tasks(run_batch, list(jobs.items()), num_threads=self.jobs)
+        bar.finalize(print_done=False)
+
+    # Run the visualizer of testcase t in the background. Visualizers are run with a low priority
+    # (see program.Visualizer.run), so that they only use CPU time that is left over by
+    # generating the testcases. run() is called in a worker thread, and deploy(bar, result,
+    # profile) in the main thread by finish_visualizations.
+    def visualize(self, t, run, deploy):
+        visualization = Visualization(t, run, deploy)
+        self.visualizations.append(visualization)
+        self.visualizer_queue.put(visualization)
+
+    # Wait for the background visualizations and deploy their outputs to data/.
+    # Visualizer failures are only reported here, after all testcases are generated.
+    def finish_visualizations(self):
+        if not self.visualizations:
+            return
+        queue = self.visualizer_queue
+        if self.jobs == 0:
+            # A sequential queue only runs its tasks when it is done.
+            queue.done()
+
+        bar = ProgressBar('Visualize', items=[str(v.t.path) for v in self.visualizations])
+        for visualization in self.visualizations:
+            localbar = bar.start(str(visualization.t.path))
+            # A task that raised an exception aborts the queue, which drops the remaining tasks.
+            while not visualization.finished.wait(0.1) and not queue.aborted:
+                pass
+            if visualization.result is not None:
+                visualization.deploy(localbar, visualization.result, visualization.profile)
+            localbar.done()
+        queue.done()
+        bar.finalize(print_done=False)
+        self.visualizations = []
+
+    # Compress the cached inputs and answers of at least config.COMPRESS_CACHE_THRESHOLD bytes, see
+    # `generate --compress-cache`. Files that share their storage with data/, as a hardlink or
+    # reflink (see clone_file), are not compressed, since that would only add a compressed copy.
+    # A reflink can not be detected, so files whose data/ copy is on the same filesystem are
+    # skipped as well.
+    def compress_cache(self):
+        files = []
+
+        def add_files(t):
+            if t.copy_of is not None or not getattr(t, 'generate_success', False):
+                return
+            cwd = self.problem.tmpdir / 'data' / t.hash
+            target_dir = self.problem.path / 'data' / t.path.parent
+            for ext in ['.in', '.ans']:
+                path = cwd / ('testcase' + ext)
+                if not path.is_file():
+                    continue
+                stat = path.stat()
+                if stat.st_size < config.COMPRESS_CACHE_THRESHOLD or stat.st_nlink > 1:
+                    continue
+                target = target_dir / (t.name + ext)
+                if target.is_file() and target.stat().st_dev == stat.st_dev:
+                    continue
+                files.append((f'{t.path}{ext}', path))
+
+        self.root_dir.walk(add_files, dir_f=None)
+        if not files:
+            return
+
+        bar = ProgressBar('Compress cache', items=[name for name, _ in files])
+
+        def compress(item):
+            name, path = item
+            localbar = bar.start(name)
+            cache.compress_file(path)
+            localbar.done()
+
+        parallel.run_tasks(compress, files, num_threads=self.jobs)
+        bar.finalize(print_done=False)
+
+    # Check that the generators of the testcases in determinism_checks are deterministic, by
+    # rerunning them, and that they depend on {seed}, by running them with other seeds.
+    # All runs are independent tasks. A testcase that was found to be deterministic is marked in
+    # the manifest and not checked again until it changes. Seed dependency is checked once per
+    # generator program and command, instead of once per testcase.
+    def check_deterministic(self):
+        tasks = []
+        # The testcase to compare against for each unproven seed dependency.
+        seed_checks = dict()
+        for t in self.determinism_checks:
+            if not (self.manifest.get(t.hash) or dict()).get('deterministic'):
+                tasks.append((t, None))
+            if t.generator.uses_seed:
+                key = combine_hashes([t.generator.program.hash, t.generator.command_string])
+                if key not in self.seed_dependency and key not in seed_checks:
+                    seed_checks[key] = t
+        for key, t in seed_checks.items():
+            for run in range(config.SEED_DEPENDENCY_RETRIES):
+                tasks.append((t, run))
+        if not tasks:
+            return
+
+        # The number of unfinished seed runs for each key.
+        remaining = {key: config.SEED_DEPENDENCY_RETRIES for key in seed_checks}
+        lock = threading.Lock()
+
+        def task_name(task):
+            t, run = task
+            return str(t.path) if run is None else f'{t.path} (seed {run + 1})'
+
+        bar = ProgressBar('Deterministic', items=[task_name(task) for task in tasks])
+
+        def check(task):
+            t, run = task
+            localbar = bar.start(task_name(task))
+            cwd = self.problem.tmpdir / 'data' / t.hash
+            infile = cwd / 'testcase.in'
+            tmp = cwd / 'tmp' / ('0' if run is None else str(run + 1))
+            tmp_infile = tmp / 'testcase.in'
+
+            if run is None:
+                seed = t.seed
+            else:
+                key = combine_hashes([t.generator.program.hash, t.generator.command_string])
+                if key in self.seed_dependency:
+                    # Another seed already gave a different result.
+                    localbar.done()
+                    return
+                seed = (t.seed + 1 + run) % (2**31)
+
+            tmp.mkdir(parents=True, exist_ok=True)
+            with self.generator_slot(t):
+                result = t.generator.run(localbar, tmp, tmp_infile.stem, seed, t.config.retries)
+            # This is checked when running the generator.
+            same = result.status and cache.hash_stored(infile) == hash_file_content(tmp_infile)
+            shutil.rmtree(tmp)
+            if not result.status:
+                localbar.done()
+                return
 
-        def count_dir(d):
-            for name in d.includes:
-                item_names.append(d.path / name)
+            if run is None:
+                if same:
+                    self.manifest.update(t.hash, deterministic=True)
+                    if config.args.check_deterministic:
+                        localbar.part_done(True, 'Generator is deterministic.')
+                else:
+                    localbar.part_done(
+                        False, f'Generator `{t.generator.command_string}` is not deterministic.'
+                    )
+                localbar.done()
+                return
+
+            with lock:
+                remaining[key] -= 1
+                if not same:
+                    self.seed_dependency.set(key, {'command': t.generator.command_string})
+                last = remaining[key] == 0
+            if not same:
+                if config.args.check_deterministic:
+                    localbar.debug('Generator depends on seed.')
+            elif last and key not in self.seed_dependency:
+                localbar.log(
+                    f'Generator `{t.generator.command_string}` likely does not depend on seed:',
+                    f'All values in [{t.seed}, {t.seed + config.SEED_DEPENDENCY_RETRIES}] give the same result.',
+                )
+            localbar.done()
 
-        self.root_dir.walk(None, count_dir)
-        bar = ProgressBar('Generate', items=item_names)
+        parallel.run_tasks(check, tasks, num_threads=self.jobs)
+        bar.finalize(print_done=False)
+
+    # Whether the testcase is generated by the current shard, see `generate --shard i/n`.
+    # Testcases are partitioned by their hash. Testcases without a hash only report their error in
+    # the first shard.
+    def in_shard(self, t):
+        if not config.args.shard:
+            return True
+        index, count = config.args.shard
+        if t.hash is None:
+            return index == 1
+        return int(t.hash, 16) % count == index - 1
+
+    # Write the cache directories and manifest entries of the generated testcases to a tar file,
+    # see `generate --export-cache`. The compression is determined by the suffix, e.g. .tar.gz.
+    def export_cache(self, path):
+        hashes = []
+
+        def add_hash(t):
+            if t.copy_of is None and getattr(t, 'generate_success', False) and self.in_shard(t):
+                hashes.append(t.hash)
+
+        self.root_dir.walk(add_hash, dir_f=None)
+        entries = {h: self.manifest.get(h) for h in hashes if h in self.manifest}
+
+        mode = {'.gz': 'w:gz', '.tgz': 'w:gz', '.bz2': 'w:bz2', '.xz': 'w:xz'}.get(path.suffix, 'w')
+        tmp_path = path.with_name(path.name + f'.{secrets.token_hex(4)}')
+        try:
+            with tarfile.open(tmp_path, mode) as tar:
+                for h in entries:
+                    tar.add(self.problem.tmpdir / 'data' / h, arcname=f'data/{h}')
+                manifest = json.dumps(entries).encode()
+                info = tarfile.TarInfo('manifest.json')
+                info.size = len(manifest)
+                tar.addfile(info, io.BytesIO(manifest))
+            tmp_path.replace(path)
+        except OSError as e:
+            tmp_path.unlink(missing_ok=True)
+            error(f'Could not export the cache to {path}: {e}')
+            return
+        log(f'Exported {len(entries)} cached testcases to {path}.')
+
+    # Add the cache directories and manifest entries in a tar file written by export_cache, e.g. by
+    # other shards, so that their testcases are up to date and only have to be copied to data/.
+    # Existing cache directories of the imported testcases are replaced.
+    def import_cache(self, path):
+        datadir = self.problem.tmpdir / 'data'
+        try:
+            with tarfile.open(path) as tar:
+                manifest = tar.extractfile('manifest.json')
+                entries = json.load(manifest)
+                # The keys are used as directory names, so only accept actual hashes.
+                if not isinstance(entries, dict) or not all(
+                    re.fullmatch('[0-9a-f]+', h) and isinstance(entry, dict)
+                    for h, entry in entries.items()
+                ):
+                    error(f'{path}: invalid manifest.json. Skipping import.')
+                    return
+                members = []
+                for member in tar.getmembers():
+                    parts = PurePosixPath(member.name).parts
+                    if member.name == 'manifest.json':
+                        continue
+                    if len(parts) < 2 or parts[0] != 'data' or parts[1] not in entries:
+                        error(f'{path}: unexpected file {member.name}. Skipping import.')
+                        return
+                    members.append(member)
+                for h in entries:
+                    if (datadir / h).exists():
+                        shutil.rmtree(datadir / h)
+                # The data filter rejects e.g. links outside the tmpdir, where available.
+                filter_args = {'filter': 'data'} if hasattr(tarfile, 'data_filter') else {}
+                tar.extractall(self.problem.tmpdir, members=members, **filter_args)
+        except (OSError, KeyError, ValueError, tarfile.TarError) as e:
+            error(f'Could not import the cache from {path}: {e}')
+            return
+        for h, entry in entries.items():
+            self.manifest.set(h, entry)
+        log(f'Imported {len(entries)} cached testcases from {path}.')
+
+    # Print the time spent in each stage and the size of the generated files, as recorded in the
+    # manifest when the testcases were generated.
+    def print_profile(self, top=10):
+        rules = []
+        self.root_dir.walk(
+            lambda t: t.copy_of is None and t.hash is not None and rules.append(t), dir_f=None
+        )
+
+        # Each profile entry is a [wall, cpu] pair in seconds. The CPU time is None when unknown.
+        by_rule = []
+        by_stage = {stage: [0, 0] for stage in PROFILE_STAGES}
+        by_generator = collections.defaultdict(lambda: [0, 0, 0])
+        files = []
+        for t in rules:
+            entry = self.manifest.get(t.hash) or dict()
+            profile = entry.get('profile', dict())
+            wall = sum(p[0] for p in profile.values())
+            cpu = 0
+            for p in profile.values():
+                cpu = add_cpu_time(cpu, p[1])
+            by_rule.append((wall, cpu, t, profile))
+            for stage, (stage_wall, stage_cpu) in profile.items():
+                if stage in by_stage:
+                    by_stage[stage][0] += stage_wall
+                    by_stage[stage][1] = add_cpu_time(by_stage[stage][1], stage_cpu)
+            if t.generator and 'generator' in profile:
+                totals = by_generator[str(t.generator.program_path)]
+                totals[0] += profile['generator'][0]
+                totals[1] = add_cpu_time(totals[1], profile['generator'][1])
+                totals[2] += 1
+            for ext, size in entry.get('sizes', dict()).items():
+                files.append((size, f'{t.path}{ext}'))
+
+        def header(title):
+            print(file=sys.stderr)
+            print(Style.BRIGHT + title + Style.RESET_ALL, file=sys.stderr)
+
+        def line(name, *columns):
+            print(f'{name:<40} ' + ' '.join(f'{c:>10}' for c in columns), file=sys.stderr)
+
+        def seconds(t):
+            return '-' if t is None else f'{t:.2f}s'
+
+        header(f'Slowest testcases (of {len(by_rule)})')
+        line('testcase', 'wall', 'cpu', *(stage.split('_')[0] for stage in PROFILE_STAGES))
+        for wall, cpu, t, profile in sorted(by_rule, key=lambda r: -r[0])[:top]:
+            stages = [seconds(profile[s][0]) if s in profile else '-' for s in PROFILE_STAGES]
+            line(str(t.path), seconds(wall), seconds(cpu), *stages)
+
+        header(f'Largest files (of {len(files)})')
+        line('file', 'size')
+        for size, name in sorted(files, reverse=True)[:top]:
+            line(name, f'{size / 1024:.1f} KiB')
+
+        header('Total by stage')
+        line('stage', 'wall', 'cpu')
+        for stage, (wall, cpu) in by_stage.items():
+            line(stage, seconds(wall), seconds(cpu))
+
+        header('Total by generator')
+        line('generator', 'wall', 'cpu', 'testcases')
+        for name, (wall, cpu, count) in sorted(by_generator.items(), key=lambda g: -g[1][0]):
+            line(name, seconds(wall), seconds(cpu), count)
+
+    # Move the output of a batch generator run for testcase t into cwd.
+    # Returns False when there is no such output.
+    def take_batch_output(self, t, cwd):
+        output = self.batch_outputs.pop(t.hash, None)
+        if output is None:
+            return False
+        outdir, share = output
+        ExecProfile.record(*share)
+        for f in outdir.iterdir():
+            f.replace(cwd / f.name)
+        outdir.rmdir()
+        return True
+
+    # The pipeline stage in which the generator of testcase t runs, see _run.
+    def generator_stage(self, t):
+        if t.config.max_parallel:
+            return f'generator {t.config.max_parallel[0]}'
+        if t.config.memory:
+            return 'generator (memory)'
+        return 'generator'
+
+    # Hold while running the generator of testcase t, to respect its `max_parallel:` and
+    # `memory:` limits. Within the pipeline, waiting does not count as a running job.
+    @contextlib.contextmanager
+    def generator_slot(self, t):
+        if not t.config.max_parallel and not t.config.memory:
+            yield
+            return
+        with contextlib.ExitStack() as stack:
+            with self.pipeline.waiting() if self.pipeline else contextlib.nullcontext():
+                if t.config.max_parallel:
+                    path, limit = t.config.max_parallel
+                    # setdefault is atomic, so all threads get the same semaphore.
+                    semaphore = self.parallel_limits.setdefault(path, threading.Semaphore(limit))
+                    stack.enter_context(semaphore)
+                stack.enter_context(self.memory_budget.reserve(t.config.memory))
+            yield
+
+    def _run(self, bar):
 
         # Testcases are generated in two steps:
         # 1. Generate directories and unique testcases listed in generators.yaml.
-        # 2. Generate duplicates of known testcases. All directories should already exists
-        #    Each directory is only started after previous directories have
-        #    finished and handled by the main thread, to avoid problems with
-        #    included testcases.
+        # 2. Generate duplicates of known testcases, and then link included testcases.
+        #    All directories and testcases exist already, so these are independent tasks.
 
         # 1
-        p = parallel.new_queue(lambda t: t.copy_of is None and t.generate(self.problem, self, bar))
+        # The steps of generating a testcase run in a pipeline, see TestcaseRule.generate_stages.
+        # Generators with a `max_parallel:` or `memory:` limit run in a stage of their own, so that
+        # waiting for them does not keep other generators from running.
+        generator_stages = dict()
+
+        def add_generator_stage(t):
+            if t.generator is not None and t.copy_of is None:
+                limit = t.config.max_parallel[1] if t.config.max_parallel else None
+                generator_stages[self.generator_stage(t)] = limit
+
+        self.root_dir.walk(add_generator_stage, dir_f=None)
+        generator_stages.pop('generator', None)
+        stages = [(stage, None) for stage in GENERATE_STAGES]
+        stages[GENERATE_STAGES.index('solution')] = ('solution', config.args.solution_jobs)
+        stages[1:1] = sorted(generator_stages.items())
+        p = parallel.Pipeline(lambda steps, stage: next(steps, None), stages, self.jobs)
+        self.pipeline = p
+
+        def generate_testcase(t):
+            if t.copy_of is None and self.in_shard(t):
+                p.put(t.generate_stages(self.problem, self, bar))
 
         def generate_dir(d):
             p.join()
             d.generate(self.problem, self, bar)
 
-        self.root_dir.walk(p.put, generate_dir)
+        self.root_dir.walk(generate_testcase, generate_dir)
         p.done()
+        self.pipeline = None
 
-        # 2
-        p = parallel.new_queue(
-            lambda t: t.copy_of is not None and t.generate(self.problem, self, bar)
-        )
+        if config.args.shard:
+            return
 
-        def generate_copies_and_includes(d):
-            p.join()
-            d.generate_includes(self.problem, self, bar)
+        # 2
+        # An included testcase may be a duplicate, so includes are only linked once all duplicates
+        # are generated.
+        def generate_copy_or_include(task):
+            if isinstance(task, TestcaseRule):
+                task.generate(self.problem, self, bar)
+            else:
+                d, key = task
+                d.generate_include(key, self.problem, self, bar)
 
-        self.root_dir.walk(p.put, generate_copies_and_includes)
+        p = parallel.new_queue(generate_copy_or_include, num_threads=self.jobs)
+        self.root_dir.walk(lambda t: t.copy_of is not None and p.put(t), dir_f=None)
+        p.join()
+        self.root_dir.walk(None, lambda d: [p.put((d, key)) for key in d.includes])
         p.done()
 
-        bar.finalize()
+    # A lock per testcase, held while validating it as an included testcase, see
+    # Directory.generate_include.
+    def include_lock(self, test_hash):
+        # setdefault is atomic, so all threads get the same lock.
+        return self.include_locks.setdefault(test_hash, threading.Lock())
+
+    # The content hash of a file in data/, recomputed only when its stat changed since it was
+    # hashed or written by deploy().
+    def deployed_hash(self, path):
+        key = str(path.relative_to(self.problem.path))
+        stat = path.stat()
+        signature = [stat.st_mtime_ns, stat.st_size, stat.st_ino]
+        entry = self.deployed.get(key)
+        if entry is not None and entry['stat'] == signature:
+            return entry['hash']
+        file_hash = hash_file_content(path)
+        self.deployed.set(key, {'hash': file_hash, 'stat': signature})
+        return file_hash
+
+    # Copy a generated file with the given content hash from the cache into data/.
+    # Compressed cached files are decompressed as a stream.
+    def deploy(self, source, target, file_hash):
+        if source.is_file():
+            clone_file(source, target)
+        else:
+            cache.decompress_file(source, target)
+        stat = target.stat()
+        self.deployed.set(
+            str(target.relative_to(self.problem.path)),
+            {'hash': file_hash, 'stat': [stat.st_mtime_ns, stat.st_size, stat.st_ino]},
+        )
 
     # move a file or into the trash directory
     def remove(self, src):
@@ -1741,6 +2852,7 @@ class GeneratorConfig:
         dst.parent.mkdir(parents=True, exist_ok=True)
 
         shutil.move(src, dst)
+        self.deployed.remove(str(src.relative_to(self.problem.path)))
 
     def _remove_unknown(self, path, bar, silent=False):
         local = path.relative_to(self.problem.path / 'data')
@@ -1755,7 +2867,7 @@ class GeneratorConfig:
             if path.is_dir():
                 # specially handle known .in files to reduce output noice
                 for f in sorted(path.glob('*.in')):
-                    if f.is_file() and hash_file_content(f) in self.hashed_in:
+                    if f.is_file() and self.deployed_hash(f) in self.hashed_in:
                         for ext in config.KNOWN_TEXT_DATA_EXTENSIONS:
                             tmp = f.with_suffix(ext)
                             if tmp.is_file():
@@ -1773,7 +2885,10 @@ class GeneratorConfig:
     def clean_up(self):
         bar = ProgressBar('Clean Up', max_len=-1)
 
-        self._remove_unknown(self.problem.path / 'data', bar)
+        try:
+            self._remove_unknown(self.problem.path / 'data', bar)
+        finally:
+            self.deployed.flush()
         if self.trashdir is not None:
             bar.warn('Some files were changed/removed.', f'-> {self.trashdir}')
         bar.finalize()
@@ -1915,10 +3030,57 @@ def generate(problem):
     if gen_config.has_yaml:
         gen_config.build()
         gen_config.run()
-        gen_config.clean_up()
+        # Files of other shards are unknown to this one, so they must not be removed.
+        if not config.args.shard:
+            gen_config.clean_up()
+        if config.args.action == 'generate' and config.args.watch:
+            watch_problem(problem, gen_config)
     return True
 
 
+# Regenerate the testcases whenever a file of the problem changes, until interrupted.
+# The parsed config and the built programs are kept: only programs whose sources changed are
+# rebuilt, after which run() only regenerates the testcases that are not up to date anymore.
+# Any other change, e.g. to generators.yaml, parses the config and builds everything again.
+def watch_problem(problem, gen_config):
+    watcher = watch.Watcher(problem.path, exclude=[problem.path / 'data'])
+    log(f'Watching for changes using {watcher.method}. Press Ctrl-C to stop.')
+    try:
+        while True:
+            changed = watcher.wait()
+            start = time.monotonic()
+            names = sorted(str(path.relative_to(problem.path)) for path in changed)
+            log(f'Changed: {", ".join(names)}')
+
+            # After a failed parse, the config is parsed again on any change.
+            rebuilt = gen_config.rebuild(changed) if gen_config is not None else False
+            if rebuilt is None:
+                error('Build failed. Waiting for changes.')
+                continue
+            if rebuilt is False:
+                problem.reset_programs(validators=True)
+                try:
+                    gen_config = GeneratorConfig(problem, config.args.testcases)
+                except SystemExit:
+                    # Fatal parse errors exit, but should not stop watching.
+                    gen_config = None
+                    error('Parsing generators.yaml failed. Waiting for changes.')
+                    continue
+                if not gen_config.has_yaml:
+                    gen_config = None
+                    error('Did not find generators/generators.yaml')
+                    continue
+                gen_config.build()
+            gen_config.run()
+            if not config.args.shard:
+                gen_config.clean_up()
+            log(f'Done in {time.monotonic() - start:.2f}s. Waiting for changes.')
+    except KeyboardInterrupt:
+        print(file=sys.stderr)
+    finally:
+        watcher.close()
+
+
 def testcases(problem, symlinks=False):
     gen_config = GeneratorConfig(problem)
     if gen_config.has_yaml:
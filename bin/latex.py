@@ -8,6 +8,7 @@ import sys
 from pathlib import Path
 from colorama import Fore, Style
 
+import cache
 import config
 import util
 import generate
@@ -18,6 +19,7 @@ from contest import *
 def latex_builddir(problem, language):
     builddir = problem.tmpdir / 'latex' / language
     builddir.mkdir(parents=True, exist_ok=True)
+    cache.touch(builddir)
     return builddir
 
 
@@ -193,7 +195,53 @@ def make_environment():
     return env
 
 
-def build_latex_pdf(builddir, tex_path, language, bar=None, problem_path=None):
+# The files read by the last LaTeX run, as recorded by latexmk in the .fls file.
+def recorded_inputs(fls_path):
+    if not fls_path.is_file():
+        return None
+    cwd = None
+    inputs = set()
+    for line in fls_path.read_text(errors='replace').splitlines():
+        kind, _, value = line.partition(' ')
+        if kind == 'PWD':
+            cwd = Path(value)
+        elif kind == 'INPUT':
+            path = Path(value)
+            if not path.is_absolute() and cwd is not None:
+                path = cwd / path
+            inputs.add(path)
+    return sorted(inputs)
+
+
+# The directories of a problem in which files are looked up by name when building its statement,
+# e.g. samples, and images or solution files tested with \IfFileExists.
+def problem_listed_dirs(problem):
+    return [problem.path / 'data' / 'sample', problem.path / 'problem_statement']
+
+
+# The relative paths of all files in a directory, recursively.
+def directory_listing(path):
+    return sorted(
+        str(Path(root, f).relative_to(path)) for root, dirs, files in os.walk(path) for f in files
+    )
+
+
+# Hash the latexmk command, the content of all files read by LaTeX, and the listings of the given
+# directories. The .fls file only records the files that LaTeX opened, so the listings make sure
+# that creating a file that LaTeX probed for but did not find also triggers a rebuild.
+def inputs_hash(latexmk_command, env, inputs, listed_dirs):
+    hashes = {
+        'command': ' '.join(str(x) for x in latexmk_command),
+        'texinputs': env['TEXINPUTS'],
+    }
+    for path in inputs:
+        hashes[str(path)] = hash_file_content(path) if path.is_file() else None
+    for path in listed_dirs:
+        hashes[f'listing:{path}'] = directory_listing(path)
+    return combine_hashes_dict(hashes)
+
+
+def build_latex_pdf(builddir, tex_path, language, bar=None, problem_path=None, listed_dirs=[]):
     env = make_environment()
 
     if shutil.which('latexmk') == None:
@@ -250,6 +298,21 @@ def build_latex_pdf(builddir, tex_path, language, bar=None, problem_path=None):
 
     latexmk_command.append(tex_path.absolute())
 
+    # The content hash of all inputs of the last successful build is stored next to the pdf.
+    # When none of them changed, running latexmk is skipped completely.
+    fls_path = (builddir / tex_path.name).with_suffix('.fls')
+    hash_path = (builddir / tex_path.name).with_suffix('.inputs_hash')
+    use_hash = not config.args.watch and config.args.open is None
+    if use_hash and not config.args.force_build and built_pdf.is_file() and hash_path.is_file():
+        inputs = recorded_inputs(fls_path)
+        if inputs is not None and hash_path.read_text() == inputs_hash(
+            latexmk_command, env, inputs, listed_dirs
+        ):
+            ensure_symlink(dest_path, built_pdf, True)
+            bar.log(f'PDF up to date: {dest_path}\n')
+            return True
+    hash_path.unlink(True)
+
     def run_latexmk(stdout, stderr):
         logfile.unlink(True)
         return util.exec_command(
@@ -292,6 +355,10 @@ def build_latex_pdf(builddir, tex_path, language, bar=None, problem_path=None):
         return False
 
     assert not config.args.watch
+    if use_hash:
+        inputs = recorded_inputs(fls_path)
+        if inputs is not None:
+            hash_path.write_text(inputs_hash(latexmk_command, env, inputs, listed_dirs))
     ensure_symlink(dest_path, built_pdf, True)
 
     bar.log(f'PDF written to {dest_path}\n')
@@ -332,7 +399,9 @@ def build_problem_pdf(problem, language, solution=False, web=False):
         },
     )
 
-    return build_latex_pdf(builddir, builddir / main_file, language, bar, problem.path)
+    return build_latex_pdf(
+        builddir, builddir / main_file, language, bar, problem.path, problem_listed_dirs(problem)
+    )
 
 
 def build_problem_pdfs(problem, solutions=False, web=False):
@@ -379,6 +448,7 @@ def find_logo():
 def build_contest_pdf(contest, problems, tmpdir, language, solutions=False, web=False):
     builddir = tmpdir / contest / 'latex'
     builddir.mkdir(parents=True, exist_ok=True)
+    cache.touch(builddir)
     build_type = 'solution' if solutions else 'problem'
 
     main_file = 'solutions' if solutions else 'contest'
@@ -471,7 +541,13 @@ def build_contest_pdf(contest, problems, tmpdir, language, solutions=False, web=
 
     (builddir / f'contest-{build_type}s.tex').write_text(problems_data)
 
-    return build_latex_pdf(builddir, Path(main_file), language, bar)
+    return build_latex_pdf(
+        builddir,
+        Path(main_file),
+        language,
+        bar,
+        listed_dirs=[d for problem in problems for d in problem_listed_dirs(problem)],
+    )
 
 
 def build_contest_pdfs(contest, problems, tmpdir, lang=None, solutions=False, web=False):
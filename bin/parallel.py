@@ -1,4 +1,5 @@
 #!/usr/bin/env python3
+import contextlib
 import heapq
 import os
 import signal
@@ -223,23 +224,119 @@ class ParallelQueue(AbstractQueue):
                 self.all_done.notify_all()
 
 
-def new_queue(f, pin=False):
+def new_queue(f, pin=False, num_threads=None):
     """
     f(task): the function to run on each queue item.
 
     pin: whether to pin the threads to (physical) CPU cores.
+
+    num_threads: the number of threads to use instead of config.args.jobs.
     """
     pin = pin and not util.is_windows() and not util.is_bsd()
 
-    num_threads = config.args.jobs
+    if num_threads is None:
+        num_threads = config.args.jobs
     if num_threads:
         return ParallelQueue(f, pin, num_threads)
     else:
         return SequentialQueue(f, pin)
 
 
-def run_tasks(f, tasks: list, pin=False):
-    queue = new_queue(f, pin)
+def run_tasks(f, tasks: list, pin=False, num_threads=None):
+    queue = new_queue(f, pin, num_threads)
     for task in tasks:
         queue.put(task)
     queue.done()
+
+
+# A queue per stage of processing a task, so that each stage has its own number of threads.
+# f(task, stage) runs one stage of the task and returns the next stage, or None when the task
+# is done. Tasks only move forward through the stages, so joining the queues in order waits
+# for all tasks. In total at most num_threads (by default config.args.jobs) stages run at the
+# same time.
+class Pipeline:
+    def __init__(self, f, stages: list[tuple[str, int | None]], num_threads=None):
+        self.f = f
+        self.stages = [stage for stage, _ in stages]
+        if num_threads is None:
+            num_threads = config.args.jobs
+        self.running = threading.BoundedSemaphore(num_threads) if num_threads else None
+        self.queues = dict()
+        for stage, limit in stages:
+
+            def run(task, stage=stage):
+                self._run(task, stage)
+
+            if num_threads:
+                threads = min(limit, num_threads) if limit else num_threads
+                self.queues[stage] = ParallelQueue(run, False, threads)
+            else:
+                self.queues[stage] = SequentialQueue(run, False)
+
+    def _run(self, task, stage):
+        if self.running is not None:
+            with self.running:
+                next_stage = self.f(task, stage)
+        else:
+            next_stage = self.f(task, stage)
+        if next_stage is not None:
+            assert self.stages.index(next_stage) >= self.stages.index(stage)
+            self.queues[next_stage].put(task)
+
+    # Add a task to the first stage.
+    def put(self, task):
+        self.queues[self.stages[0]].put(task)
+
+    def _for_each_queue(self, f):
+        try:
+            for stage in self.stages:
+                f(self.queues[stage])
+        except:
+            for queue in self.queues.values():
+                queue.abort()
+            raise
+
+    # Used by a stage that waits for a resource, e.g. a Budget, so that the waiting task does not
+    # count towards the number of running stages.
+    @contextlib.contextmanager
+    def waiting(self):
+        if self.running is None:
+            yield
+            return
+        self.running.release()
+        try:
+            yield
+        finally:
+            self.running.acquire()
+
+    # Wait for all current tasks to pass through all stages.
+    def join(self):
+        self._for_each_queue(lambda queue: queue.join())
+
+    # Wait for all tasks to be done and stop all threads.
+    def done(self):
+        self._for_each_queue(lambda queue: queue.done())
+
+
+# Limits the total size, e.g. memory, of the tasks that run at the same time.
+# A task larger than the total still runs, but only when no other task is running.
+class Budget:
+    def __init__(self, total):
+        self.total = total
+        self.used = 0
+        self.changed = threading.Condition()
+
+    @contextlib.contextmanager
+    def reserve(self, amount):
+        if not amount:
+            yield
+            return
+        with self.changed:
+            self.changed.wait_for(lambda: self.used == 0 or self.used + amount <= self.total)
+            self.used += amount
+        try:
+            yield
+        finally:
+            with self.changed:
+                self.used -= amount
+                self.changed.notify_all()
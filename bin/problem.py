@@ -9,6 +9,7 @@ from pathlib import Path
 from typing import Type
 
 import config
+import cache
 import latex
 import parallel
 import program
@@ -43,7 +44,13 @@ class Problem:
         self._program_callbacks = dict()
         # Dictionary from path to parsed file contents.
         self._testdata_yamls = dict()
+        # Dictionary from directory in data/ to the flags applying to it.
+        self._testdata_index = dict()
         self._testdata_lock = threading.Lock()
+        # Persistent caches in the tmpdir, opened on first use.
+        self._file_hashes = None
+        self._validation_cache = None
+        self._cache_lock = threading.Lock()
 
         # The label for the problem: A, B, A1, A2, X, ...
         self.label = label
@@ -57,6 +64,29 @@ class Problem:
 
         self.statement_languages = self._determine_statement_languages()
 
+    # Map from absolute paths to content hashes, only rehashing files whose stat changed.
+    def file_hashes(self):
+        with self._cache_lock:
+            if self._file_hashes is None:
+                self._file_hashes = cache.FileHashes(self.tmpdir / 'cache.sqlite')
+            return self._file_hashes
+
+    # Map from (validator, flags, mode, file hashes) to the validation result.
+    def validation_cache(self):
+        with self._cache_lock:
+            if self._validation_cache is None:
+                self._validation_cache = cache.Manifest(
+                    self.tmpdir / 'cache.sqlite', table='validation'
+                )
+            return self._validation_cache
+
+    # Write the persistent caches that were used back to disk.
+    def flush_caches(self):
+        with self._cache_lock:
+            for c in [self._file_hashes, self._validation_cache]:
+                if c is not None:
+                    c.flush()
+
     def _determine_statement_languages(self):
         """Determine the languages that are both mentioned in the problem.yaml under name
         and have a corresponding problem statement.
@@ -176,65 +206,95 @@ class Problem:
             yaml_path.write_text(raw)
             log(f'Generated UUID for {self.name}, added to problem.yaml')
 
-    def _parse_testdata_yaml(p, path, bar):
-        assert path.is_relative_to(p.path / 'data')
-        for dir in [path] + list(path.parents):
-            # Do not go above the data directory.
-            if dir == p.path:
-                return
+    def _parse_testdata_yaml(p, f, bar):
+        p._testdata_yamls[f] = flags = read_yaml(f, plain=True)
+
+        # verify testdata.yaml
+        for k in flags:
+            match k:
+                case 'output_validator_flags':
+                    if not isinstance(flags[k], str):
+                        bar.error(
+                            "ouput_validator_flags must be string",
+                            resume=True,
+                            print_item=False,
+                        )
+                case 'input_validator_flags':
+                    if not isinstance(flags[k], (str, dict)):
+                        bar.error(
+                            "input_validator_flags must be string or map",
+                            resume=True,
+                            print_item=False,
+                        )
+                    if isinstance(flags[k], dict):
+                        input_validator_names = set(
+                            val.name for val in p.validators(validate.InputValidator)
+                        )
+                        for name in set(flags[k]) - input_validator_names:
+                            bar.warn(
+                                f'Unknown input validator {name}; expected {input_validator_names}',
+                                print_item=False,
+                            )
+                case 'grading' | 'run_samples':
+                    bar.warn(f'{k} not implemented in BAPCtools', print_item=False)
+                case _:
+                    path = f.relative_to(p.path / 'data')
+                    bar.warn(f'Unknown key "{k}" in {path}', print_item=False)
+        return flags
+
+    def _resolve_testdata_flags(p, dir, bar):
+        """
+        The flags applying to the given directory, combining the testdata.yaml files in it and
+        all its parents up to data/. Computed once per directory and stored in the index.
 
-            f = dir / 'testdata.yaml'
-            if not f.is_file() or f in p._testdata_yamls:
-                continue
-            with p._testdata_lock:
-                if not f in p._testdata_yamls:
-                    p._testdata_yamls[f] = flags = read_yaml(f, plain=True)
-
-                    # verify testdata.yaml
-                    for k in flags:
-                        match k:
-                            case 'output_validator_flags':
-                                if not isinstance(flags[k], str):
-                                    bar.error(
-                                        "ouput_validator_flags must be string",
-                                        resume=True,
-                                        print_item=False,
-                                    )
-                            case 'input_validator_flags':
-                                if not isinstance(flags[k], (str, dict)):
-                                    bar.error(
-                                        "input_validator_flags must be string or map",
-                                        resume=True,
-                                        print_item=False,
-                                    )
-                                if isinstance(flags[k], dict):
-                                    input_validator_names = set(
-                                        val.name for val in p.validators(validate.InputValidator)
-                                    )
-                                    for name in set(flags[k]) - input_validator_names:
-                                        bar.warn(
-                                            f'Unknown input validator {name}; expected {input_validator_names}',
-                                            print_item=False,
-                                        )
-                            case 'grading' | 'run_samples':
-                                bar.warn(f'{k} not implemented in BAPCtools', print_item=False)
-                            case _:
-                                path = f.relative_to(p.path / 'data')
-                                bar.warn(f'Unknown key "{k}" in {path}', print_item=False)
-            # Do not go above the data directory.
-            if dir == p.path / 'data':
-                break
+        Returns
+        -------
+        A tuple (output_validator_flags, input_validator_flags, input_validator_flags_by_name),
+        where input_validator_flags applies to all input validators not in the dict.
+        """
+        if dir in p._testdata_index:
+            return p._testdata_index[dir]
+
+        if dir == p.path / 'data':
+            resolved = (None, None, dict())
+        else:
+            resolved = p._resolve_testdata_flags(dir.parent, bar)
+
+        f = dir / 'testdata.yaml'
+        if f.is_file():
+            flags = p._testdata_yamls.get(f) or p._parse_testdata_yaml(f, bar)
+            output_flags, input_flags, input_flags_by_name = resolved
+            if 'output_validator_flags' in flags:
+                output_flags = flags['output_validator_flags']
+            if 'input_validator_flags' in flags:
+                if isinstance(flags['input_validator_flags'], dict):
+                    input_flags_by_name = input_flags_by_name | flags['input_validator_flags']
+                else:
+                    input_flags = flags['input_validator_flags']
+                    input_flags_by_name = dict()
+            resolved = (output_flags, input_flags, input_flags_by_name)
+
+        p._testdata_index[dir] = resolved
+        return resolved
+
+    # Forget all parsed testdata.yaml files, e.g. after generate changed them.
+    def reset_testdata_yamls(p):
+        with p._testdata_lock:
+            p._testdata_yamls = dict()
+            p._testdata_index = dict()
 
     def get_testdata_yaml(p, path, key, bar, name=None) -> str | None:
         """
-        Find the testdata flags applying at the given path for the given key.
-        If necessary, walk up from `path` looking for the first testdata.yaml file that applies,
+        Find the testdata flags applying at the given directory for the given key.
+        These come from the first testdata.yaml file that applies, walking up from `path`.
 
-        Side effects: parses and caches the file.
+        Side effects: parses and caches the testdata.yaml files, and stores the flags
+        applying to `path` and its parents in an index, so that later lookups in the
+        same directory are a single dictionary lookup.
 
         Arguments
         ---------
-        path: absolute path (a file or a directory)
+        path: absolute path of a directory in data/
         key: The testdata.yaml key to look for, either of 'input_validator_flags', 'output_validator_flags', or 'grading'.
             'grading' is not implemented
         name: If key == 'input_validator_flags', optionally the name of the input validator
@@ -251,32 +311,16 @@ class Problem:
                 f"Only input validators support flags by validator name, got {key} and {name}"
             )
 
-        # parse and cache testdata.yaml
-        p._parse_testdata_yaml(path, bar)
-
-        # exctract the flags
-        for dir in [path] + list(path.parents):
-            # Do not go above the data directory.
-            if dir == p.path:
-                return None
+        resolved = p._testdata_index.get(path)
+        if resolved is None:
+            assert is_relative_to(p.path / 'data', path)
+            with p._testdata_lock:
+                resolved = p._resolve_testdata_flags(path, bar)
 
-            f = dir / 'testdata.yaml'
-            if f not in p._testdata_yamls:
-                continue
-            flags = p._testdata_yamls[f]
-            if key in flags:
-                if key == 'output_validator_flags':
-                    if not isinstance(flags[key], str):
-                        bar.error("ouput_validator_flags must be string")
-                    return flags[key]
-
-                if key == 'input_validator_flags':
-                    if not isinstance(flags[key], (str, dict)):
-                        bar.error("input_validator_flags must be string or map")
-                    if isinstance(flags[key], str):
-                        return flags[key]
-                    elif name in flags[key]:
-                        return flags[key][name]
+        output_flags, input_flags, input_flags_by_name = resolved
+        if key == 'output_validator_flags':
+            return output_flags
+        return input_flags_by_name.get(name, input_flags)
 
     def testcases(
         p,
@@ -558,18 +602,15 @@ class Problem:
                 )
             ]
 
-        skip_double_build_warning = (
-            check_constraints  # or not paths_for_class[Class.ANSWER] TODO not sure about this
-        )
-        validators = [
-            cls(
-                problem,
-                path,
-                skip_double_build_warning=skip_double_build_warning,
-                check_constraints=check_constraints,
-            )
-            for path in paths
-        ]
+            # Constraint checking only passes an extra argument when running the validators,
+            # so the validators built for normal validation are reused.
+            problem.validators(cls)
+            validators = [problem._programs[path] for path in paths]
+            build_ok = all(v.ok for v in validators)
+            problem._validators[key] = validators if ok and build_ok else []
+            return validators
+
+        validators = [cls(problem, path) for path in paths]
         bar = ProgressBar(f'Building {cls.__str__(cls)} validator', items=validators)
         build_ok = True
 
@@ -735,6 +776,25 @@ class Problem:
     def reset_testcase_hashes(self):
         self._testcase_hashes = {}
 
+    # Forget built programs, so that they are built again on their next use, e.g. after their
+    # sources changed during `generate --watch`.
+    # paths: the programs to forget, or None to forget all programs and their callbacks.
+    # validators: also forget all validators.
+    def reset_programs(self, paths=None, validators=False):
+        if paths is None:
+            self._programs = dict()
+            self._program_callbacks = dict()
+        else:
+            for path in paths:
+                self._programs.pop(path, None)
+        if validators:
+            self._validators = dict()
+            self._programs = {
+                path: p
+                for path, p in self._programs.items()
+                if not isinstance(p, validate.Validator)
+            }
+
     # Returns None for new testcases or the Testcase object it equals.
     def matches_existing_testcase(self, t):
         if t.root in ['invalid_input', 'invalid_answer']:
@@ -745,6 +805,59 @@ class Problem:
         self._testcase_hashes[h] = t
         return None
 
+    # The maximum number of testcases validated by a single validator process in batch mode.
+    VALIDATOR_BATCH_SIZE = 100
+
+    def _run_validator_batches(problem, testcases, mode: validate.Mode, constraints: dict | None):
+        """Run the input validators that support batch mode (see headers/validation.h) on all
+        testcases, with a single process for many testcases. The results are stored in the
+        testcases, and validate_format then only runs the validators on the testcases that were not
+        validated.
+        """
+        if mode == validate.Mode.ANSWER:
+            return
+        # Get the validators before starting the bar, since building them uses a bar as well.
+        validators = problem.validators(
+            validate.InputValidator, check_constraints=constraints is not None
+        )
+
+        tasks = []
+        bar = ProgressBar('Batch validation', max_len=1, count=0)
+        for validator in validators:
+            if not validator.supports_batch():
+                continue
+            # Jobs with a different number of arguments can not share a process.
+            groups = dict()
+            for t in testcases:
+                args = t.validator_batch_args(
+                    validator, validate.Mode.INPUT, bar=bar, constraints=constraints
+                )
+                if args is not None:
+                    groups.setdefault(len(args), []).append((t, args))
+            for jobs in groups.values():
+                size = min(problem.VALIDATOR_BATCH_SIZE, -(-len(jobs) // max(config.args.jobs, 1)))
+                for i in range(0, len(jobs), size):
+                    tasks.append((validator, jobs[i : i + size]))
+                    bar.update(1, len(validator.name))
+
+        # The constraints of each job are collected separately, so that they can be cached with
+        # the result of the job, and are merged into constraints by Testcase._run_validator.
+        def run_batch(task):
+            validator, jobs = task
+            localbar = bar.start(validator.name)
+            collected = None if constraints is None else [dict() for _ in jobs]
+            results = validator.run_batch(jobs, collected)
+            for i, ((t, args), ret) in enumerate(zip(jobs, results)):
+                if ret is not None:
+                    t.batch_results[(validator, validate.Mode.INPUT, tuple(args))] = (
+                        ret,
+                        None if collected is None else collected[i],
+                    )
+            localbar.done(message=f'{len(jobs)} testcases')
+
+        parallel.run_tasks(run_batch, tasks)
+        bar.finalize(print_done=False)
+
     def validate_data(problem, mode: validate.Mode, constraints: dict | bool | None = None) -> bool:
         """Validate aspects of the test data files.
 
@@ -813,6 +926,9 @@ class Problem:
 
         problem.reset_testcase_hashes()
 
+        if config.args.batch_validation:
+            problem._run_validator_batches(testcases, mode, constraints)
+
         # validate the testcases
         bar = ProgressBar(action, items=[t.name for t in testcases])
 
@@ -841,6 +957,7 @@ class Problem:
                 localbar.done()
 
         parallel.run_tasks(process_testcase, testcases)
+        problem.flush_caches()
 
         bar.finalize(print_done=True)
 
@@ -1,3 +1,4 @@
+import json
 import re
 import shutil
 import stat
@@ -8,6 +9,8 @@ import yaml as yamllib
 from util import *
 from colorama import Fore
 
+import cache
+
 EXTRA_LANGUAGES = '''
 checktestdata:
     name: 'Checktestdata'
@@ -88,6 +91,7 @@ def sanitizer():
 # - path:           source file/directory
 # - short_path:     the path relative to problem/subdir/, or None
 # - tmpdir:         the build directory in tmpfs. This is only created when build() is called.
+#                   For shared programs, this is a symlink to a directory in shared_tmpdir().
 # - input_files:    list of source files linked into tmpdir
 # - language:       the detected language
 # - env:            the environment variables used for compile/run command substitution
@@ -98,6 +102,20 @@ def sanitizer():
 #
 # build() will return the (run_command, message) pair.
 class Program:
+    # Programs whose sources all live outside the problem, like the default output validator or
+    # validators symlinked from a shared directory, are built only once in a directory keyed by
+    # their hash and build configuration in here, which is shared between all problems and
+    # contests of the current user. Only the user may write it, since binaries are run from it.
+    @staticmethod
+    def shared_tmpdir():
+        cache_home = os.getenv('XDG_CACHE_HOME') or Path.home() / '.cache'
+        shared_tmpdir = Path(cache_home) / 'bapctools' / 'shared'
+        if not shared_tmpdir.is_dir():
+            shared_tmpdir.mkdir(mode=0o700, parents=True, exist_ok=True)
+        if shared_tmpdir.stat().st_mode & 0o077:
+            shared_tmpdir.chmod(0o700)
+        return shared_tmpdir
+
     def __init__(self, problem, path, deps=None, *, skip_double_build_warning=False):
         if deps is not None:
             assert isinstance(self, Generator)
@@ -411,15 +429,8 @@ class Program:
                 self.bar.error(f'{str(f)} does not match file name regex {config.FILE_NAME_REGEX}')
                 return False
 
-        # Link all source_files
-        if self.tmpdir.is_file():
-            self.tmpdir.unlink()
-        self.tmpdir.mkdir(parents=True, exist_ok=True)
-        self.input_files = []
         hashes = []
         for f in self.source_files:
-            ensure_symlink(self.tmpdir / f.name, f)
-            self.input_files.append(self.tmpdir / f.name)
             if not f.is_file():
                 self.ok = False
                 self.bar.error(f'{str(f)} is not a file')
@@ -427,6 +438,68 @@ class Program:
             hashes.append(hash_file(f))
         self.hash = combine_hashes(hashes)
 
+        if not self._is_shared():
+            return self._build()
+
+        # Build in the shared directory, and link it into the problem tmpdir.
+        # The key includes the build configuration, since the compile command depends on it.
+        build_key = combine_hashes(
+            [
+                self.hash,
+                json.dumps(languages(), sort_keys=True, default=str),
+                json.dumps(config.args.sanitizer and sanitizer(), sort_keys=True, default=str),
+                str(get_memory_limit()),
+            ]
+        )
+        local_tmpdir = self.tmpdir
+        self.tmpdir = Program.shared_tmpdir() / self.subdir / build_key[:32]
+        # The lock is kept while this command may run the build, see cache.BuildLock. A build that
+        # another command is using is only compiled when it is broken, and it is compiled at most
+        # once per command, also with --force-build.
+        lock = cache.BuildLock.get(self.tmpdir.with_suffix('.lock'))
+        with lock.mutex:
+            if lock.built or lock.try_exclusive():
+                ok = self._build(exclusive=not lock.built)
+            else:
+                if config.args.force_build:
+                    self.bar.warn(
+                        f'{self.short_path} is in use by another command, not rebuilding.'
+                    )
+                lock.shared()
+                ok = self._build(exclusive=False)
+            if ok is None:
+                lock.exclusive()
+                ok = self._build()
+            if not ok:
+                lock.release()
+                return False
+            lock.shared()
+            lock.built = True
+        local_tmpdir.parent.mkdir(parents=True, exist_ok=True)
+        ensure_symlink(local_tmpdir, self.tmpdir)
+        self.tmpdir = local_tmpdir
+        return True
+
+    def _is_shared(self):
+        from validate import Validator
+
+        if not isinstance(self, Validator) or is_windows():
+            return False
+        problem_path = self.problem.path.resolve()
+        return all(not is_relative_to(problem_path, f.resolve()) for f in self.source_files)
+
+    # When `exclusive` is False, another command may be running the build, so it is not compiled
+    # again. Returns None when it has to be compiled.
+    def _build(self, exclusive=True):
+        # Link all source_files
+        if self.tmpdir.is_file() or self.tmpdir.is_symlink():
+            self.tmpdir.unlink()
+        self.tmpdir.mkdir(parents=True, exist_ok=True)
+        self.input_files = []
+        for f in self.source_files:
+            ensure_symlink(self.tmpdir / f.name, f)
+            self.input_files.append(self.tmpdir / f.name)
+
         if not self._get_language(self.source_files):
             return False
 
@@ -462,10 +535,14 @@ class Program:
                 self.compile_command
             )
 
-        if not up_to_date or config.args.force_build:
+        if not up_to_date or (config.args.force_build and exclusive):
+            if not exclusive:
+                return None
             if not self._compile():
                 return False
 
+        cache.touch(self.tmpdir)
+
         if self.path in self.problem._program_callbacks:
             for c in self.problem._program_callbacks[self.path]:
                 c(self)
@@ -490,10 +567,8 @@ class Generator(Program):
         in_path = cwd / (name + '.in')
         stdout_path = cwd / (name + '.in_')
 
-        # Clean the directory, but not the meta_.yaml file.
+        # Clean the directory.
         for f in cwd.iterdir():
-            if f.name == 'meta_.yaml':
-                continue
             if f.is_dir() and not f.is_symlink():
                 shutil.rmtree(f)
             else:
@@ -531,14 +606,24 @@ class Generator(Program):
 
         return result
 
+    # Run the generator once for many testcases, see `batch_generators` in generators.yaml.
+    # The jobs file is passed on stdin, and stdout is ignored.
+    def run_batch(self, cwd, jobs_path, timeout):
+        assert self.run_command is not None
+        with jobs_path.open() as stdin:
+            return exec_command(
+                self.run_command + ['--batch'], stdin=stdin, timeout=timeout, cwd=cwd, memory=None
+            )
+
 
 class Visualizer(Program):
     subdir = 'visualizers'
 
     # Run the visualizer.
     # Stdin and stdout are not used.
+    # Visualizers run with the lowest priority, so that they only use otherwise idle cores.
     def run(self, cwd, args=[]):
         assert self.run_command is not None
         return exec_command(
-            self.run_command + args, timeout=config.get_timeout(), cwd=cwd, memory=None
+            self.run_command + args, timeout=config.get_timeout(), cwd=cwd, memory=None, nice=19
         )
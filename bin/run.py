@@ -1,6 +1,7 @@
 import os
 import sys
 
+import cache
 import program
 import config
 import interactive
@@ -40,6 +41,7 @@ class Run:
 
         self.feedbackdir.mkdir(exist_ok=True, parents=True)
         ensure_symlink(self.in_path, self.testcase.in_path)
+        cache.touch(self.problem.tmpdir / 'runs' / self.submission.short_path)
 
     # Return an ExecResult object amended with verdict.
     def run(self, bar, *, interaction=None, submission_args=None):
@@ -287,12 +289,13 @@ class Submission(program.Program):
     # Returns ExecResult
     # The `default_timeout` argument is used when a submission is run as a solution when
     # generating testcases.
+    # A compressed cached input (see `generate --compress-cache`) is decompressed into stdin.
     def run(self, in_path, out_path, crop=True, args=[], cwd=None, default_timeout=False):
         assert self.run_command is not None
         # Just for safety reasons, change the cwd.
         if cwd is None:
             cwd = self.tmpdir
-        with in_path.open('rb') as inf:
+        with cache.open_stdin(in_path) as inf:
             out_file = out_path.open('wb') if out_path else None
 
             # Print stderr to terminal is stdout is None, otherwise return its value.
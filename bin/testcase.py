@@ -11,10 +11,19 @@ from util import (
     shorten_path,
     print_name,
     warn,
+    ExecResult,
     ExecStatus,
 )
 from colorama import Fore, Style
-from validate import Validator, InputValidator, AnswerValidator, OutputValidator, Mode, sanity_check
+from validate import (
+    Validator,
+    InputValidator,
+    AnswerValidator,
+    OutputValidator,
+    Mode,
+    merge_constraints,
+    sanity_check,
+)
 import config
 
 
@@ -58,6 +67,10 @@ class Testcase:
     testdata_yaml: dict
         The YAML-parsed test data flags that apply to this test case.
 
+    batch_results: dict
+        Results of validators run in batch mode, keyed by (validator, mode, flags), that are
+        used instead of running the validator again.
+
     """
 
     def __init__(self, base_problem, path: Path, *, short_path=None, print_warn=False):
@@ -94,6 +107,7 @@ class Testcase:
             else self.in_path.with_name(self.in_path.with_suffix('').stem + '.ans.statement')
         )
         self.out_path = None if self.root != 'invalid_outputs' else self.in_path.with_suffix('.out')
+        self.batch_results = dict()
         # Display name: everything after data/.
         self.name = str(self.short_path.with_suffix(''))
 
@@ -129,7 +143,7 @@ class Testcase:
             else ('output_validator_flags', None)
         )
 
-        path = self.problem.path / 'data' / self.short_path
+        path = self.problem.path / 'data' / self.short_path.parent
         flags = self.problem.get_testdata_yaml(path, key, bar, name=name)
 
         if flags is None:
@@ -242,6 +256,102 @@ class Testcase:
             case _:
                 raise ValueError
 
+    def _validation_key(self, validator, mode: Mode, args) -> str | None:
+        """
+        Returns
+        -------
+        The key of the validation result in the validation cache,
+        or None when one of the validated files does not exist.
+        """
+        files = {Mode.INPUT: [self.in_path], Mode.ANSWER: [self.in_path, self.ans_path]}.get(
+            mode, [self.in_path, self.ans_path, self.out_path]
+        )
+        if not all(f is not None and f.is_file() for f in files):
+            return None
+        file_hashes = self.problem.file_hashes()
+        d = {
+            'validator': type(validator).__name__,
+            'hash': validator.hash,
+            'flags': ' '.join(args),
+            'mode': str(mode),
+        }
+        if isinstance(validator, OutputValidator):
+            # OutputValidator.run also passes the flags from problem.yaml.
+            d['validator_flags'] = ' '.join(self.problem.settings.validator_flags)
+        for f in files:
+            d[f.suffix] = file_hashes.hash(f)
+        return combine_hashes_dict(d)
+
+    def _cached_result(
+        self, validator, mode: Mode, args, constraints
+    ) -> tuple[str | None, dict | None]:
+        """
+        Returns
+        -------
+        A pair of the key of the validation result in the validation cache (or None when results
+        are not cached), and the cached entry (or None when it is not cached).
+        When collecting constraints, only entries that include the collected constraints are used.
+        """
+        if config.args.revalidate:
+            return None, None
+        key = self._validation_key(validator, mode, args)
+        if key is None:
+            return None, None
+        entry = self.problem.validation_cache().get(key)
+        if entry is not None and constraints is not None and 'constraints' not in entry:
+            entry = None
+        return key, entry
+
+    def validator_batch_args(self, validator, mode: Mode, *, bar, constraints) -> list[str] | None:
+        """
+        Returns
+        -------
+        The arguments to run the given validator on this testcase in a batch with,
+        or None when it is not run, or its result is in the validation cache.
+        """
+        flags = self.testdata_yaml_validator_flags(validator, bar)
+        if flags is False:
+            return None
+        flags = flags or []
+        key, entry = self._cached_result(validator, mode, flags, constraints)
+        if not config.args.revalidate and (key is None or entry is not None):
+            return None
+        return flags
+
+    def _run_validator(self, validator, mode: Mode, *, constraints, args) -> ExecResult:
+        """
+        Run a single validator, reusing the result of a previous run on identical files,
+        or of a batch run, see Problem.validate_data.
+        The constraints collected by a run are cached with its result, and merged into constraints
+        when the result is reused. Results are not cached when --revalidate is passed.
+        Timeouts and crashes are never cached.
+        """
+        key, entry = self._cached_result(validator, mode, args, constraints)
+        if entry is not None:
+            if constraints is not None:
+                merge_constraints(
+                    constraints, {loc: tuple(c) for loc, c in entry['constraints'].items()}
+                )
+            return ExecResult(
+                None, ExecStatus[entry['status']], 0, False, entry['err'], entry['out']
+            )
+
+        collected = None if constraints is None else dict()
+        batch = self.batch_results.pop((validator, mode, tuple(args)), None)
+        if batch is not None:
+            ret, collected = batch
+        else:
+            ret = validator.run(self, mode=mode, constraints=collected, args=args)
+        if constraints is not None:
+            merge_constraints(constraints, collected)
+
+        if key is not None and ret.status in [ExecStatus.ACCEPTED, ExecStatus.REJECTED]:
+            entry = {'status': ret.status.name, 'err': ret.err, 'out': ret.out}
+            if collected is not None:
+                entry['constraints'] = collected
+            self.problem.validation_cache().set(key, entry)
+        return ret
+
     def _run_validators(
         self,
         mode: Mode,
@@ -266,7 +376,7 @@ class Testcase:
                 continue
             flags = args if flags is None else flags + args
 
-            ret = validator.run(self, mode=mode, constraints=constraints, args=flags)
+            ret = self._run_validator(validator, mode, constraints=constraints, args=flags)
             results.append(ret.status)
 
             message = name
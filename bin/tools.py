@@ -19,6 +19,7 @@ import hashlib
 import os
 import sys
 import tempfile
+import time
 import shutil
 import colorama
 import json
@@ -27,11 +28,13 @@ from pathlib import Path
 
 # Local imports
 import config
+import cache
 import constraints
 import export
 import generate
 import fuzz
 import latex
+import program
 import run
 import skel
 import slack
@@ -339,6 +342,11 @@ Run this from one of:
     global_parser.add_argument(
         '--language', dest='languages', action='append', help='Set language.'
     )
+    global_parser.add_argument(
+        '--tmp-budget',
+        type=int,
+        help='When set, the tmpdir is reduced to this size in MiB after each command, by removing the least recently used files.',
+    )
 
     subparsers = parser.add_subparsers(
         title='actions', dest='action', parser_class=SuppressingParser
@@ -477,6 +485,16 @@ Run this from one of:
         action='store_true',
         help='Skip sanity checks on testcases.',
     )
+    validate_parser.add_argument(
+        '--revalidate',
+        action='store_true',
+        help='Do not reuse cached validation results of unchanged testcases.',
+    )
+    validate_parser.add_argument(
+        '--batch-validation',
+        action='store_true',
+        help='Validate many testcases per process with validators based on validation.h.',
+    )
     validate_parser.add_argument(
         '--timeout', '-t', type=int, help='Override the default timeout. Default: 30.'
     )
@@ -550,6 +568,21 @@ Run this from one of:
         action='store_true',
         help='Skip generating .ans/.interaction files with the solution.',
     )
+    genparser.add_argument(
+        '--compress-cache',
+        action='store_true',
+        help='Compress large cached inputs and answers in the tmpdir (zstd if available, gzip otherwise).',
+    )
+    genparser.add_argument(
+        '--profile',
+        action='store_true',
+        help='Print the time spent per testcase, stage, and generator, and the largest files.',
+    )
+    genparser.add_argument(
+        '--solution-jobs',
+        type=int,
+        help='The maximum number of solutions to run in parallel, e.g. for memory-heavy solutions. Default: --jobs.',
+    )
     genparser.add_argument(
         '--no-visualizer',
         action='store_true',
@@ -560,6 +593,27 @@ Run this from one of:
         action='store_true',
         help='Skip sanity checks on testcases.',
     )
+    genparser.add_argument(
+        '--shard',
+        help='Only generate the testcases in shard i/n, partitioned by their hash, e.g. 2/4. Implies not cleaning up data/.',
+    )
+    genparser.add_argument(
+        '--export-cache',
+        type=Path,
+        help='Write the cached testcases generated by this run to a tar file, e.g. to be imported by a final run after generating with --shard.',
+    )
+    genparser.add_argument(
+        '--import-cache',
+        type=Path,
+        action='append',
+        help='Import the cached testcases from a tar file written by --export-cache before generating. Can be passed multiple times.',
+    )
+    genparser.add_argument(
+        '--watch',
+        '-w',
+        action='store_true',
+        help='Keep watching the problem and regenerate the affected testcases whenever a file changes.',
+    )
 
     # Fuzzer
     fuzzparser = subparsers.add_parser(
@@ -676,6 +730,16 @@ Run this from one of:
         action='store_true',
         help='Skip sanity checks on testcases.',
     )
+    allparser.add_argument(
+        '--revalidate',
+        action='store_true',
+        help='Do not reuse cached validation results of unchanged testcases.',
+    )
+    allparser.add_argument(
+        '--batch-validation',
+        action='store_true',
+        help='Validate many testcases per process with validators based on validation.h.',
+    )
     allparser.add_argument(
         '--check-deterministic',
         action='store_true',
@@ -702,6 +766,11 @@ Run this from one of:
         help='Make a zip more following the kattis problemarchive.com format.',
     )
     zipparser.add_argument('--no-solutions', action='store_true', help='Do not compile solutions')
+    zipparser.add_argument(
+        '--revalidate',
+        action='store_true',
+        help='Do not reuse cached validation results of unchanged testcases.',
+    )
 
     # Build a zip with all samples.
     subparsers.add_parser(
@@ -737,11 +806,17 @@ Run this from one of:
         parents=[global_parser],
         help='Print the tmpdir corresponding to the current problem.',
     )
-    tmpparser.add_argument(
+    tmp_group = tmpparser.add_mutually_exclusive_group()
+    tmp_group.add_argument(
         '--clean',
         action='store_true',
         help='Delete the temporary cache directory for the current problem/contest.',
     )
+    tmp_group.add_argument(
+        '--gc',
+        action='store_true',
+        help='Remove the least recently used files from the tmpdir until it fits in --tmp-budget.',
+    )
 
     solvestatsparser = subparsers.add_parser(
         'solve_stats',
@@ -782,6 +857,8 @@ Run this from one of:
 
 # Takes a Namespace object returned by argparse.parse_args().
 def run_parsed_arguments(args):
+    start_time = time.time()
+
     # Process arguments
     config.args = args
     config.set_default_args()
@@ -808,6 +885,7 @@ def run_parsed_arguments(args):
 
     # Get problem_paths and cd to contest
     problems, level, contest, tmpdir = get_problems()
+    cache.lock_tmpdir(tmpdir)
 
     # Check for incompatible actions at the problem/problemset level.
     if level != 'problem':
@@ -833,6 +911,13 @@ def run_parsed_arguments(args):
                 checked_paths.append(path)
         config.args.add = checked_paths
 
+    if config.args.shard is not None:
+        # Parse `i/n` into (i, n).
+        index, _, count = config.args.shard.partition('/')
+        if not index.isdigit() or not count.isdigit() or not 1 <= int(index) <= int(count):
+            fatal(f'--shard must be of the form i/n with 1 <= i <= n, found {config.args.shard}.')
+        config.args.shard = (int(index), int(count))
+
     # Handle one-off subcommands.
     if action == 'tmp':
         if level == 'problem':
@@ -846,6 +931,17 @@ def run_parsed_arguments(args):
                 shutil.rmtree(level_tmpdir)
             if level_tmpdir.is_file():
                 level_tmpdir.unlink()
+        elif config.args.gc:
+            freed = cache.collect_garbage(
+                tmpdir,
+                config.get_tmp_budget(),
+                start_time,
+                shared_dir=program.Program.shared_tmpdir(),
+            )
+            if freed is None:
+                warn(f'{tmpdir} is in use by another command, not removing anything.')
+            else:
+                log(f'Removed {freed / 1024 / 1024:.1f} MiB from {tmpdir}.')
         else:
             print(level_tmpdir)
 
@@ -1014,13 +1110,23 @@ def run_parsed_arguments(args):
             outfile = contest + '.zip'
             if config.args.kattis:
                 outfile = contest + '-kattis.zip'
-            export.build_contest_zip(problems, problem_zips, outfile, statement_language)
+            export.build_contest_zip(problems, problem_zips, outfile, statement_language, tmpdir)
         if action in ['update_problems_yaml']:
             export.update_problems_yaml(
                 problems,
                 re.split("[^#0-9A-Za-z]", config.args.colors) if config.args.colors else None,
             )
 
+    # Keep the tmpdir within its size budget, when one is set. Everything used by this command is kept.
+    if config.args.tmp_budget:
+        cache.collect_garbage(
+            tmpdir,
+            config.get_tmp_budget(),
+            start_time - 1,
+            auto=True,
+            shared_dir=program.Program.shared_tmpdir(),
+        )
+
     if not success or config.n_error > 0 or config.n_warn > 0:
         sys.exit(1)
 
@@ -740,6 +740,46 @@ def ensure_symlink(link, target, output=False, relative=False):
         link.symlink_to(target.resolve(), target.is_dir())
 
 
+# Linux ioctl to create a copy-on-write clone (reflink) of a file, see ioctl_ficlone(2).
+FICLONE = 0x40049409
+
+# Map from (source device, target device) to the cheapest way to copy files between them that
+# worked before: 'reflink', 'hardlink' or 'copy'.
+_clone_methods = dict()
+_clone_methods_lock = threading.Lock()
+
+
+# Copy source to target, which must not exist yet. Depending on what the filesystem(s) support,
+# this creates a reflink (copy-on-write clone), a hardlink, or a streaming copy.
+# Note that in case of a hardlink, modifying either file in place modifies the other as well.
+def clone_file(source, target):
+    devices = (os.stat(source).st_dev, os.stat(target.parent).st_dev)
+    with _clone_methods_lock:
+        method = _clone_methods.get(devices, 'reflink')
+
+    if method == 'reflink' and not is_windows():
+        import fcntl
+
+        try:
+            with open(source, 'rb') as src, open(target, 'wb') as dst:
+                fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+            return
+        except OSError:
+            target.unlink(missing_ok=True)
+            method = 'hardlink'
+    if method in ['reflink', 'hardlink']:
+        try:
+            os.link(source, target)
+            method = 'hardlink'
+        except OSError:
+            method = 'copy'
+    if method == 'copy':
+        shutil.copy(source, target, follow_symlinks=True)
+
+    with _clone_methods_lock:
+        _clone_methods[devices] = method
+
+
 def substitute(data, variables):
     if variables is None:
         return data
@@ -909,8 +949,11 @@ class ExecResult:
         self.pass_id = pass_id
 
 
-def limit_setter(command, timeout, memory_limit, group=None, cores=False):
+def limit_setter(command, timeout, memory_limit, group=None, cores=False, nice=0):
     def setlimits():
+        if nice:
+            os.nice(nice)
+
         if timeout:
             resource.setrlimit(resource.RLIMIT_CPU, (timeout + 1, timeout + 1))
 
@@ -998,9 +1041,48 @@ def validator_exec_code_map(returncode):
     return ExecStatus.ERROR
 
 
+def add_cpu_time(a, b):
+    return None if a is None or b is None else a + b
+
+
+# Accumulates the wall and CPU time of all processes started by exec_command in the current
+# thread while it is active:
+#   with ExecProfile() as profile:
+#       ...
+#   print(profile.wall_time, profile.cpu_time)
+class ExecProfile:
+    _active = threading.local()
+
+    def __init__(self):
+        self.wall_time = 0
+        self.cpu_time = 0
+
+    def __enter__(self):
+        self._outer = getattr(ExecProfile._active, 'profile', None)
+        ExecProfile._active.profile = self
+        return self
+
+    def __exit__(self, *args):
+        ExecProfile._active.profile = self._outer
+        if self._outer is not None:
+            self._outer.add(self.wall_time, self.cpu_time)
+
+    # The CPU time is None when it is unknown for some of the processes.
+    def add(self, wall_time, cpu_time):
+        self.wall_time += wall_time
+        self.cpu_time = add_cpu_time(self.cpu_time, cpu_time)
+
+    @staticmethod
+    def record(wall_time, cpu_time):
+        profile = getattr(ExecProfile._active, 'profile', None)
+        if profile is not None:
+            profile.add(wall_time, cpu_time)
+
+
 # Run `command`, returning stderr if the return code is unexpected.
+# Set `nice` to run the command with a lower scheduling priority, see nice(2).
 def exec_command(
-    command, exec_code_map=default_exec_code_map, crop=True, preexec_fn=True, **kwargs
+    command, exec_code_map=default_exec_code_map, crop=True, preexec_fn=True, nice=0, **kwargs
 ):
     # By default: discard stdout, return stderr
     if 'stdout' not in kwargs or kwargs['stdout'] is True:
@@ -1053,7 +1135,7 @@ def exec_command(
         if not is_windows() and not is_wsl() and preexec_fn:
             process = ResourcePopen(
                 command,
-                preexec_fn=limit_setter(command, timeout, get_memory_limit(kwargs)),
+                preexec_fn=limit_setter(command, timeout, get_memory_limit(kwargs), nice=nice),
                 **kwargs,
             )
         else:
@@ -1093,6 +1175,11 @@ def exec_command(
     err = maybe_crop(stderr.decode('utf-8', 'replace')) if stderr is not None else None
     out = maybe_crop(stdout.decode('utf-8', 'replace')) if stdout is not None else None
 
+    if getattr(process, 'rusage', None) is not None:
+        ExecProfile.record(tend - tstart, process.rusage.ru_utime + process.rusage.ru_stime)
+    else:
+        ExecProfile.record(tend - tstart, None)
+
     if hasattr(process, 'rusage'):
         duration = process.rusage.ru_utime + process.rusage.ru_stime
         # It may happen that the Rusage is low, even though a timeout was raised, i.e. when calling sleep().
@@ -1,5 +1,8 @@
+import cache
+import mmap
 import program
 import re
+import tempfile
 from util import *
 from enum import Enum
 
@@ -19,6 +22,11 @@ class Mode(Enum):
         }[self]
 
 
+# The environment variables that enable the batch mode of headers/validation.h.
+BATCH_ENV_VAR = 'VALIDATION_BATCH'
+BATCH_TIMEOUT_ENV_VAR = 'VALIDATION_BATCH_TIMEOUT'
+
+
 def _merge_constraints(constraints_path, constraints):
     # Merge with previous constraints.
     if constraints_path.is_file():
@@ -42,23 +50,31 @@ def _merge_constraints(constraints_path, constraints):
                 high = int(high)
             except ValueError:
                 high = float(high)
-            if loc in constraints:
-                c = constraints[loc]
-                has_low |= c[1]
-                has_high |= c[2]
-                if c[3] < vmin:
-                    vmin = c[3]
-                if c[4] > vmax:
-                    vmax = c[4]
-                if c[5] > low:
-                    low = c[5]
-                if c[6] < high:
-                    high = c[6]
-            constraints[loc] = (name, has_low, has_high, vmin, vmax, low, high)
+            merge_constraints(constraints, {loc: (name, has_low, has_high, vmin, vmax, low, high)})
 
         constraints_path.unlink()
 
 
+def merge_constraints(constraints, collected):
+    """Merge the constraints collected by a validator run into constraints.
+    Both map a location to a tuple (name, has_low, has_high, vmin, vmax, low, high).
+    """
+    for loc, (name, has_low, has_high, vmin, vmax, low, high) in collected.items():
+        if loc in constraints:
+            c = constraints[loc]
+            has_low |= c[1]
+            has_high |= c[2]
+            if c[3] < vmin:
+                vmin = c[3]
+            if c[4] > vmax:
+                vmax = c[4]
+            if c[5] > low:
+                low = c[5]
+            if c[6] < high:
+                high = c[6]
+        constraints[loc] = (name, has_low, has_high, vmin, vmax, low, high)
+
+
 class Validator(program.Program):
     """Base class for AnswerValidator, InputValidator, and OutputValidator.
 
@@ -79,15 +95,11 @@ class Validator(program.Program):
     def __repr__(self):
         return type(self).__name__ + ': ' + str(self.path)
 
-    def __init__(self, problem, path, skip_double_build_warning=False, check_constraints=False):
+    def __init__(self, problem, path, skip_double_build_warning=False):
         program.Program.__init__(
             self, problem, path, skip_double_build_warning=skip_double_build_warning
         )
 
-        if check_constraints:
-            self.tmpdir = self.tmpdir.parent / (self.tmpdir.name + '_check_constraints')
-        self.check_constraints = check_constraints
-
     def _run_helper(self, testcase, constraints, args):
         """Helper method for the run method in subclasses.
         Return:
@@ -98,14 +110,14 @@ class Validator(program.Program):
         if testcase.in_path.is_relative_to(self.problem.tmpdir):
             cwd = testcase.in_path.with_suffix('.feedbackdir')
         else:
-            name = self.tmpdir.relative_to(self.problem.tmpdir)
-            cwd = (
-                self.problem.tmpdir
-                / 'tool_runs'
-                / name
-                / testcase.short_path.with_suffix('.feedbackdir')
-            )
+            cwd = self._tool_runs_dir() / testcase.short_path.with_suffix('.feedbackdir')
+            cache.touch(self._tool_runs_dir())
         cwd.mkdir(parents=True, exist_ok=True)
+        # Input validators read a compressed cached input (see `generate --compress-cache`) from
+        # stdin as a stream, but the other validators and viva get the input as a path.
+        if not testcase.in_path.is_file() and cache.compressed_path(testcase.in_path):
+            if not isinstance(self, InputValidator) or self.language == 'viva':
+                cache.decompress_file(testcase.in_path)
         arglist = []
         if args is not None:
             assert isinstance(args, list)
@@ -121,6 +133,104 @@ class Validator(program.Program):
 
         return cwd, constraints_path, arglist
 
+    def _tool_runs_dir(self):
+        """The directory in the tmpdir of the problem for runs of this validator on testcases
+        outside the tmpdir. Unlike self.tmpdir, it is never shared with other problems.
+        """
+        return self.problem.tmpdir / 'tool_runs' / self.tmpdir.relative_to(self.problem.tmpdir)
+
+    def supports_batch(self):
+        """Whether this validator can validate many testcases in a single process.
+        This is the case for C++ input validators based on a version of headers/validation.h with
+        batch mode. Answer validators usually read the input file given as their first argument
+        before constructing the validator, so they are always run once per testcase.
+        """
+        if not isinstance(self, InputValidator) or self.language != 'cpp':
+            return False
+        for f in self.source_files:
+            if f.name == 'validation.h' and f.is_file():
+                try:
+                    return BATCH_ENV_VAR in f.read_text()
+                except UnicodeDecodeError:
+                    return False
+        return False
+
+    def run_batch(self, jobs, constraints=None):
+        """Run this validator on many testcases in a single process.
+
+        See the batch mode in headers/validation.h. All jobs must have the same number of arguments.
+
+        Arguments
+        ---------
+        jobs: list of (testcase, args) pairs
+        constraints: None, or a list with a dict for each job, into which the constraints
+            collected by that job are merged.
+
+        Returns
+        -------
+        A list with the ExecResult of each job, or None when the job has to be run on its own
+        instead, i.e. when the validator crashed or timed out, or the batch itself failed.
+        """
+        assert self.supports_batch()
+
+        lines = []
+        outputs = []
+        for i, (testcase, args) in enumerate(jobs):
+            cwd, constraints_path, arglist = self._run_helper(
+                testcase, None if constraints is None else constraints[i], args
+            )
+            stdout_path = cwd / 'batch.out'
+            stderr_path = cwd / 'batch.err'
+            fields = [cwd, testcase.in_path.resolve(), stdout_path, stderr_path] + arglist
+            lines.append(b'\0'.join(os.fsencode(str(f)) for f in fields))
+            outputs.append((stdout_path, stderr_path, constraints_path, arglist))
+
+        assert len({len(arglist) for *_, arglist in outputs}) == 1
+        # The build directory may be shared by other problems and concurrent commands, so the
+        # jobs file is written to the tmpdir of this problem, with a name unique to this run.
+        batch_dir = self._tool_runs_dir()
+        batch_dir.mkdir(parents=True, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=batch_dir, prefix='batch_') as jobs_file:
+            jobs_file.write(b'\n'.join(lines) + b'\n')
+            jobs_file.flush()
+
+            env = os.environ.copy()
+            env[BATCH_ENV_VAR] = jobs_file.name
+            env[BATCH_TIMEOUT_ENV_VAR] = str(config.get_timeout())
+            # The arguments of the process itself are replaced by those of each job.
+            with open(os.devnull) as devnull:
+                ret = exec_command(
+                    self.run_command + outputs[0][3],
+                    stdin=devnull,
+                    env=env,
+                    cwd=batch_dir,
+                    timeout=config.get_timeout() * (len(jobs) + 1),
+                    crop=False,
+                )
+
+        codes = ret.out.split() if ret.status and ret.out else []
+        if len(codes) != len(jobs) or not all(re.fullmatch('-?[0-9]+', c) for c in codes):
+            codes = [None] * len(jobs)
+
+        results = []
+        for i, (code, (stdout_path, stderr_path, constraints_path, _)) in enumerate(
+            zip(codes, outputs)
+        ):
+            status = validator_exec_code_map(int(code)) if code is not None else ExecStatus.ERROR
+            out, err = (
+                crop_output(path.read_bytes().decode('utf-8', 'replace')) if path.is_file() else ''
+                for path in [stdout_path, stderr_path]
+            )
+            stdout_path.unlink(missing_ok=True)
+            stderr_path.unlink(missing_ok=True)
+            if status not in [ExecStatus.ACCEPTED, ExecStatus.REJECTED]:
+                results.append(None)
+                continue
+            if constraints is not None:
+                _merge_constraints(constraints_path, constraints[i])
+            results.append(ExecResult(int(code), status, 0, False, err, out))
+        return results
+
     # .ctd, .viva, or otherwise called as: ./validator [arguments] < inputfile.
     # It may not read/write files.
     def _run_format_validator(self, testcase, cwd):
@@ -145,7 +255,7 @@ class Validator(program.Program):
             return ExecStatus.ERROR
 
         if self.language == 'checktestdata':
-            with main_path.open() as main_file:
+            with cache.open_stdin(main_path) as main_file:
                 return exec_command(
                     self.run_command, exec_code_map=format_exec_code_map, stdin=main_file, cwd=cwd
                 )
@@ -194,7 +304,7 @@ class InputValidator(Validator):
 
         invocation = self.run_command.copy()
 
-        with testcase.in_path.open() as in_file:
+        with cache.open_stdin(testcase.in_path) as in_file:
             ret = exec_command(
                 invocation + arglist,
                 exec_code_map=validator_exec_code_map,
@@ -327,40 +437,86 @@ class OutputValidator(Validator):
         return ret
 
 
-# Checks if byte is printable or whitespace
-def _in_invalid_byte(byte, *, other_whitespaces=False):
-    if other_whitespaces:
-        if byte == ord('\t'):
-            return False
-        if byte == ord('\r'):
-            return False
-        if byte == ord('\v'):
-            return False
-        if byte == ord('\f'):
-            return False
-    if byte == ord('\n'):
-        return False
-    if byte >= 0x20 and byte < 0x7F:
-        return False
-    return True
+# The bytes allowed in testcase files: printable ASCII and newlines, and with lenient whitespace
+# also the other ASCII whitespace characters.
+_STRICT_BYTES = b'\n' + bytes(range(0x20, 0x7F))
+_LENIENT_BYTES = _STRICT_BYTES + b'\t\r\v\f'
+# Consecutive whitespace when only spaces and newlines are allowed is found by mapping newlines to
+# spaces and searching for two spaces, skipping empty lines ('\n\n'), which are fine.
+_NEWLINE_TO_SPACE = bytes.maketrans(b'\n', b' ')
+# Files are scanned in chunks of this many bytes, so that the memory use is constant.
+_SANITY_CHECK_CHUNK_SIZE = 1 << 22
 
 
-def _has_invalid_byte(bytes, *, other_whitespaces=False):
-    return any(_in_invalid_byte(b, other_whitespaces=other_whitespaces) for b in bytes)
+class _SanityScan:
+    """
+    The result of scanning a file for sanity_check in a single pass.
 
+    invalid and consecutive_whitespace are the (line, column) of the first unexpected byte and of
+    the first consecutive whitespace, or None. Lines and columns are 1-based and count bytes.
+    """
 
-# assumes that the only possible whitespaces are space and newline
-# allows \n\n
-def _has_consecutive_whitespaces(bytes):
-    last = -1
-    for byte in bytes:
-        cur_whitespace = byte == ord(' ') or byte == ord('\n')
-        if last == ord(' ') and cur_whitespace:
-            return True
-        if last == ord('\n') and byte == ord(' '):
-            return True
-        last = byte
-    return False
+    def __init__(self, path, strict_whitespace):
+        self.size = path.stat().st_size
+        self.first = None
+        self.last = None
+        self.invalid = None
+        self.invalid_byte = None
+        self.consecutive_whitespace = None
+        if self.size == 0:
+            # Empty files can not be mapped.
+            return
+
+        allowed = _STRICT_BYTES if strict_whitespace else _LENIENT_BYTES
+        invalid_regex = re.compile(b'[^' + re.escape(allowed) + b']')
+        with open(path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            self.first = data[0]
+            self.last = data[-1]
+            # The chunk, its offset, and the number of newlines and the offset of the current line
+            # before it. The previous chunk is kept to locate whitespace crossing chunk boundaries.
+            current = None
+            previous = None
+            lines = 0
+            line_start = 0
+            for start in range(0, self.size, _SANITY_CHECK_CHUNK_SIZE):
+                chunk = data[start : start + _SANITY_CHECK_CHUNK_SIZE]
+                previous = current
+                current = (chunk, start, lines, line_start)
+                # Translating with all allowed bytes deleted is much faster than a regex search,
+                # which is only needed to find the position of an unexpected byte.
+                if chunk.translate(None, allowed):
+                    pos = invalid_regex.search(chunk).start()
+                    self.invalid = _location(current, pos)
+                    self.invalid_byte = chunk[pos : pos + 1]
+                    # Unexpected bytes are reported before consecutive whitespace.
+                    return
+                if strict_whitespace and self.consecutive_whitespace is None:
+                    # Include the last byte of the previous chunk, to find whitespace crossing the
+                    # chunk boundary.
+                    window = previous[0][-1:] + chunk if previous else chunk
+                    spaces = window.translate(_NEWLINE_TO_SPACE)
+                    pos = spaces.find(b'  ')
+                    while pos >= 0 and window[pos : pos + 2] == b'\n\n':
+                        pos = spaces.find(b'  ', pos + 1)
+                    if pos >= 0:
+                        pos -= len(window) - len(chunk)
+                        if pos < 0:
+                            self.consecutive_whitespace = _location(previous, len(previous[0]) - 1)
+                        else:
+                            self.consecutive_whitespace = _location(current, pos)
+                newlines = chunk.count(b'\n')
+                if newlines:
+                    lines += newlines
+                    line_start = start + chunk.rfind(b'\n') + 1
+
+
+# The (line, column) of byte `pos` in a chunk (chunk, start, lines, line_start) of _SanityScan.
+def _location(chunk_state, pos):
+    chunk, start, lines, line_start = chunk_state
+    newline = chunk.rfind(b'\n', 0, pos)
+    if newline >= 0:
+        line_start = start + newline + 1
+    return (lines + chunk.count(b'\n', 0, pos) + 1, start + pos - line_start + 1)
 
 
 def sanity_check(path, bar, strict_whitespace=True):
@@ -384,26 +540,34 @@ def sanity_check(path, bar, strict_whitespace=True):
     if config.args.no_testcase_sanity_checks:
         return
 
+    if not path.exists() and cache.compressed_path(path):
+        # Cached files are only compressed after they were checked.
+        return
     if not path.exists():
         fatal(f"{path} not found during sanity check")
         return
-    with open(path, 'rb') as file:
-        name = {
-            '.in': "Input",
-            '.ans': "Answer",
-            '.out': "Output",
-        }[path.suffix]
-        file_bytes = file.read()
-        if _has_invalid_byte(file_bytes, other_whitespaces=not strict_whitespace):
-            bar.warn(f'{name} contains unexpected characters but was accepted!')
-        elif len(file_bytes) == 0:
-            bar.warn(f'{name} is empty but was accepted!')
-        elif len(file_bytes) > 20_000_000:
-            bar.warn(f'{name} is larger than 20Mb!')
-        elif strict_whitespace:
-            if file_bytes[0] in [ord(' '), ord('\n')]:
-                bar.warn(f'{name} starts with whitespace but was accepted!')
-            elif file_bytes[-1] != ord('\n'):
-                bar.warn(f'{name} does not end with a newline but was accepted!')
-            elif _has_consecutive_whitespaces(file_bytes):
-                bar.warn(f'{name} contains consecutive whitespace characters but was accepted!')
+    name = {
+        '.in': "Input",
+        '.ans': "Answer",
+        '.out': "Output",
+    }[path.suffix]
+    scan = _SanityScan(path, strict_whitespace)
+    if scan.invalid:
+        line, column = scan.invalid
+        bar.warn(
+            f'{name} contains unexpected character {scan.invalid_byte!r} at line {line}, column {column} but was accepted!'
+        )
+    elif scan.size == 0:
+        bar.warn(f'{name} is empty but was accepted!')
+    elif scan.size > 20_000_000:
+        bar.warn(f'{name} is larger than 20Mb!')
+    elif strict_whitespace:
+        if scan.first in [ord(' '), ord('\n')]:
+            bar.warn(f'{name} starts with whitespace but was accepted!')
+        elif scan.last != ord('\n'):
+            bar.warn(f'{name} does not end with a newline but was accepted!')
+        elif scan.consecutive_whitespace:
+            line, column = scan.consecutive_whitespace
+            bar.warn(
+                f'{name} contains consecutive whitespace characters at line {line}, column {column} but was accepted!'
+            )
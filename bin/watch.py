@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+# Watching a directory tree for changed files, used by `bt generate --watch`.
+# On Linux, inotify is used through ctypes. Elsewhere, or when inotify is not available
+# (e.g. the limit on the number of watches is reached), the tree is polled instead.
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import time
+
+from pathlib import Path
+
+# See inotify(7).
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (
+    IN_ATTRIB
+    | IN_CLOSE_WRITE
+    | IN_MOVED_FROM
+    | IN_MOVED_TO
+    | IN_CREATE
+    | IN_DELETE
+    | IN_DELETE_SELF
+    | IN_MOVE_SELF
+)
+
+EVENT_HEADER = struct.Struct('iIII')
+
+# Time without further changes before a batch of changes is reported, so that e.g. an editor
+# writing a temporary file and moving it into place results in a single batch.
+DEBOUNCE = 0.1
+POLL_INTERVAL = 0.5
+
+
+# Editor swap/backup files, hidden files, and caches never trigger a change.
+def _ignored(name):
+    return name.startswith('.') or name.endswith('~') or name == '__pycache__'
+
+
+class Watcher:
+    # Watch all files in the tree below `root`, except for the trees in `exclude`.
+    def __init__(self, root, exclude=[]):
+        self.root = Path(root)
+        self.exclude = {Path(p) for p in exclude}
+        self.fd = None
+        self.watches = dict()
+        if sys.platform.startswith('linux'):
+            self._init_inotify()
+        if self.fd is None:
+            self.method = 'polling'
+            self.snapshot = self._snapshot()
+        else:
+            self.method = 'inotify'
+
+    def _skip(self, path):
+        return _ignored(path.name) or path in self.exclude
+
+    def _directories(self, root):
+        for directory, dirnames, filenames in os.walk(root):
+            dirnames[:] = [d for d in dirnames if not self._skip(Path(directory) / d)]
+            yield Path(directory)
+
+    def _init_inotify(self):
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+            self._inotify_add_watch = libc.inotify_add_watch
+            self._inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+            fd = libc.inotify_init1(IN_CLOEXEC)
+        except (OSError, AttributeError):
+            return
+        if fd < 0:
+            return
+        self.fd = fd
+        for directory in self._directories(self.root):
+            if not self._add_watch(directory):
+                # Most likely the inotify watch limit was reached; fall back to polling.
+                os.close(self.fd)
+                self.fd = None
+                self.watches = dict()
+                return
+
+    def _add_watch(self, directory):
+        wd = self._inotify_add_watch(self.fd, os.fsencode(directory), WATCH_MASK | IN_ONLYDIR)
+        if wd < 0:
+            # The directory may have been removed in the meantime.
+            return ctypes.get_errno() in [2, 20]  # ENOENT, ENOTDIR
+        self.watches[wd] = directory
+        return True
+
+    # Read the pending inotify events and return the changed paths.
+    def _read_events(self):
+        changed = set()
+        data = os.read(self.fd, 64 * 1024)
+        offset = 0
+        while offset < len(data):
+            wd, mask, _cookie, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset : offset + length].rstrip(b'\0')
+            offset += length
+
+            if mask & IN_Q_OVERFLOW:
+                # Events were lost, so report everything as changed.
+                changed.add(self.root)
+                continue
+            if mask & IN_IGNORED:
+                self.watches.pop(wd, None)
+                continue
+            directory = self.watches.get(wd)
+            if directory is None:
+                continue
+            path = directory / os.fsdecode(name) if name else directory
+            if self._skip(path):
+                continue
+            if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                # New directories are watched as well, including the files already in them.
+                for subdirectory in self._directories(path):
+                    self._add_watch(subdirectory)
+            changed.add(path)
+        return changed
+
+    def _snapshot(self):
+        snapshot = dict()
+        for directory in self._directories(self.root):
+            try:
+                entries = list(os.scandir(directory))
+            except OSError:
+                continue
+            for entry in entries:
+                if _ignored(entry.name) or entry.is_dir():
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                snapshot[Path(entry.path)] = (stat.st_mtime_ns, stat.st_size, stat.st_mode)
+        return snapshot
+
+    def _poll(self):
+        snapshot = self._snapshot()
+        changed = {
+            path
+            for path in snapshot.keys() | self.snapshot.keys()
+            if snapshot.get(path) != self.snapshot.get(path)
+        }
+        self.snapshot = snapshot
+        return changed
+
+    def _changes(self, timeout):
+        if self.fd is not None:
+            ready, _, _ = select.select([self.fd], [], [], timeout)
+            return self._read_events() if ready else set()
+        time.sleep(timeout)
+        return self._poll()
+
+    # Block until files have changed, and return the set of changed paths.
+    # This includes removed files, and newly created files and directories.
+    def wait(self):
+        interval = None if self.fd is not None else POLL_INTERVAL
+        changed = set()
+        while not changed:
+            changed = self._changes(interval)
+        while True:
+            more = self._changes(DEBOUNCE)
+            if not more:
+                return changed
+            changed |= more
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
@@ -35,11 +35,23 @@
 #include <variant>
 #include <vector>
 
+#if __has_include(<unistd.h>) && __has_include(<sys/wait.h>)
+#define VALIDATION_BATCH_SUPPORTED
+#include <cerrno>
+#include <csignal>
+#include <cstdlib>
+#include <fcntl.h>
+#include <sys/wait.h>
+#include <unistd.h>
+#endif
+
 const std::string_view case_sensitive_flag       = "case_sensitive";
 const std::string_view ws_sensitive_flag         = "space_change_sensitive";
 const std::string_view constraints_file_flag     = "--constraints_file";
 const std::string_view generate_flag             = "--generate";
 const std::string_view generate_binary_substring = "generat";
+const char* const batch_env_var                  = "VALIDATION_BATCH";
+const char* const batch_timeout_env_var          = "VALIDATION_BATCH_TIMEOUT";
 
 inline struct ArbitraryTag {
 	static constexpr bool unique     = false;
@@ -547,6 +559,113 @@ T& select(std::pair<T, T>& in, std::mt19937_64& rng) {
 
 } // namespace Random
 
+// Batch mode validates many files with a single validator process, to avoid paying the process
+// startup and static initialization for every testcase.
+// It is enabled by setting the environment variable VALIDATION_BATCH to the path of a jobs file.
+// The constructor of InputValidator then forks a child for every job. The child continues with
+// the rest of main() as if it was called for that job alone, so every job starts from a fresh
+// Validator state. The parent waits for each child, prints one line with its exit code (or minus
+// the signal that killed it) per job to stdout, and exits.
+//
+// Every line of the jobs file is one job, consisting of NUL-separated fields:
+//   working directory, stdin path, stdout path, stderr path, argument, argument, ...
+// The arguments replace argv[1..argc-1], so every job must have exactly argc-1 arguments, and
+// they may contain e.g. --constraints_file. VALIDATION_BATCH_TIMEOUT optionally gives the wall
+// time limit of a single job in seconds.
+//
+// Batch mode requires that main() does not use argv or the standard input before constructing
+// the validator. Answer validators usually read the input file given in argv[1] first, so they
+// do not support batch mode.
+namespace Batch {
+
+#ifdef VALIDATION_BATCH_SUPPORTED
+
+inline std::vector<std::vector<std::string>> read_jobs(const char* path) {
+	std::ifstream is(path);
+	if(!is) {
+		std::cerr << "Could not open batch jobs file " << path << std::endl;
+		exit(1);
+	}
+	std::vector<std::vector<std::string>> jobs;
+	std::string line;
+	while(std::getline(is, line)) {
+		auto& job = jobs.emplace_back();
+		std::string::size_type start = 0;
+		while(true) {
+			auto end = line.find('\0', start);
+			job.push_back(line.substr(start, end - start));
+			if(end == std::string::npos) break;
+			start = end + 1;
+		}
+	}
+	return jobs;
+}
+
+inline bool redirect(int fd, const std::string& path, int flags) {
+	int file = open(path.c_str(), flags, 0644);
+	if(file < 0) return false;
+	bool ok = dup2(file, fd) >= 0;
+	close(file);
+	return ok;
+}
+
+// Returns in the child process of each job. Never returns in the parent.
+inline void run(int argc, char** argv) {
+	const char* jobs_path = std::getenv(batch_env_var);
+	if(jobs_path == nullptr or argv == nullptr) return;
+	auto jobs = read_jobs(jobs_path);
+	const char* timeout = std::getenv(batch_timeout_env_var);
+	unsigned int timeout_seconds = timeout == nullptr ? 0 : std::stoul(timeout);
+
+	std::vector<int> codes;
+	for(const auto& job : jobs) {
+		if(job.size() != 4 + static_cast<size_t>(argc - 1)) {
+			std::cerr << "Batch job has " << job.size() << " fields, expected " << 4 + argc - 1
+			          << "." << std::endl;
+			exit(1);
+		}
+		std::cout.flush();
+		std::fflush(nullptr);
+		pid_t pid = fork();
+		if(pid < 0) {
+			std::cerr << "Could not fork for a batch job." << std::endl;
+			exit(1);
+		}
+		if(pid == 0) {
+			unsetenv(batch_env_var);
+			unsetenv(batch_timeout_env_var);
+			if(chdir(job[0].c_str()) != 0 or !redirect(0, job[1], O_RDONLY) or
+			   !redirect(1, job[2], O_WRONLY | O_CREAT | O_TRUNC) or
+			   !redirect(2, job[3], O_WRONLY | O_CREAT | O_TRUNC)) {
+				_exit(1);
+			}
+			// The strings are owned by the child from now on.
+			for(int i = 1; i < argc; ++i) argv[i] = strdup(job[4 + i - 1].c_str());
+			if(timeout_seconds > 0) alarm(timeout_seconds);
+			return;
+		}
+		int status;
+		while(waitpid(pid, &status, 0) < 0) {
+			if(errno != EINTR) {
+				std::cerr << "Could not wait for a batch job." << std::endl;
+				exit(1);
+			}
+		}
+		codes.push_back(WIFEXITED(status) ? WEXITSTATUS(status) : -WTERMSIG(status));
+	}
+	for(int code : codes) std::cout << code << '\n';
+	std::cout.flush();
+	exit(0);
+}
+
+#else
+
+inline void run(int /*argc*/, char** /*argv*/) {}
+
+#endif
+
+} // namespace Batch
+
 class Validator {
   protected:
 	Validator(bool ws_, bool case_, std::istream& in_, std::string constraints_file_path_ = "",
@@ -1414,10 +1533,16 @@ class InputValidator : public Validator {
   public:
 	// An InputValidator is always both whitespace and case sensitive.
 	explicit InputValidator(int argc = 0, char** argv = nullptr)
+	    : InputValidator((Batch::run(argc, argv), BatchJob{}), argc, argv) {}
+
+  private:
+	struct BatchJob {};
+
+	// Arguments are only parsed after Batch::run returned for the current job.
+	InputValidator(BatchJob /*unused*/, int argc, char** argv)
 	    : Validator(true, true, std::cin, get_constraints_file(argc, argv), get_seed(argc, argv),
 	                get_params(argc, argv)) {}
 
-  private:
 	static std::optional<unsigned int> get_seed(int argc, char** argv) {
 		for(int i = 1; i < argc - 1; ++i) {
 			if(argv[i] == generate_flag) {
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+
+# Compares plain and compressed storage of cached testcases, as used by
+# `bt generate --compress-cache`, on one or more filesystems.
+# For each directory, a synthetic testcase is written to a cache directory and stored plain or
+# compressed, deployed to a data directory, and piped from the cache into a submission that reads
+# all of stdin, the way Submission.run and InputValidator.run do via cache.open_stdin.
+#
+# Usage: bench_compressed_cache.py [--size MiB] [--repeat N] DIR [DIR ...]
+# E.g.:  bench_compressed_cache.py /dev/shm /var/tmp
+# to compare tmpfs and SSD.
+
+import argparse
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'bin'))
+
+import config  # noqa: E402 (config must be imported before cache)
+import cache  # noqa: E402
+
+# A submission that reads all of its input.
+SUBMISSION = [sys.executable, '-c', 'import sys\nwhile sys.stdin.buffer.read(1 << 16): pass']
+
+
+# Numbers separated by spaces and newlines, which compress roughly like typical test data.
+def write_testcase(path, size):
+    rng = random.Random(42)
+    lines = [' '.join(str(rng.randint(0, 10**9)) for _ in range(10)) + '\n' for _ in range(10000)]
+    block = ''.join(lines).encode()
+    with path.open('wb') as f:
+        written = 0
+        while written < size:
+            f.write(block[: size - written])
+            written += len(block)
+
+
+def bench(directory, size, compressed):
+    with tempfile.TemporaryDirectory(dir=directory) as tmp:
+        tmp = Path(tmp)
+        cachedir = tmp / 'cache'
+        datadir = tmp / 'data'
+        cachedir.mkdir()
+        datadir.mkdir()
+        source = cachedir / 'testcase.in'
+        times = dict()
+
+        start = time.perf_counter()
+        write_testcase(source, size)
+        if compressed:
+            cache.compress_file(source)
+        times['store'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        with cache.open_stdin(source) as stdin:
+            subprocess.run(SUBMISSION, stdin=stdin, check=True)
+        times['run'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        if compressed:
+            cache.decompress_file(source, datadir / 'testcase.in')
+        else:
+            # A copy rather than a link, as when the tmpdir is on another filesystem than data/.
+            with source.open('rb') as src, (datadir / 'testcase.in').open('wb') as dst:
+                while data := src.read(1 << 20):
+                    dst.write(data)
+        times['deploy'] = time.perf_counter() - start
+
+        times['total'] = times['store'] + times['run'] + times['deploy']
+        times['cache size'] = sum(f.stat().st_size for f in cachedir.iterdir())
+        return times
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Compare plain and compressed storage of cached testcases.'
+    )
+    parser.add_argument('--size', type=int, default=256, help='Testcase size in MiB.')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('dirs', nargs='+', type=Path)
+    args = parser.parse_args()
+
+    method = 'zstd' if cache.has_zstandard else 'gzip'
+    print(
+        f'{"directory":<20} {"storage":<8} {"store":>8} {"run":>8} {"deploy":>8} {"total":>8}'
+        f' {"cache":>10}'
+    )
+    for directory in args.dirs:
+        for compressed in [False, True]:
+            results = [
+                bench(directory, args.size * 1024 * 1024, compressed) for _ in range(args.repeat)
+            ]
+            best = {key: min(r[key] for r in results) for key in results[0]}
+            print(
+                f'{str(directory):<20} {method if compressed else "plain":<8}'
+                f' {best["store"]:>7.2f}s {best["run"]:>7.2f}s {best["deploy"]:>7.2f}s'
+                f' {best["total"]:>7.2f}s {best["cache size"] / 1024 / 1024:>6.1f} MiB'
+            )
+
+
+if __name__ == '__main__':
+    main()
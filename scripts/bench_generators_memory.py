@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+
+# Measures the time and memory used to parse a large generators.yaml.
+# A synthetic problem is created with `--rules` seeded rules that each have `count: --count`,
+# so 1000 rules with count 100 give 100k testcases.
+#
+# Usage: bench_generators_memory.py [--rules N] [--count N]
+
+import argparse
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'bin'))
+
+import config  # noqa: E402 (config must be imported before the other modules)
+import generate  # noqa: E402
+import problem  # noqa: E402
+
+
+def write_problem(path, rules, count):
+    (path / 'generators').mkdir(parents=True)
+    (path / 'problem_statement').mkdir()
+    (path / 'problem_statement' / 'problem.en.tex').write_text('\\problemname{Benchmark}\n')
+    (path / 'problem.yaml').write_text(
+        'name: Benchmark\nuuid: 00000000-0000-0000-0000-000000000000\n'
+    )
+    (path / 'generators' / 'gen.py').write_text('#!/usr/bin/env python3\nprint(0)\n')
+    lines = ['solution: /submissions/accepted/sol.py', 'data:', '  sample:', '    data: []']
+    lines += ['  secret:', '    data:']
+    for i in range(rules):
+        lines += [
+            f'      rule{i}:',
+            f'        generate: gen.py {i} {{seed}}',
+            f'        count: {count}',
+        ]
+    (path / 'generators' / 'generators.yaml').write_text('\n'.join(lines) + '\n')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure parsing a large generators.yaml.')
+    parser.add_argument('--rules', type=int, default=1000)
+    parser.add_argument('--count', type=int, default=100)
+    args = parser.parse_args()
+
+    config.args.action = 'generate'
+    config.args.no_bar = True
+    config.set_default_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        problem_path = tmp / 'problem'
+        write_problem(problem_path, args.rules, args.count)
+        p = problem.Problem(problem_path, tmp / 'tmpdir')
+
+        for run in ['parse', 'cached']:
+            tracemalloc.start()
+            start = time.perf_counter()
+            generator_config = generate.GeneratorConfig(p)
+            duration = time.perf_counter() - start
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print(
+                f'{run:<8} {len(generator_config.known_cases):>8} testcases'
+                f' {duration:>7.2f}s  retained {current / 2**20:>7.1f} MiB'
+                f'  peak {peak / 2**20:>7.1f} MiB'
+            )
+            del generator_config
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+
+# Measures the time and memory used by the testcase sanity check (validate.sanity_check) on large
+# files. For each size, a synthetic testcase of numbers separated by spaces and newlines is
+# written to a temporary directory and checked with strict and lenient whitespace.
+# With --legacy, the previous implementation that loops over all bytes in Python is measured
+# as well; this takes minutes for the larger sizes.
+#
+# Usage: bench_sanity_check.py [--sizes MiB ...] [--dir DIR] [--legacy]
+# E.g.:  bench_sanity_check.py --sizes 20 200 1024
+
+import argparse
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'bin'))
+
+import config  # noqa: E402 (config must be imported before validate)
+import validate  # noqa: E402
+
+
+class Bar:
+    def __init__(self):
+        self.warnings = []
+
+    def warn(self, message):
+        self.warnings.append(message)
+
+
+def write_testcase(path, size):
+    rng = random.Random(42)
+    # Repeat a block of random lines, since generating all lines is slower than the check itself.
+    lines = [' '.join(str(rng.randint(0, 10**9)) for _ in range(10)) + '\n' for _ in range(10000)]
+    block = ''.join(lines).encode()
+    with path.open('wb') as f:
+        written = 0
+        while written < size:
+            f.write(block[: size - written])
+            written += len(block)
+        # Make sure the file ends in a newline.
+        f.seek(-1, 2)
+        f.write(b'\n')
+
+
+# The implementation before the streaming scan, reading the whole file at once.
+def legacy_check(path, strict_whitespace):
+    file_bytes = path.read_bytes()
+    allowed = set(validate._STRICT_BYTES if strict_whitespace else validate._LENIENT_BYTES)
+    if any(b not in allowed for b in file_bytes):
+        return
+    last = -1
+    for byte in file_bytes:
+        cur_whitespace = byte == ord(' ') or byte == ord('\n')
+        if last == ord(' ') and cur_whitespace:
+            return
+        if last == ord('\n') and byte == ord(' '):
+            return
+        last = byte
+
+
+def measure(f):
+    tracemalloc.start()
+    start = time.perf_counter()
+    f()
+    duration = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return duration, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure the testcase sanity check.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[20, 200, 1024], help='In MiB.')
+    parser.add_argument('--dir', type=Path, help='Directory for the testcases.')
+    parser.add_argument('--legacy', action='store_true', help='Also measure the old check.')
+    args = parser.parse_args()
+
+    config.set_default_args()
+
+    print(f'{"size":>9} {"mode":<8} {"implementation":<14} {"time":>8} {"speed":>11} {"peak":>10}')
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+        path = Path(tmp) / 'testcase.in'
+        for size in args.sizes:
+            write_testcase(path, size * 2**20)
+            for strict in [True, False]:
+                implementations = [
+                    ('streaming', lambda: validate.sanity_check(path, Bar(), strict)),
+                ]
+                if args.legacy:
+                    implementations.append(('legacy', lambda: legacy_check(path, strict)))
+                for name, f in implementations:
+                    duration, peak = measure(f)
+                    print(
+                        f'{size:>5} MiB {"strict" if strict else "lenient":<8} {name:<14}'
+                        f' {duration:>7.2f}s {size / duration:>7.0f} MiB/s'
+                        f' {peak / 2**20:>6.1f} MiB'
+                    )
+
+
+if __name__ == '__main__':
+    main()
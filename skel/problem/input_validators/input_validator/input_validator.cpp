@@ -5,6 +5,8 @@
 // E.g., check that a graph is connected.
 
 int main(int argc, char *argv[]) {
+    // Construct the validator before using argv or std::cin, so that it supports
+    // `bt validate --batch-validation`.
     InputValidator v(argc, argv);
     int n = v.read_integer("n", 0, 100000);
     v.space();
@@ -20,6 +20,9 @@ command: !="" & (=~"^([^{}]|\\{name\\}|\\{count\\})*(\\{seed(:[0-9]+)?\\})?([^{}
 	// Path to visualiser can be omitted
 	visualizer?:  command & =~"^/" | null
 	random_salt?: string
+	// Limits for running the generators in parallel (BAPCtools only).
+	max_parallel?: int & >=1
+	memory?:       int & >=1
 }
 
 #testcase:
@@ -49,6 +52,10 @@ command: !="" & (=~"^([^{}]|\\{name\\}|\\{count\\})*(\\{seed(:[0-9]+)?\\})?([^{}
 	// Each consists of a list of paths relative to "/generators/",
 	// such as "tree_generator/tree.h".
 	generators?: [name]: [...(filepath & !~"^/")]
+	// Generators (relative to "/generators/") that support the batch protocol.
+	batch_generators?: [...(filepath & !~"^/")]
+	// Whether testcases may be generated in parallel, or the maximum number of parallel jobs.
+	parallel?: bool | int & >=0
 	data: close({
 		sample!:          #testgroup
 		secret!:          #testgroup
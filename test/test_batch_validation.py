@@ -0,0 +1,134 @@
+import pytest
+import shutil
+from pathlib import Path
+
+import config
+import problem
+import util
+import validate
+from util import ExecStatus
+
+config.RUNNING_TEST = True
+config.set_default_args()
+
+HEADER = Path(__file__).resolve().parent.parent / 'headers' / 'validation.h'
+
+INPUT_VALIDATOR = '''#include "validation.h"
+int main(int argc, char *argv[]) {
+    InputValidator v(argc, argv);
+    v.read_integer("n", 0, 100);
+    v.newline();
+}
+'''
+
+# Like the skeleton, this opens the input before constructing the validator.
+ANSWER_VALIDATOR = '''#include "validation.h"
+int main(int argc, char *argv[]) {
+    std::ifstream in(argv[1]);
+    int n;
+    in >> n;
+    AnswerValidator v(argc, argv);
+    v.read_integer("answer", n, n);
+    v.newline();
+}
+'''
+
+# Input and answer of each testcase. The answer must be equal to the input.
+TESTCASES = {
+    '1': ('1', '1'),
+    '2': ('2', '2'),
+    '3': ('3', '4'),
+    '4': ('200', '200'),
+    '5': ('5', '5'),
+}
+
+
+@pytest.fixture
+def batch_problem(tmp_path, monkeypatch):
+    path = tmp_path / 'batch'
+    (path / 'problem_statement').mkdir(parents=True)
+    (path / 'problem_statement' / 'problem.en.tex').write_text('\\problemname{Batch}\n')
+    (path / 'problem.yaml').write_text('name: Batch\nuuid: 00000000-0000-0000-0000-000000000000\n')
+    for kind, source in [('input', INPUT_VALIDATOR), ('answer', ANSWER_VALIDATOR)]:
+        directory = path / f'{kind}_validators' / 'validator'
+        directory.mkdir(parents=True)
+        (directory / 'validator.cpp').write_text(source)
+        shutil.copy(HEADER, directory / 'validation.h')
+    secret = path / 'data' / 'secret'
+    secret.mkdir(parents=True)
+    for name, (in_, ans) in TESTCASES.items():
+        (secret / f'{name}.in').write_text(in_ + '\n')
+        (secret / f'{name}.ans').write_text(ans + '\n')
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(config.args, 'revalidate', True)
+    monkeypatch.setattr(config.args, 'jobs', 1)
+    return problem.Problem(path, tmp_path / 'tmp')
+
+
+def verdicts(p, mode, batch, monkeypatch, constraints=None):
+    monkeypatch.setattr(config.args, 'batch_validation', batch)
+    cls = validate.InputValidator if mode == validate.Mode.INPUT else validate.AnswerValidator
+    testcases = p.testcases(mode=mode)
+    if batch:
+        p._run_validator_batches(testcases, mode, constraints)
+    result = dict()
+    for t in testcases:
+        for validator in p.validators(cls, check_constraints=constraints is not None):
+            ret = t._run_validator(validator, mode, constraints=constraints, args=[])
+            result[t.name] = ret.status
+    return result
+
+
+@pytest.mark.skipif(util.is_windows() or shutil.which('g++') is None, reason='needs g++ and fork()')
+class TestBatchValidation:
+    def test_input(self, batch_problem, monkeypatch):
+        expected = verdicts(batch_problem, validate.Mode.INPUT, False, monkeypatch)
+        assert expected['secret/4'] == ExecStatus.REJECTED
+        assert verdicts(batch_problem, validate.Mode.INPUT, True, monkeypatch) == expected
+
+    def test_input_is_batched(self, batch_problem, monkeypatch):
+        monkeypatch.setattr(config.args, 'batch_validation', True)
+        testcases = batch_problem.testcases(mode=validate.Mode.INPUT)
+        batch_problem._run_validator_batches(testcases, validate.Mode.INPUT, None)
+        assert all(t.batch_results for t in testcases)
+
+    def test_input_constraints(self, batch_problem, monkeypatch):
+        expected = dict()
+        verdicts(batch_problem, validate.Mode.INPUT, False, monkeypatch, expected)
+        assert expected
+        constraints = dict()
+        verdicts(batch_problem, validate.Mode.INPUT, True, monkeypatch, constraints)
+        assert constraints == expected
+
+    def test_answer(self, batch_problem, monkeypatch):
+        expected = verdicts(batch_problem, validate.Mode.ANSWER, False, monkeypatch)
+        assert expected['secret/3'] == ExecStatus.REJECTED
+        assert expected['secret/5'] == ExecStatus.ACCEPTED
+        assert verdicts(batch_problem, validate.Mode.ANSWER, True, monkeypatch) == expected
+
+    def test_answer_is_not_batched(self, batch_problem):
+        (validator,) = batch_problem.validators(validate.AnswerValidator)
+        assert not validator.supports_batch()
+
+    def test_jobs_file_is_not_in_build_dir(self, batch_problem, monkeypatch):
+        # The build directory may be shared with other problems and commands.
+        runs = []
+        exec_command = validate.exec_command
+
+        def record(command, **kwargs):
+            runs.append((kwargs['cwd'], Path(kwargs['env'][validate.BATCH_ENV_VAR])))
+            return exec_command(command, **kwargs)
+
+        monkeypatch.setattr(validate, 'exec_command', record)
+        monkeypatch.setattr(config.args, 'batch_validation', True)
+        testcases = batch_problem.testcases(mode=validate.Mode.INPUT)
+        batch_problem._run_validator_batches(testcases, validate.Mode.INPUT, None)
+        assert all(t.batch_results for t in testcases)
+
+        (validator,) = batch_problem.validators(validate.InputValidator)
+        ((cwd, jobs_path),) = runs
+        assert cwd.is_relative_to(batch_problem.tmpdir / 'tool_runs')
+        assert jobs_path.parent == cwd
+        assert not jobs_path.exists()
+        assert not list(validator.tmpdir.glob('batch_*'))
@@ -0,0 +1,109 @@
+import os
+import sqlite3
+import time
+import pytest
+from contextlib import closing
+
+import config
+import cache
+
+config.RUNNING_TEST = True
+config.set_default_args()
+
+# More than a day ago.
+OLD = time.time() - 2 * 24 * 60 * 60
+
+
+def rows(path, table):
+    with closing(sqlite3.connect(path)) as connection:
+        return {key for (key,) in connection.execute(f'SELECT key FROM {table}')}
+
+
+# A tmpdir with two cached testcases of one problem, each with a validation result and a file
+# hash. Testcase `old` was last used long ago, after its rows, and `new` is used by the current
+# command.
+@pytest.fixture
+def tmpdir(tmp_path):
+    tmpdir = tmp_path / 'tmp'
+    problem = tmpdir / 'problem'
+    data = problem / 'data'
+    for h in ['old', 'new']:
+        (data / h).mkdir(parents=True)
+        (data / h / 'testcase.in').write_bytes(b'1\n' * 100000)
+
+    manifest = cache.Manifest(data / 'manifest.sqlite')
+    deployed = cache.Manifest(data / 'manifest.sqlite', table='deployed')
+    validation = cache.Manifest(problem / 'cache.sqlite', table='validation')
+    file_hashes = cache.Manifest(problem / 'cache.sqlite', table='file_hashes')
+    for h in ['old', 'new']:
+        manifest.set(h, {'hash': h})
+        deployed.set(f'data/secret/{h}.in', {'hash': h})
+        validation.set(h, {'ret': 0})
+        file_hashes.set(h, {'hash': h})
+    for c in [manifest, deployed, validation, file_hashes]:
+        c.flush()
+
+    with closing(sqlite3.connect(problem / 'cache.sqlite')) as connection, connection:
+        for table in ['validation', 'file_hashes']:
+            connection.execute(f"UPDATE {table} SET used = ? WHERE key = 'old'", (OLD - 60,))
+    os.utime(data / 'old', (OLD, OLD))
+    return tmpdir
+
+
+def test_rows_are_marked_used(tmpdir):
+    path = tmpdir / 'problem' / 'cache.sqlite'
+    validation = cache.Manifest(path, table='validation')
+    assert validation.get('old') is not None
+    validation.flush()
+    with closing(sqlite3.connect(path)) as connection:
+        ((used,),) = connection.execute("SELECT used FROM validation WHERE key = 'old'")
+    assert used > OLD
+
+
+def test_rows_without_time_of_use(tmp_path):
+    # A database written before rows recorded when they were used.
+    path = tmp_path / 'cache.sqlite'
+    with closing(sqlite3.connect(path)) as connection, connection:
+        connection.execute('CREATE TABLE validation (key TEXT PRIMARY KEY, value TEXT NOT NULL)')
+        connection.execute('INSERT INTO validation VALUES (?, ?)', ('a', '{"ret": 0}'))
+    validation = cache.Manifest(path, table='validation')
+    assert validation.get('a') == {'ret': 0}
+    validation.flush()
+    assert rows(path, 'validation') == {'a'}
+
+
+def test_gc_drops_rows_of_evicted_entries(tmpdir):
+    problem = tmpdir / 'problem'
+    # Evicting `old` is enough.
+    freed = cache.collect_garbage(tmpdir, 300000, time.time() - 60)
+    assert freed >= 200000
+
+    assert not (problem / 'data' / 'old').exists()
+    assert (problem / 'data' / 'new').exists()
+    assert rows(problem / 'data' / 'manifest.sqlite', 'entries') == {'new'}
+    assert rows(problem / 'cache.sqlite', 'validation') == {'new'}
+    assert rows(problem / 'cache.sqlite', 'file_hashes') == {'new'}
+    # The deployed files in data/ are still tracked.
+    assert len(rows(problem / 'data' / 'manifest.sqlite', 'deployed')) == 2
+
+
+def test_gc_keeps_rows_within_budget(tmpdir):
+    problem = tmpdir / 'problem'
+    assert cache.collect_garbage(tmpdir, 10**9, time.time() - 60) == 0
+    assert rows(problem / 'data' / 'manifest.sqlite', 'entries') == {'old', 'new'}
+    assert rows(problem / 'cache.sqlite', 'validation') == {'old', 'new'}
+
+
+def test_gc_drops_unused_rows_over_budget(tmpdir):
+    problem = tmpdir / 'problem'
+    # Nothing can be evicted, so only the rows not used since `keep_since` are dropped.
+    cache.collect_garbage(tmpdir, 0, OLD - 30)
+    assert (problem / 'data' / 'old').exists()
+    assert rows(problem / 'data' / 'manifest.sqlite', 'entries') == {'old', 'new'}
+    assert rows(problem / 'cache.sqlite', 'validation') == {'new'}
+    assert rows(problem / 'cache.sqlite', 'file_hashes') == {'new'}
+
+    cache.collect_garbage(tmpdir, 0, time.time() + 60)
+    assert not (problem / 'data' / 'new').exists()
+    assert rows(problem / 'data' / 'manifest.sqlite', 'entries') == set()
+    assert rows(problem / 'cache.sqlite', 'validation') == set()
@@ -0,0 +1,63 @@
+import subprocess
+import sys
+import pytest
+
+import config
+import cache
+from util import hash_file_content
+
+config.RUNNING_TEST = True
+config.set_default_args()
+
+CONTENT = b''.join(b'%d %d\n' % (i, i * i) for i in range(200000))
+
+
+@pytest.fixture
+def stored(tmp_path):
+    path = tmp_path / 'testcase.in'
+    path.write_bytes(CONTENT)
+    plain_hash = hash_file_content(path)
+    cache.compress_file(path)
+    return path, plain_hash
+
+
+def test_compress_file(stored):
+    path, plain_hash = stored
+    assert not path.exists()
+    assert cache.compressed_path(path) is not None
+    assert cache.is_stored(path)
+    assert cache.hash_stored(path) == plain_hash
+
+
+def test_decompress_to_target(stored, tmp_path):
+    path, _ = stored
+    target = tmp_path / 'data.in'
+    cache.decompress_file(path, target)
+    assert target.read_bytes() == CONTENT
+    assert cache.compressed_path(path) is not None
+
+    cache.decompress_file(path)
+    assert path.read_bytes() == CONTENT
+    assert cache.compressed_path(path) is None
+
+
+def test_open_stdin_streams(stored):
+    path, _ = stored
+    with cache.open_stdin(path) as stdin:
+        out = subprocess.run(['wc', '-c'], stdin=stdin, capture_output=True, check=True).stdout
+    assert int(out) == len(CONTENT)
+    # Only the compressed file is stored.
+    assert not path.exists()
+
+
+def test_open_stdin_partial_read(stored):
+    # A process that exits before reading its whole input must not block the writer.
+    path, _ = stored
+    with cache.open_stdin(path) as stdin:
+        out = subprocess.run(
+            [sys.executable, '-c', 'import sys; print(sys.stdin.readline().strip())'],
+            stdin=stdin,
+            capture_output=True,
+            check=True,
+        ).stdout
+    assert out == b'0 0\n'
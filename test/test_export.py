@@ -0,0 +1,96 @@
+import pytest
+import struct
+import zipfile
+
+import config
+import cache
+import export
+
+config.RUNNING_TEST = True
+config.set_default_args()
+
+
+@pytest.fixture
+def files(tmp_path):
+    directory = tmp_path / 'files'
+    directory.mkdir()
+    for i in range(4):
+        (directory / f'{i}.in').write_text(f'{i}\n' * 1000)
+    nested = directory / 'nested.zip'
+    with zipfile.ZipFile(nested, 'w') as zf:
+        zf.writestr('a.txt', 'a' * 1000)
+    return directory
+
+
+def build(tmp_path, files):
+    cache_path = tmp_path / 'cache.sqlite'
+    output = tmp_path / 'out.zip'
+    with export.IncrementalZip(
+        output, cache.FileHashes(cache_path), cache.Manifest(cache_path, table='zip_entries')
+    ) as zf:
+        for f in sorted(files.iterdir()):
+            zf.write(f, f'data/{f.name}')
+    return zf
+
+
+# The local header and compressed data of each entry, as written to the zip.
+def raw_entries(path):
+    entries = dict()
+    with zipfile.ZipFile(path) as zf, path.open('rb') as f:
+        for info in zf.infolist():
+            f.seek(info.header_offset)
+            header = f.read(zipfile.sizeFileHeader)
+            name_length, extra_length = struct.unpack('<HH', header[26:30])
+            entries[info.filename] = f.read(name_length + extra_length + info.compress_size)
+    return entries
+
+
+def test_reuse_unchanged_entries(tmp_path, files):
+    zf = build(tmp_path, files)
+    assert (zf.reused, zf.compressed) == (0, 5)
+    before = raw_entries(zf.output)
+
+    (files / '2.in').write_text('changed\n')
+    zf = build(tmp_path, files)
+    assert (zf.reused, zf.compressed) == (4, 1)
+
+    with zipfile.ZipFile(zf.output) as z:
+        assert z.testzip() is None
+        assert z.read('data/2.in') == b'changed\n'
+        assert z.getinfo('data/nested.zip').compress_type == zipfile.ZIP_STORED
+    after = raw_entries(zf.output)
+    assert after.keys() == before.keys()
+    for name in before:
+        if name != 'data/2.in':
+            assert after[name] == before[name]
+
+
+def test_broken_entry_is_compressed_again(tmp_path, files):
+    zf = build(tmp_path, files)
+    with zipfile.ZipFile(zf.output) as z:
+        offset = z.getinfo('data/1.in').header_offset
+    # Corrupt the local header signature of a single entry.
+    with zf.output.open('r+b') as f:
+        f.seek(offset)
+        f.write(b'XXXX')
+
+    zf = build(tmp_path, files)
+    assert (zf.reused, zf.compressed) == (4, 1)
+    with zipfile.ZipFile(zf.output) as z:
+        assert z.testzip() is None
+        assert z.read('data/1.in') == b'1\n' * 1000
+
+
+def test_without_zipfile_internals(tmp_path, files, monkeypatch):
+    zf = build(tmp_path, files)
+    # As if a future version of zipfile renamed one of its internals.
+    monkeypatch.setattr(
+        export.IncrementalZip, 'ZIPFILE_INTERNALS', export.IncrementalZip.ZIPFILE_INTERNALS + ['_x']
+    )
+    (files / '2.in').write_text('changed\n')
+    zf = build(tmp_path, files)
+    assert not zf.can_copy
+    assert (zf.reused, zf.compressed) == (0, 5)
+    with zipfile.ZipFile(zf.output) as z:
+        assert z.testzip() is None
+        assert z.read('data/2.in') == b'changed\n'
@@ -1,6 +1,8 @@
 import argparse
 import collections
+import io
 import pytest
+import tarfile
 import yaml
 from pathlib import Path
 
@@ -44,6 +46,8 @@ class MockGeneratorConfig(generate.GeneratorConfig):
         self.trashdir = None
         # Files that should be processed
         self.restriction = restriction
+        # Files (other than generators.yaml) that the parsed rules depend on, with their stat.
+        self.parse_dependencies = dict()
 
 
 class TestGeneratorConfig:
@@ -59,3 +63,77 @@ class TestGeneratorConfig:
             gen_config.parse_yaml(yamldoc)
             if gen_config.n_parse_error > 0:
                 raise generate.ParseException()
+
+
+class TestParseCache:
+    def parsed_config(self, tmp_path):
+        problem = MockProblem()
+        problem.tmpdir = tmp_path
+        gen_config = MockGeneratorConfig(problem)
+        gen_config.parse_yaml({'data': {'sample': {'data': []}, 'secret': {'data': []}}})
+        return gen_config
+
+    def test_hit(self, tmp_path):
+        gen_config = self.parsed_config(tmp_path)
+        gen_config._write_parse_cache('key', [])
+
+        cached = MockGeneratorConfig(gen_config.problem)
+        assert cached._load_parse_cache('key')
+        assert cached.known_directories == gen_config.known_directories
+        assert not MockGeneratorConfig(gen_config.problem)._load_parse_cache('other key')
+
+    def test_dependency_changed(self, tmp_path):
+        gen_config = self.parsed_config(tmp_path)
+        dependency = tmp_path / 'copied.in'
+        dependency.write_text('1\n')
+        gen_config.add_parse_dependency(dependency)
+        gen_config._write_parse_cache('key', [])
+        assert MockGeneratorConfig(gen_config.problem)._load_parse_cache('key')
+
+        dependency.write_text('12\n')
+        assert not MockGeneratorConfig(gen_config.problem)._load_parse_cache('key')
+
+    def test_code_changed(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(config.args, 'action', 'generate', raising=False)
+        gen_config = self.parsed_config(tmp_path)
+        yaml_text = 'data: {}'
+        key = gen_config._parse_key(yaml_text)
+        assert gen_config._parse_key(yaml_text) == key
+
+        monkeypatch.setattr(generate, '_bin_code_hash', 'changed')
+        assert gen_config._parse_key(yaml_text) != key
+
+
+class TestCount:
+    def test_config_per_testcase(self):
+        gen_config = MockGeneratorConfig(MockProblem())
+        gen_config.parse_yaml(
+            {
+                'data': {
+                    'sample': {'data': []},
+                    'secret': {'data': {'a': {'in': '1', 'count': 3, 'max_parallel': 1}}},
+                }
+            }
+        )
+        testcases = [t for t in gen_config.known_cases.values() if t.path.parts[0] == 'secret']
+        assert len(testcases) == 3
+        for t in testcases:
+            assert t.config.max_parallel == (str(t.path), 1)
+
+
+class TestImportCache:
+    def test_invalid_hash(self, tmp_path):
+        problem = MockProblem()
+        problem.tmpdir = tmp_path / 'tmp'
+        victim = problem.tmpdir / 'victim'
+        victim.mkdir(parents=True)
+        manifest = b'{"../victim": {}}'
+        with tarfile.open(tmp_path / 'cache.tar', 'w') as tar:
+            info = tarfile.TarInfo('manifest.json')
+            info.size = len(manifest)
+            tar.addfile(info, io.BytesIO(manifest))
+
+        # error() exits while running tests.
+        with pytest.raises(SystemExit):
+            MockGeneratorConfig(problem).import_cache(tmp_path / 'cache.tar')
+        assert victim.is_dir()
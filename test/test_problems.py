@@ -86,6 +86,7 @@ class TestIdentityProblem:
     # def test_output(self): tools.test(['output'])
     def test_validate(self):
         tools.test(['validate'])
+        tools.test(['validate', '--batch-validation'])
 
     def test_constraints(self):
         tools.test(['constraints', '-e'])
@@ -0,0 +1,154 @@
+import argparse
+import pytest
+from pathlib import Path
+
+import config
+import cache
+import validate
+import testcase as testcase_module
+from util import ExecResult, ExecStatus
+
+config.RUNNING_TEST = True
+config.set_default_args()
+
+
+class MockProblem:
+    def __init__(self, tmp_path):
+        self.path = tmp_path / 'problem'
+        self.tmpdir = tmp_path / 'tmp'
+        self.tmpdir.mkdir()
+        self.settings = argparse.Namespace(validator_flags=[])
+        self._file_hashes = cache.FileHashes(self.tmpdir / 'cache.sqlite')
+        self._validation_cache = cache.Manifest(self.tmpdir / 'cache.sqlite', table='validation')
+
+    def file_hashes(self):
+        return self._file_hashes
+
+    def validation_cache(self):
+        return self._validation_cache
+
+
+# Validators that count how often they are run, instead of running a program.
+class CountingValidator:
+    def __init__(self, hash, status=ExecStatus.ACCEPTED):
+        self.hash = hash
+        self.status = status
+        self.runs = 0
+
+    def run(self, testcase, mode, constraints=None, args=None):
+        self.runs += 1
+        if constraints is not None:
+            constraints['validate.cpp:1'] = ('n', True, False, 1, 1, 1, 10)
+        return ExecResult(None, self.status, 0, False, 'err', 'out')
+
+
+class CountingInputValidator(CountingValidator, validate.InputValidator):
+    pass
+
+
+class CountingOutputValidator(CountingValidator, validate.OutputValidator):
+    pass
+
+
+@pytest.fixture
+def problem(tmp_path, monkeypatch):
+    monkeypatch.setattr(config.args, 'revalidate', None)
+    return MockProblem(tmp_path)
+
+
+@pytest.fixture
+def testcase(problem):
+    data = problem.path / 'data' / 'secret'
+    data.mkdir(parents=True)
+    (data / '1.in').write_text('1\n')
+    (data / '1.ans').write_text('2\n')
+    return testcase_module.Testcase(problem, data / '1.in', short_path=Path('secret/1.in'))
+
+
+def run(testcase, validator, mode=validate.Mode.INPUT, args=[]):
+    return testcase._run_validator(validator, mode, constraints=None, args=args)
+
+
+class TestValidationCache:
+    def test_hit(self, testcase):
+        validator = CountingInputValidator('a')
+        assert run(testcase, validator).status == ExecStatus.ACCEPTED
+        ret = run(testcase, validator)
+        assert validator.runs == 1
+        assert ret.status == ExecStatus.ACCEPTED
+        assert (ret.err, ret.out) == ('err', 'out')
+
+    def test_rejected_is_cached(self, testcase):
+        validator = CountingInputValidator('a', ExecStatus.REJECTED)
+        run(testcase, validator)
+        assert run(testcase, validator).status == ExecStatus.REJECTED
+        assert validator.runs == 1
+
+    def test_timeout_is_not_cached(self, testcase):
+        validator = CountingInputValidator('a', ExecStatus.TIMEOUT)
+        run(testcase, validator)
+        run(testcase, validator)
+        assert validator.runs == 2
+
+    def test_changed_file(self, testcase):
+        validator = CountingInputValidator('a')
+        run(testcase, validator)
+        testcase.in_path.write_text('10\n')
+        run(testcase, validator)
+        assert validator.runs == 2
+
+    def test_changed_validator(self, testcase):
+        run(testcase, CountingInputValidator('a'))
+        validator = CountingInputValidator('b')
+        run(testcase, validator)
+        assert validator.runs == 1
+
+    def test_changed_flags(self, testcase):
+        validator = CountingInputValidator('a')
+        run(testcase, validator, args=['--n', '1'])
+        run(testcase, validator, args=['--n', '2'])
+        assert validator.runs == 2
+
+    def test_changed_problem_validator_flags(self, problem, testcase):
+        validator = CountingOutputValidator('a')
+        run(testcase, validator, validate.Mode.ANSWER)
+        problem.settings.validator_flags = ['float_tolerance', '1e-6']
+        run(testcase, validator, validate.Mode.ANSWER)
+        assert validator.runs == 2
+        run(testcase, validator, validate.Mode.ANSWER)
+        assert validator.runs == 2
+
+    def test_revalidate(self, testcase, monkeypatch):
+        validator = CountingInputValidator('a')
+        run(testcase, validator)
+        monkeypatch.setattr(config.args, 'revalidate', True)
+        run(testcase, validator)
+        assert validator.runs == 2
+
+    def test_constraints_are_cached(self, testcase):
+        validator = CountingInputValidator('a')
+        for _ in range(2):
+            constraints = {}
+            testcase._run_validator(
+                validator, validate.Mode.INPUT, constraints=constraints, args=[]
+            )
+            assert constraints == {'validate.cpp:1': ('n', True, False, 1, 1, 1, 10)}
+        assert validator.runs == 1
+        # Results with constraints are also used when not collecting constraints.
+        run(testcase, validator)
+        assert validator.runs == 1
+
+    def test_cached_constraints_are_merged(self, testcase):
+        validator = CountingInputValidator('a')
+        testcase._run_validator(validator, validate.Mode.INPUT, constraints={}, args=[])
+        constraints = {'validate.cpp:1': ('n', False, True, 0, 10, 1, 10)}
+        testcase._run_validator(validator, validate.Mode.INPUT, constraints=constraints, args=[])
+        assert constraints == {'validate.cpp:1': ('n', True, True, 0, 10, 1, 10)}
+
+    def test_result_without_constraints_is_rerun(self, testcase):
+        validator = CountingInputValidator('a')
+        run(testcase, validator)
+        constraints = {}
+        testcase._run_validator(validator, validate.Mode.INPUT, constraints=constraints, args=[])
+        assert validator.runs == 2
+        assert constraints